@@ -0,0 +1,492 @@
+"""
+Banc de mesure des performances du calcul sur des packs régionaux synthétiques
+
+Les packs sont générés (bench/generateur.py) dans une base PostgreSQL jetable
+(pgserver requis) ou dans des snapshots Parquet (aucune base nécessaire). Chaque
+scénario est exécuté dans un processus neuf qui mesure :
+- le nombre de requêtes envoyées à la base (total et par résultat) et leur durée cumulée,
+- la durée du calcul,
+- la mémoire maximale du processus.
+
+Scénarios :
+- epci : calcul unitaire (EPCIResultat) d'un échantillon d'EPCI,
+- epci_cache : le même calcul répété avec un CacheResultats, le second passage devant
+  être servi sans aucune requête (le scénario échoue sinon),
+- epci_partage : calculs unitaires alternant deux paramétrages sur un même pack (colonnes
+  préchargées puis complétées), comparés à un pack neuf (le scénario échoue sinon),
+- horizon : courbe horizon_curve (périodes 1 à 29) d'un échantillon d'EPCI pour deux
+  paramétrages, comparée au calcul unitaire de chaque période (le scénario échoue sinon),
+- region : calcul vectorisé (RegionResultat) des EPCI puis des ZO d'une région,
+- national : calcul de tous les lots de toutes les régions (national.calculer_lot).
+
+Les mesures peuvent être enregistrées comme référence (bench/references/<nom>.json)
+puis comparées à chaque exécution.
+
+Exemple :
+    python -m bench.banc --base snapshot --enregistrer
+    python -m bench.banc --base snapshot
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bench import generateur
+
+SCENARIOS = ("epci", "epci_cache", "epci_partage", "horizon", "region", "national")
+
+## répertoire des mesures de référence
+REPERTOIRE_REFERENCES = os.path.join(os.path.dirname(__file__), "references")
+
+
+def _calcul_epci(config):
+    from models import EPCI
+    from national import parametre_standard
+    from resultat import EPCIResultat
+
+    parametre = parametre_standard()
+    region = config["regions"][0]
+    epcis, _ = generateur.codes_region(region, config["nb_epcis"], config["nb_zos"])
+    for code in epcis[: config["echantillon"]]:
+        epci = EPCI(code, region, parametre=parametre, version=config["version"])
+        EPCIResultat(epci, periode_projection=config["periode"]).to_dict()
+    return min(config["echantillon"], len(epcis))
+
+
+def _calcul_epci_cache(config):
+    from cache import CacheResultats
+    from resultat import Resultat, profileur
+
+    # premier passage : CacheResultats rempli ; le second, sur de nouveaux Resultat,
+    # doit être entièrement servi par le cache, sans aucune requête
+    Resultat.CACHE_RESULTATS = CacheResultats()
+    try:
+        _calcul_epci(config)
+        with profileur() as profil:
+            nb_resultats = _calcul_epci(config)
+    finally:
+        Resultat.CACHE_RESULTATS = None
+    requetes = profil.statistiques()["requetes"]
+    if requetes:
+        raise RuntimeError(
+            "to_dict servi par CacheResultats : {0} requête(s) envoyée(s)".format(
+                requetes
+            )
+        )
+    return 2 * nb_resultats
+
+
+def _calcul_epci_partage(config):
+    import dataclasses
+
+    from chargement import Data
+    from models import EPCI
+    from national import parametre_standard
+    from resultat import EPCIResultat
+
+    # calculs successifs de paramétrages différents sur un même pack (colonnes préchargées
+    # puis complétées) : chacun doit donner les valeurs d'un pack neuf (le scénario échoue sinon)
+    standard = parametre_standard()
+    parametres = (
+        standard,
+        dataclasses.replace(
+            standard,
+            source_b14="Filo",
+            source_b15="Filo",
+            b13_taux_effort=25,
+            b17_motif="Env",
+            b2_scenario_omphale="PH_B",
+            b11_sa=False,
+        ),
+    )
+    standard, autre = parametres
+    region = config["regions"][0]
+    epcis, _ = generateur.codes_region(region, config["nb_epcis"], config["nb_zos"])
+    echantillon = epcis[: config["echantillon"]]
+    nb_resultats = 0
+    for x, y in zip(echantillon, echantillon[1:] + echantillon[:1]):
+        # un pack partagé par paire de territoires, calculés dans un ordre qui alterne
+        # les colonnes préchargées d'un même code
+        data = Data.ouvrir(region, config["version"])
+        for parametre, code in (
+            (standard, x),
+            (autre, x),
+            (standard, y),
+            (standard, x),
+            (autre, y),
+            (autre, x),
+        ):
+            epci = EPCI(code, region, parametre=parametre, version=config["version"])
+            partage = EPCIResultat(epci, periode_projection=config["periode"])
+            partage.data = data
+            neuf = EPCIResultat(epci, periode_projection=config["periode"])
+            neuf.data = Data.ouvrir(region, config["version"])
+            obtenu, attendu = partage.to_dict(), neuf.to_dict()
+            if obtenu != attendu:
+                raise RuntimeError(
+                    "Calcul de {0} sur un pack partagé différent : {1}".format(
+                        code,
+                        {
+                            nom: (obtenu[nom], attendu[nom])
+                            for nom in attendu
+                            if obtenu[nom] != attendu[nom]
+                        },
+                    )
+                )
+            nb_resultats += 1
+    return nb_resultats
+
+
+def _calcul_horizon(config):
+    import dataclasses
+
+    from chargement import Data
+    from models import EPCI
+    from national import parametre_standard
+    from resultat import EPCIResultat
+
+    # horizon_curve doit donner, pour chaque période, les valeurs du calcul unitaire
+    # de cette période (le scénario échoue sinon)
+    standard = parametre_standard()
+    parametres = (
+        standard,
+        dataclasses.replace(standard, b1_horizon_resorption=4, b2_tx_rs=-0.3),
+    )
+    periodes = list(range(1, 30))
+    region = config["regions"][0]
+    data = Data.ouvrir(region, config["version"])
+    epcis, _ = generateur.codes_region(region, config["nb_epcis"], config["nb_zos"])
+    nb_resultats = 0
+    for parametre in parametres:
+        for code in epcis[: config["echantillon"]]:
+            epci = EPCI(code, region, parametre=parametre, version=config["version"])
+            resultat = EPCIResultat(epci, periode_projection=config["periode"])
+            resultat.data = data
+            courbe = resultat.horizon_curve(periodes)
+            for periode in periodes:
+                unitaire = EPCIResultat(epci, periode_projection=periode)
+                unitaire.data = data
+                attendu = unitaire.to_dict()
+                obtenu = courbe.loc[periode].to_dict()
+                if obtenu != attendu:
+                    raise RuntimeError(
+                        "horizon_curve de {0} différente pour la période {1} : {2}".format(
+                            code,
+                            periode,
+                            {
+                                nom: (obtenu[nom], attendu[nom])
+                                for nom in attendu
+                                if obtenu[nom] != attendu[nom]
+                            },
+                        )
+                    )
+                nb_resultats += 1
+    return nb_resultats
+
+
+def _calcul_region(config):
+    from national import parametre_standard
+    from resultat import RegionResultat
+
+    parametre = parametre_standard()
+    nb_resultats = 0
+    for niveau in ("epci", "zo"):
+        frame = RegionResultat(
+            config["regions"][0],
+            parametre,
+            periode_projection=config["periode"],
+            version=config["version"],
+            niveau=niveau,
+        ).to_frame()
+        nb_resultats += len(frame)
+    return nb_resultats
+
+
+def _calcul_national(config):
+    from national import calculer_lot, lister_taches, parametre_standard
+
+    parametre = parametre_standard()
+    taches = lister_taches(config["regions"], config["version"])
+    return sum(
+        len(calculer_lot(tache, parametre, config["periode"])) for tache in taches
+    )
+
+
+CALCULS = {
+    "epci": _calcul_epci,
+    "epci_cache": _calcul_epci_cache,
+    "epci_partage": _calcul_epci_partage,
+    "horizon": _calcul_horizon,
+    "region": _calcul_region,
+    "national": _calcul_national,
+}
+
+
+def mesurer(scenario, config):
+    """
+    Exécute le scénario dans le processus courant et renvoie ses mesures
+    """
+    from resultat import profileur
+
+    with profileur() as profil:
+        debut = time.perf_counter()
+        nb_resultats = CALCULS[scenario](config)
+        duree = time.perf_counter() - debut
+    statistiques = profil.statistiques()
+    return {
+        "resultats": nb_resultats,
+        "requetes": statistiques["requetes"],
+        "requetes_par_resultat": statistiques["requetes"] / max(nb_resultats, 1),
+        "duree_s": duree,
+        "duree_sql_s": statistiques["duree_totale_s"],
+        # ru_maxrss est exprimé en kilo-octets sous Linux
+        "memoire_max_mo": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def executer(scenario, config, repetitions=1):
+    """
+    Exécute le scénario repetitions fois, chaque fois dans un processus neuf,
+    et renvoie les mesures (durée et mémoire médianes)
+    """
+    mesures = []
+    for _ in range(repetitions):
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executeur:
+            mesures.append(executeur.submit(mesurer, scenario, config).result())
+    resultat = dict(mesures[0])
+    for clef in ("duree_s", "memoire_max_mo"):
+        resultat[clef] = statistics.median(m[clef] for m in mesures)
+    return resultat
+
+
+def base_postgres(repertoire):
+    """
+    Démarre une base PostgreSQL jetable dans le répertoire (pgserver requis)
+    et renvoie ses paramètres de connexion sous forme de variables OTELO_DB_*
+    """
+    try:
+        import pgserver
+    except ImportError:
+        raise ImportError(
+            "Le module pgserver est nécessaire pour le banc sur PostgreSQL (sinon --base snapshot)"
+        )
+    from psycopg2.extensions import parse_dsn
+
+    serveur = pgserver.get_server(repertoire, cleanup_mode="delete")
+    parametres = parse_dsn(serveur.get_uri())
+    return serveur, {
+        "OTELO_DB_HOST": parametres.get("host", ""),
+        "OTELO_DB_DATABASE": parametres.get("dbname", "postgres"),
+        "OTELO_DB_PORT": parametres.get("port", "5432"),
+        "OTELO_DB_USER": parametres.get("user", "postgres"),
+        "OTELO_DB_PASSWORD": parametres.get("password", ""),
+    }
+
+
+def preparer_base(base, repertoire, config):
+    """
+    Génère les packs synthétiques et renvoie les variables d'environnement des processus de mesure
+    (ainsi que le serveur PostgreSQL jetable, à conserver pendant les mesures)
+    """
+    options = {
+        "version": config["version"],
+        "nb_epcis": config["nb_epcis"],
+        "nb_zos": config["nb_zos"],
+        "graine": config["graine"],
+    }
+    if base == "snapshot":
+        snapshots = os.path.join(repertoire, "snapshots")
+        generateur.generer(config["regions"], snapshots=snapshots, **options)
+        return None, {"OTELO_SNAPSHOTS": snapshots}
+    import psycopg2
+
+    serveur, variables = base_postgres(os.path.join(repertoire, "pgdata"))
+    connexion = psycopg2.connect(serveur.get_uri())
+    try:
+        generateur.generer(config["regions"], connexion=connexion, **options)
+    finally:
+        connexion.close()
+    # les processus de mesure ne doivent pas lire les snapshots éventuellement configurés
+    variables["OTELO_SNAPSHOTS"] = ""
+    return serveur, variables
+
+
+def revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fichier_reference(nom):
+    return os.path.join(REPERTOIRE_REFERENCES, nom + ".json")
+
+
+def comparer(mesures, reference, tolerance):
+    """
+    Compare les mesures à la référence et renvoie la liste des régressions
+    (durée ou mémoire au-delà de la tolérance relative, requêtes plus nombreuses)
+    """
+    regressions = []
+    for scenario, mesure in mesures.items():
+        ancienne = reference["scenarios"].get(scenario)
+        if ancienne is None:
+            continue
+        for clef in ("duree_s", "memoire_max_mo"):
+            if mesure[clef] > ancienne[clef] * (1 + tolerance):
+                regressions.append(
+                    "{0} : {1} {2:.3f} (référence {3:.3f})".format(
+                        scenario, clef, mesure[clef], ancienne[clef]
+                    )
+                )
+        if mesure["requetes_par_resultat"] > ancienne["requetes_par_resultat"]:
+            regressions.append(
+                "{0} : requetes_par_resultat {1:.2f} (référence {2:.2f})".format(
+                    scenario,
+                    mesure["requetes_par_resultat"],
+                    ancienne["requetes_par_resultat"],
+                )
+            )
+    return regressions
+
+
+def afficher(mesures, reference=None):
+    print(
+        "{0:<12} {1:>10} {2:>10} {3:>12} {4:>10} {5:>12}".format(
+            "scénario",
+            "résultats",
+            "requêtes",
+            "req/résultat",
+            "durée (s)",
+            "mémoire (Mo)",
+        )
+    )
+    for scenario, mesure in mesures.items():
+        ligne = "{0:<12} {1:>10} {2:>10} {3:>12.2f} {4:>10.3f} {5:>12.1f}".format(
+            scenario,
+            mesure["resultats"],
+            mesure["requetes"],
+            mesure["requetes_par_resultat"],
+            mesure["duree_s"],
+            mesure["memoire_max_mo"],
+        )
+        ancienne = (reference or {}).get("scenarios", {}).get(scenario)
+        if ancienne:
+            ligne += "   durée x{0:.2f} / référence {1}".format(
+                mesure["duree_s"] / max(ancienne["duree_s"], 1e-9),
+                reference.get("revision") or reference.get("date"),
+            )
+        print(ligne)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Banc de mesure des performances")
+    parser.add_argument(
+        "--base",
+        choices=("snapshot", "postgres"),
+        default="snapshot",
+        help="packs servis par des snapshots Parquet ou par une base PostgreSQL jetable (pgserver)",
+    )
+    parser.add_argument("--scenarios", nargs="*", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--regions", nargs="*", default=["11", "24", "32"])
+    parser.add_argument("--version", type=int, default=1)
+    parser.add_argument("--epcis", type=int, default=40, help="EPCI par région")
+    parser.add_argument("--zos", type=int, default=8, help="ZO par région")
+    parser.add_argument(
+        "--echantillon", type=int, default=10, help="EPCI du scénario epci"
+    )
+    parser.add_argument("--periode", type=int, default=6)
+    parser.add_argument("--graine", type=int, default=1)
+    parser.add_argument("--repetitions", type=int, default=1)
+    parser.add_argument(
+        "--reference", help="nom de la référence (défaut : nom de la base)"
+    )
+    parser.add_argument(
+        "--enregistrer",
+        action="store_true",
+        help="enregistre les mesures comme nouvelle référence",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="écart relatif de durée / mémoire toléré par rapport à la référence",
+    )
+    args = parser.parse_args(arguments)
+    config = {
+        "regions": args.regions,
+        "version": args.version,
+        "nb_epcis": args.epcis,
+        "nb_zos": args.zos,
+        "echantillon": args.echantillon,
+        "periode": args.periode,
+        "graine": args.graine,
+    }
+    nom = args.reference or args.base
+    reference = None
+    if os.path.exists(fichier_reference(nom)):
+        with open(fichier_reference(nom), "rt", encoding="utf-8") as f:
+            reference = json.load(f)
+        if reference["config"] != config:
+            print(
+                "Référence {0} ignorée : configuration différente".format(nom),
+                file=sys.stderr,
+            )
+            reference = None
+
+    with tempfile.TemporaryDirectory(prefix="otelo_banc_") as repertoire:
+        serveur, variables = preparer_base(args.base, repertoire, config)
+        # les processus de mesure (spawn) héritent de l'environnement au démarrage
+        os.environ.update(variables)
+        try:
+            mesures = {
+                scenario: executer(scenario, config, args.repetitions)
+                for scenario in args.scenarios
+            }
+        finally:
+            if serveur is not None:
+                serveur.cleanup()
+
+    afficher(mesures, reference)
+    regressions = comparer(mesures, reference, args.tolerance) if reference else []
+    for regression in regressions:
+        print("Régression " + regression, file=sys.stderr)
+
+    if args.enregistrer:
+        os.makedirs(REPERTOIRE_REFERENCES, exist_ok=True)
+        with open(fichier_reference(nom), "wt", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "revision": revision(),
+                    "python": platform.python_version(),
+                    "machine": platform.node(),
+                    "config": config,
+                    "scenarios": mesures,
+                },
+                f,
+                indent=2,
+            )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+Génération de packs régionaux synthétiques pour les mesures de performance
+
+Les tables r<region>_<feuille> (EPCI) et r<region>_<feuille>_zo (ZO) ont les colonnes
+lues par chargement.Data, remplies de valeurs aléatoires plausibles (reproductibles
+pour une même graine), avec environ 5 % de valeurs nulles.
+Les packs sont écrits dans une base PostgreSQL ou sous forme de snapshots.
+"""
+
+import random
+
+import pandas as pd
+
+from chargement import CATEGORIES_HEBERGEMENT, SCHEMAS, ecrire_snapshot
+
+## scénarios des colonnes de la feuille Omphale
+SCENARIOS_OMPHALE = ["Central_C", "Central_B", "Central_H", "PH_B", "PB_H"]
+
+## années de la feuille Omphale
+ANNEES_OMPHALE = range(2015, 2051)
+
+_FF = [
+    qualite + confort + occupation
+    for qualite in ("", "ent_", "quali_ent_")
+    for confort in (
+        "wc_",
+        "chauff_",
+        "sdb_",
+        "wc_chauff_",
+        "wc_sdb_",
+        "sdb_chauff_",
+        "3elts_",
+    )
+    for occupation in ("loc", "ppt")
+]
+
+## colonnes numériques de chaque feuille (hors Omphale)
+COLONNES = {
+    "f_synthese": ["evol_men_1217", "tx_evol_men1217"],
+    "fb1_sa_rp": ["nb_pers"],
+    "fb1_fortune_rp": ["fortune_pond"],
+    "fb1_hotel_rp": ["Nb_menages"],
+    "fb1_sa_sne": ["nb_menages"],
+    "fb1_fortune_sne": ["nb_menages_camping", "nb_menages_squat"],
+    "fb1_hotel_sne": ["nb_menages"],
+    "fb1_heberges_finess": [
+        categorie + suffixe
+        for categorie in CATEGORIES_HEBERGEMENT.values()
+        for suffixe in ("_places", "_lits")
+    ],
+    "fb1_cohab_interg_filo": ["nb_foyers_fiscaux"],
+    "fb1_heberges_sne": [
+        "nb_menages_particulier",
+        "nb_menages_gratuit",
+        "nb_menages_temp",
+    ],
+    "fb1_inadeq_fin": [
+        "nb_all_plus{0}_{1}".format(taux, type)
+        for taux in (25, 30, 35, 40)
+        for type in ("Acc", "PLP")
+    ],
+    "fb1_mv_qualite_rp": [
+        "sani_loc_nonHLM",
+        "sani_ppT",
+        "sani_chfl_loc_nonHLM",
+        "sani_chfl_ppT",
+    ],
+    "fb1_mv_qualite_filo": ["pppi_lp", "pppi_po"],
+    "fb1_mv_qualite_ff": ["pp_ss_" + variable for variable in _FF],
+    "fb1_inadeq_physique_rp": [
+        "nb_men_{0}_{1}".format(surocc, proprio)
+        for surocc in ("acc", "mod")
+        for proprio in ("ppT", "loc_nonHLM")
+    ],
+    "fb1_inadeq_physique_filo": [
+        "surocc_{0}_{1}".format(surocc, proprio)
+        for surocc in ("leg", "lourde")
+        for proprio in ("po", "lp")
+    ],
+    "fb1_parc_social_sne": [
+        "crea",
+        "crea_voisin",
+        "crea_mater",
+        "crea_services",
+        "crea_motifs",
+    ],
+    "fb2_flux_filo": [
+        "Parctot_17",
+        "txRest_parctot_1117",
+        "txDisp_parctot_1117",
+        "txRP_parctot17",
+        "txLV_parctot17",
+        "txRS_parctot17",
+    ],
+    "fb2_omphale": ["cle"] + SCENARIOS_OMPHALE,
+}
+
+
+def codes_region(region, nb_epcis, nb_zos):
+    """
+    Renvoie les codes EPCI et ZO synthétiques de la région
+    """
+    numero = int(region) if str(region).isdigit() else 0
+    epcis = [str(200000000 + numero * 10000 + i) for i in range(nb_epcis)]
+    zos = ["REG{0}_ZO{1}_zone_1".format(region, i) for i in range(nb_zos)]
+    return epcis, zos
+
+
+def _valeur(generateur, feuille, colonne, base, annee):
+    if generateur.random() < 0.05:
+        return None
+    if feuille == "fb2_omphale":
+        if colonne == "cle":
+            return 0.0 if generateur.random() < 0.5 else generateur.uniform(0.1, 1.0)
+        ecart = 1 + SCENARIOS_OMPHALE.index(colonne) * 0.1
+        return base * (1 + 0.004 * (annee - 2015) * ecart)
+    if colonne.startswith("txRP"):
+        return generateur.uniform(0.7, 0.9)
+    if colonne.startswith("tx"):
+        return generateur.uniform(0.001, 0.12)
+    if colonne == "Parctot_17":
+        return generateur.uniform(10000, 300000)
+    return round(generateur.uniform(0, 500), generateur.choice([0, 3]))
+
+
+def _table(generateur, feuille, clef, codes):
+    colonnes = COLONNES[feuille]
+    omphale = feuille == "fb2_omphale"
+    lignes = []
+    for code in codes:
+        base = generateur.uniform(20000, 200000)
+        for annee in ANNEES_OMPHALE if omphale else [None]:
+            ligne = {clef: code, "libelle": "lib " + code}
+            if omphale:
+                ligne["annee"] = annee
+            for colonne in colonnes:
+                ligne[colonne] = _valeur(generateur, feuille, colonne, base, annee)
+            lignes.append(ligne)
+    entete = [clef, "libelle"] + (["annee"] if omphale else []) + colonnes
+    table = pd.DataFrame(lignes, columns=entete)
+    table[colonnes] = table[colonnes].astype(float)
+    return table
+
+
+def tables_synthetiques(region, nb_epcis=40, nb_zos=8, graine=1):
+    """
+    Renvoie les tables synthétiques du pack régional : {feuille: (Dataframe EPCI, Dataframe ZO)}
+    """
+    generateur = random.Random("{0}-{1}".format(graine, region))
+    epcis, zos = codes_region(region, nb_epcis, nb_zos)
+    return {
+        feuille: (
+            _table(generateur, feuille, "EPCI", epcis),
+            _table(generateur, feuille, "ZO", zos),
+        )
+        for feuille in COLONNES
+    }
+
+
+def ecrire_postgres(connexion, region, tables, version=1):
+    """
+    Crée (en les remplaçant) les tables du pack régional dans la base de la connexion psycopg2
+    """
+    from psycopg2.extras import execute_values
+
+    schema = SCHEMAS[version]
+    with connexion, connexion.cursor() as curseur:
+        curseur.execute('CREATE SCHEMA IF NOT EXISTS "{0}"'.format(schema))
+        for feuille, (df, df_zo) in tables.items():
+            for suffixe, table in (("", df), ("_zo", df_zo)):
+                nom = '"{0}"."r{1}_{2}{3}"'.format(schema, region, feuille, suffixe)
+                definitions = []
+                for colonne in table.columns:
+                    if colonne in ("EPCI", "ZO", "libelle"):
+                        type = "varchar"
+                    elif colonne == "annee":
+                        type = "integer"
+                    else:
+                        type = "double precision"
+                    definitions.append('"{0}" {1}'.format(colonne, type))
+                curseur.execute("DROP TABLE IF EXISTS " + nom)
+                curseur.execute(
+                    "CREATE TABLE " + nom + " (" + ", ".join(definitions) + ")"
+                )
+                valeurs = [
+                    tuple(None if pd.isna(v) else v for v in ligne)
+                    for ligne in table.itertuples(index=False)
+                ]
+                execute_values(
+                    curseur,
+                    "INSERT INTO "
+                    + nom
+                    + " ("
+                    + ", ".join('"{0}"'.format(c) for c in table.columns)
+                    + ") VALUES %s",
+                    valeurs,
+                )
+
+
+def generer(
+    regions, version=1, nb_epcis=40, nb_zos=8, graine=1, connexion=None, snapshots=None
+):
+    """
+    Génère les packs synthétiques des régions dans la base (connexion psycopg2)
+    et / ou sous forme de snapshots (répertoire snapshots, organisé comme OTELO_SNAPSHOTS)
+    """
+    for region in regions:
+        tables = tables_synthetiques(region, nb_epcis, nb_zos, graine)
+        if connexion is not None:
+            ecrire_postgres(connexion, region, tables, version)
+        if snapshots is not None:
+            ecrire_snapshot(
+                "{0}/r{1}_v{2}".format(snapshots, region, version),
+                region,
+                version,
+                tables,
+            )
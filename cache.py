@@ -0,0 +1,126 @@
+"""
+Cache des résultats partagé entre les calculs (et les requêtes) d'un processus
+
+Les valeurs calculées par EPCIResultat / ZOResultat sont conservées sous une clef
+stable (empreinte du territoire, de la version, de la période et des paramètres),
+avec une éviction LRU, une durée de vie facultative et un stockage disque facultatif.
+
+Exemple :
+    Resultat.CACHE_RESULTATS = CacheResultats(taille_max=10000, duree_vie=3600)
+"""
+
+import collections
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+## valeur renvoyée par obtenir() pour une clef absente
+ABSENT = object()
+
+
+class CacheResultats:
+    """
+    Cache LRU borné des valeurs calculées, avec durée de vie et répertoire disque facultatifs
+    """
+
+    def __init__(self, taille_max=10000, duree_vie=None, repertoire=None):
+        """
+        taille_max : nombre maximal de valeurs conservées en mémoire
+        duree_vie : durée de validité d'une valeur en secondes (None : sans limite)
+        repertoire : répertoire où les valeurs sont aussi écrites (fichiers pickle),
+        relues après un redémarrage ou par les autres processus
+        """
+        self.taille_max = taille_max
+        self.duree_vie = duree_vie
+        self.repertoire = repertoire
+        self._valeurs = collections.OrderedDict()
+        self._verrou = threading.Lock()
+        self.succes = 0
+        self.succes_disque = 0
+        self.echecs = 0
+        self.evictions = 0
+        self.expirations = 0
+        if repertoire is not None:
+            os.makedirs(repertoire, exist_ok=True)
+
+    def _fichier(self, clef):
+        nom = hashlib.sha256(repr(clef).encode("utf-8")).hexdigest()
+        return os.path.join(self.repertoire, nom + ".pickle")
+
+    def _expiree(self, date):
+        return self.duree_vie is not None and time.time() - date > self.duree_vie
+
+    def obtenir(self, clef, defaut=ABSENT):
+        """
+        Renvoie la valeur associée à la clef, ou defaut si elle est absente ou expirée
+        """
+        with self._verrou:
+            entree = self._valeurs.get(clef)
+            if entree is not None:
+                date, valeur = entree
+                if not self._expiree(date):
+                    self._valeurs.move_to_end(clef)
+                    self.succes += 1
+                    return valeur
+                del self._valeurs[clef]
+                self.expirations += 1
+        if self.repertoire is not None:
+            try:
+                with open(self._fichier(clef), "rb") as f:
+                    date, valeur = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+            else:
+                if not self._expiree(date):
+                    with self._verrou:
+                        self.succes_disque += 1
+                    self._memoriser(clef, date, valeur)
+                    return valeur
+        with self._verrou:
+            self.echecs += 1
+        return defaut
+
+    def enregistrer(self, clef, valeur):
+        """
+        Associe la valeur à la clef (et l'écrit dans le répertoire disque s'il est défini)
+        """
+        date = time.time()
+        self._memoriser(clef, date, valeur)
+        if self.repertoire is not None:
+            fichier = self._fichier(clef)
+            fichier_tmp = fichier + ".{0}.tmp".format(os.getpid())
+            with open(fichier_tmp, "wb") as f:
+                pickle.dump((date, valeur), f)
+            os.replace(fichier_tmp, fichier)
+
+    def _memoriser(self, clef, date, valeur):
+        with self._verrou:
+            self._valeurs[clef] = (date, valeur)
+            self._valeurs.move_to_end(clef)
+            while len(self._valeurs) > self.taille_max:
+                self._valeurs.popitem(last=False)
+                self.evictions += 1
+
+    def vider(self):
+        """
+        Vide le cache en mémoire (le répertoire disque n'est pas effacé)
+        """
+        with self._verrou:
+            self._valeurs.clear()
+
+    def __len__(self):
+        return len(self._valeurs)
+
+    @property
+    def statistiques(self):
+        return {
+            "taille": len(self._valeurs),
+            "taille_max": self.taille_max,
+            "succes": self.succes,
+            "succes_disque": self.succes_disque,
+            "echecs": self.echecs,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
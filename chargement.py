@@ -1,20 +1,130 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import threading
 from functools import cached_property
-from pg.pgutils import PGScript
+from pg.pgasync import PoolAsync
+from pg.pgutils import PGScript, PoolConnexions, identifiant
 import environ
+import numpy as np
+import pandas as pd
 
 # Lecture .env
 env = environ.Env()
 environ.Env.read_env()
 
 
+## paramètres facultatifs : un calcul sur snapshots (OTELO_SNAPSHOTS) n'a pas besoin de la base
 OTELO_DATA_DB = (
-    env("OTELO_DB_HOST"),
-    env("OTELO_DB_DATABASE"),
-    env("OTELO_DB_PORT"),
-    env("OTELO_DB_USER"),
-    env("OTELO_DB_PASSWORD"),
+    env("OTELO_DB_HOST", default=None),
+    env("OTELO_DB_DATABASE", default=None),
+    env("OTELO_DB_PORT", default=None),
+    env("OTELO_DB_USER", default=None),
+    env("OTELO_DB_PASSWORD", default=None),
 )
 
+## taille du pool de connexions partagé par toutes les feuilles du processus
+OTELO_DATA_POOL = {
+    "min_connexions": env.int("OTELO_DB_POOL_MIN", default=1),
+    "max_connexions": env.int("OTELO_DB_POOL_MAX", default=5),
+}
+
+
+def arrondi(valeur, decimales=None):
+    """
+    round() qui accepte aussi un tableau numpy de valeurs.
+    Pour un tableau, l'arrondi donne exactement les mêmes valeurs que round() appliqué
+    à chaque élément (arrondi au pair le plus proche), afin que le calcul vectorisé
+    soit identique au calcul unitaire.
+    """
+    if isinstance(valeur, np.ndarray):
+        if decimales is None:
+            return np.rint(valeur)
+        return np.array([round(v, decimales) for v in valeur.tolist()], dtype=float)
+    return round(valeur, decimales)
+
+
+def puissance(base, exposant):
+    """
+    base ** exposant qui accepte aussi des tableaux numpy (calculé élément par élément
+    en Python, pour les mêmes raisons que arrondi)
+    """
+    if isinstance(base, np.ndarray) or isinstance(exposant, np.ndarray):
+        base, exposant = np.broadcast_arrays(base, exposant)
+        return np.array(
+            [b**e for b, e in zip(base.tolist(), exposant.tolist())], dtype=float
+        )
+    return base**exposant
+
+
+## répertoire des snapshots des packs régionaux (r<region>_v<version>), utilisés à la place de la base
+OTELO_SNAPSHOTS = env("OTELO_SNAPSHOTS", default=None)
+
+## version du format des snapshots
+FORMAT_SNAPSHOT = 1
+
+
+def empreinte_fichier(fichier):
+    """
+    Renvoie l'empreinte sha256 du contenu du fichier
+    """
+    empreinte = hashlib.sha256()
+    with open(fichier, "rb") as f:
+        for bloc in iter(lambda: f.read(1 << 20), b""):
+            empreinte.update(bloc)
+    return empreinte.hexdigest()
+
+
+def ecrire_snapshot(chemin, region, version, tables):
+    """
+    Écrit un snapshot de pack régional dans le répertoire chemin
+    tables : {feuille: (Dataframe à l'EPCI, Dataframe à la ZO)}
+    Renvoie le manifeste.
+    """
+    os.makedirs(chemin, exist_ok=True)
+    fichiers = {}
+    for nom, (df, df_zo) in tables.items():
+        for fichier, table in ((nom, df), (nom + "_zo", df_zo)):
+            if not isinstance(table, pd.DataFrame):
+                raise ValueError("Lecture impossible de la table " + fichier)
+            fichier += ".parquet"
+            table.to_parquet(os.path.join(chemin, fichier), index=False)
+            fichiers[fichier] = empreinte_fichier(os.path.join(chemin, fichier))
+    manifeste = {
+        "format": FORMAT_SNAPSHOT,
+        "region": region,
+        "version": version,
+        "schema": SCHEMAS[version],
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "fichiers": fichiers,
+        "empreinte": hashlib.sha256(
+            json.dumps(fichiers, sort_keys=True).encode("utf-8")
+        ).hexdigest(),
+    }
+    with open(os.path.join(chemin, "snapshot.json"), "wt", encoding="utf-8") as f:
+        json.dump(manifeste, f, indent=2)
+    return manifeste
+
+
+def pool_donnees():
+    """
+    Renvoie le pool de connexions du processus vers la base des données Otelo
+    """
+    return PoolConnexions.partage(*OTELO_DATA_DB, **OTELO_DATA_POOL)
+
+
+def pool_donnees_async():
+    """
+    Renvoie le pool de connexions asynchrones de la boucle courante vers la base des données Otelo
+    """
+    return PoolAsync.partage(*OTELO_DATA_DB, **OTELO_DATA_POOL)
+
+
+## schéma des packs de données selon la version
+SCHEMAS = {1: "public", 2: "v2024"}
+
 CATEGORIES_HEBERGEMENT = {
     "1": "Aire Station Nomades",
     "2": "Autre Ctre.Accueil",
@@ -57,13 +167,167 @@ class Data:
         "fb2_flux_filo",
     ]
 
-    def __init__(self, region, version=1):
+    ## packs lus dans OTELO_SNAPSHOTS, partagés par tous les calculs du processus
+    _SNAPSHOTS = {}
+    _VERROU_SNAPSHOTS = threading.Lock()
+
+    def __init__(self, region, version=1, pool=None, precharge=False):
+        """
+        pool : PoolConnexions utilisé par les feuilles, par défaut le pool partagé du processus
+        precharge : si True, chaque feuille (EPCI et ZO) est chargée une seule fois en mémoire
+        et toutes les valeurs sont ensuite servies sans requête
+        """
         self.region = region
         self.version = version
-        for feuille in self.FEUILLES:
-            setattr(
-                self, feuille, Feuille("r{0}_{1}".format(self.region, feuille), version)
+        self.precharge = precharge
+        self.pool = pool if pool is not None else pool_donnees()
+        self.snapshot = None
+        self.entrepot = None
+
+    def __getattr__(self, nom):
+        """
+        Crée la feuille demandée au premier accès : seules les feuilles utilisées par le calcul sont construites
+        """
+        if nom not in self.FEUILLES:
+            raise AttributeError(nom)
+        feuille = Feuille(
+            "r{0}_{1}".format(self.region, nom),
+            self.version,
+            self.pool,
+            precharge=self.precharge,
+        )
+        feuille.pack = self
+        if self.snapshot is not None:
+            feuille.charger_snapshot(self.snapshot, nom)
+        elif self.entrepot is not None:
+            feuille.attacher(self.entrepot.table(self.region, self.version, nom))
+        return self.__dict__.setdefault(nom, feuille)
+
+    @classmethod
+    def ouvrir(cls, region, version=1, precharge=False):
+        """
+        Renvoie le pack régional, lu dans son snapshot s'il existe dans OTELO_SNAPSHOTS,
+        dans la base de données sinon
+        """
+        chemin = cls.chemin_snapshot(region, version)
+        manifeste = None if chemin is None else os.path.join(chemin, "snapshot.json")
+        if manifeste is None or not os.path.exists(manifeste):
+            return cls(region, version, precharge=precharge)
+        # un snapshot n'est lu qu'une fois par processus (tant que son manifeste est inchangé)
+        clef = (chemin, os.path.getmtime(manifeste))
+        with cls._VERROU_SNAPSHOTS:
+            if clef not in cls._SNAPSHOTS:
+                cls._SNAPSHOTS[clef] = cls.from_snapshot(chemin)
+            return cls._SNAPSHOTS[clef]
+
+    @staticmethod
+    def chemin_snapshot(region, version=1):
+        """
+        Renvoie le répertoire du snapshot de la région dans OTELO_SNAPSHOTS (None si non défini)
+        """
+        if not OTELO_SNAPSHOTS:
+            return None
+        return os.path.join(OTELO_SNAPSHOTS, "r{0}_v{1}".format(region, version))
+
+    def export_snapshot(self, chemin):
+        """
+        Écrit toutes les feuilles du pack (EPCI et ZO) dans le répertoire chemin :
+        un fichier Parquet par table et un manifeste snapshot.json (région, version,
+        empreinte sha256 de chaque fichier). pyarrow est nécessaire.
+        Renvoie le manifeste.
+        """
+        tables = {}
+        for nom in self.FEUILLES:
+            feuille = getattr(self, nom)
+            tables[nom] = (feuille.df, feuille.df_zo)
+        return ecrire_snapshot(chemin, self.region, self.version, tables)
+
+    @classmethod
+    def from_snapshot(cls, chemin, verifier=True):
+        """
+        Renvoie le pack régional lu dans un snapshot écrit par export_snapshot, sans accès à la base.
+        Les feuilles sont lues (fichiers projetés en mémoire) à leur premier accès.
+        verifier : contrôle l'empreinte de chaque fichier du snapshot
+        """
+        with open(os.path.join(chemin, "snapshot.json"), "rt", encoding="utf-8") as f:
+            manifeste = json.load(f)
+        if manifeste.get("format") != FORMAT_SNAPSHOT:
+            raise ValueError(
+                "Format de snapshot non pris en charge : "
+                + str(manifeste.get("format"))
+            )
+        if verifier:
+            for fichier, empreinte in manifeste["fichiers"].items():
+                if empreinte_fichier(os.path.join(chemin, fichier)) != empreinte:
+                    raise ValueError("Fichier du snapshot modifié : " + fichier)
+        data = cls(manifeste["region"], manifeste["version"], precharge=True)
+        data.snapshot = chemin
+        data.manifeste = manifeste
+        return data
+
+    @classmethod
+    def regions(cls, version=1, pool=None):
+        """
+        Renvoie la liste des codes des régions dont le pack de données est présent en base,
+        ou dans OTELO_SNAPSHOTS s'il contient des snapshots de cette version
+        """
+        if OTELO_SNAPSHOTS and os.path.isdir(OTELO_SNAPSHOTS):
+            suffixe = "_v" + str(version)
+            regions = sorted(
+                nom[1 : -len(suffixe)]
+                for nom in os.listdir(OTELO_SNAPSHOTS)
+                if nom.startswith("r")
+                and nom.endswith(suffixe)
+                and os.path.exists(os.path.join(OTELO_SNAPSHOTS, nom, "snapshot.json"))
             )
+            if regions:
+                return regions
+        pg = PGScript(
+            *OTELO_DATA_DB,
+            log=False,
+            pool=pool if pool is not None else pool_donnees(),
+        )
+        suffixe = "_fb1_sa_rp"
+        return sorted(
+            table[1 : -len(suffixe)]
+            for table in pg.lister_tables(SCHEMAS[version])
+            if table.startswith("r") and table.endswith(suffixe)
+        )
+
+    async def charger_async(self, codes):
+        """
+        Charge simultanément (accès asynchrones) les lignes de toutes les feuilles pour les codes indiqués.
+        Les valeurs de ces territoires sont ensuite servies depuis la mémoire.
+        """
+        await asyncio.gather(
+            self.charger_territoires_async(),
+            *(getattr(self, feuille).charger_async(codes) for feuille in self.FEUILLES),
+        )
+
+    async def charger_territoires_async(self, pool=None):
+        """
+        Lit (accès asynchrones) le registre des territoires du pack s'il n'est pas encore connu
+        """
+        if "territoires" not in self.__dict__:
+            self.__dict__["territoires"] = await Territoires.partage_async(self, pool)
+
+    def precharger(self, colonnes, codes):
+        """
+        Charge en mémoire les seules colonnes lues pour les codes indiqués, avec une requête
+        projetée par feuille (et par niveau EPCI / ZO) au plus.
+        colonnes : {feuille: [colonnes]}, par exemple Plan.colonnes()
+        Les valeurs de ces colonnes pour ces territoires sont ensuite servies depuis la mémoire.
+        """
+        for nom, colonnes_feuille in colonnes.items():
+            getattr(self, nom).precharger(colonnes_feuille, codes)
+
+    @cached_property
+    def territoires(self):
+        """
+        Registre des EPCI et ZO du pack, partagé par ses feuilles (et par les packs
+        de la même région lus à la même source, ou dans la même base, dans le processus)
+        """
+        return Territoires.partage(self)
 
     def epcis(self):
         """
@@ -213,7 +477,7 @@ class Data:
         an_N1 = an_N0 + periode
         val_N1 = self.fb2_omphale.valeur_omphale(scenario, code, an_N1)
         val_N0 = self.fb2_omphale.valeur_omphale(scenario, code, an_N0)
-        return round(val_N1 - val_N0)
+        return arrondi(val_N1 - val_N0)
 
     def epci_moins_50k(
         self,
@@ -235,6 +499,11 @@ class Data:
         an_N1 = an_N0 + periode
         val_N1 = self.fb2_omphale.valeur_omphale(scenario, code, an_N1)
         val_N0 = self.fb2_omphale.valeur_omphale(scenario, code, an_N0)
+        if isinstance(val_N0, np.ndarray) or isinstance(val_N1, np.ndarray):
+            val_N0, val_N1 = np.broadcast_arrays(val_N0, val_N1)
+            nul = val_N0 == 0
+            tx = puissance(val_N1 / np.where(nul, 1.0, val_N0), 1 / periode) - 1.0
+            return np.where(nul, 0, arrondi(tx, 10))
         if val_N0 == 0:
             return 0
         tx = ((val_N1 / val_N0) ** (1 / periode)) - 1.0
@@ -242,16 +511,16 @@ class Data:
 
     def b2_chronique_omphale(self, code, scenario, annee_finale):
         x = list(range(2017, annee_finale))
-        y = []
-        for an in x:
-            y.append(self.fb2_omphale.valeur_omphale(scenario, code, an))
+        y = self.fb2_omphale.valeur_omphale(scenario, code, np.array(x)).tolist()
         return x, y
 
     def b2_taux_restruc_an(self, code):
-        return (1.0 + self.fb2_flux_filo.taux("restruc", code)) ** (1.0 / 6.0) - 1.0
+        return (
+            puissance(1.0 + self.fb2_flux_filo.taux("restruc", code), 1.0 / 6.0) - 1.0
+        )
 
     def b2_taux_disp_an(self, code):
-        return (1.0 + self.fb2_flux_filo.taux("disp", code)) ** (1.0 / 6.0) - 1.0
+        return puissance(1.0 + self.fb2_flux_filo.taux("disp", code), 1.0 / 6.0) - 1.0
 
     def b2_taux_lv(self, code):
         return self.fb2_flux_filo.taux("lv", code)
@@ -263,22 +532,190 @@ class Data:
         return self.fb2_flux_filo.taux("rp", code)
 
     def evolution_menages(self, code):
-        return round(self.f_synthese.valeur("evol_men_1217", code))
+        return arrondi(self.f_synthese.valeur("evol_men_1217", code))
 
     def taux_evolution_annuel_menages(self, code):
-        return round(self.f_synthese.valeur("tx_evol_men1217", code), 10)
+        return arrondi(self.f_synthese.valeur("tx_evol_men1217", code), 10)
 
 
 class Feuille(PGScript):
-    def __init__(self, nom_table, version=1):
-        super().__init__(*OTELO_DATA_DB, log=False)
-        if version == 1:
-            self.schema = "public"
-        elif version == 2:
-            self.schema = "v2024"
+
+    REQUETES_PREPAREES = frozenset(
+        {
+            "get_val_epci",
+            "get_val_zo",
+            "get_vals_epci",
+            "get_vals_zo",
+            "get_vals_omphale_epci",
+            "get_vals_omphale_zo",
+            "get_lignes_epci",
+            "get_lignes_zo",
+            "get_colonnes_epci",
+            "get_colonnes_zo",
+        }
+    )
+
+    def __init__(self, nom_table, version=1, pool=None, precharge=False):
+        super().__init__(
+            *OTELO_DATA_DB, log=False, pool=pool if pool is not None else pool_donnees()
+        )
+        self.schema = SCHEMAS[version]
         self.table = nom_table
-        self.nom_table = self.schema + "." + nom_table
-        self.nom_table_zo = self.schema + "." + nom_table + "_zo"
+        self.nom_table = identifiant(self.schema) + "." + identifiant(nom_table)
+        self.nom_table_zo = (
+            identifiant(self.schema) + "." + identifiant(nom_table + "_zo")
+        )
+        self.precharge = precharge
+        ## pack régional (Data) de la feuille, dont le registre des territoires est utilisé
+        self.pack = None
+        self._memoire = None
+        self._series_omphale = {}
+
+    @property
+    def memoire(self):
+        """
+        Renvoie la TableMemoire de la feuille (chargée au premier appel en mode préchargé),
+        ou None si les valeurs doivent être lues dans la base de données
+        """
+        if self.precharge and (self._memoire is None or not self._memoire.complete):
+            self._memoire = self.charger_memoire()
+        return self._memoire
+
+    def _memoire_pour(self, code, colonnes=None):
+        """
+        Renvoie la TableMemoire si elle contient le (ou les) code(s) et les colonnes
+        (toutes les colonnes si colonnes vaut None), None sinon
+        """
+        memoire = self.memoire
+        if memoire is not None and memoire.couvre(code, colonnes):
+            return memoire
+        return None
+
+    def serie_omphale(self, code):
+        """
+        Renvoie la TableMemoire des lignes Omphale du code (toutes les années, toutes les colonnes),
+        lue en une seule requête puis conservée pour les appels suivants
+        """
+        if code not in self._series_omphale:
+            if self.territoires.est_epci(code):
+                df = self.get_lignes_epci(self.nom_table, parametres=([code],))
+                df_zo = pd.DataFrame(columns=["ZO"])
+            else:
+                df = pd.DataFrame(columns=["EPCI"])
+                df_zo = self.get_lignes_zo(self.nom_table_zo, parametres=([code],))
+            if not isinstance(df, pd.DataFrame) or not isinstance(df_zo, pd.DataFrame):
+                print("-", "lecture Omphale impossible pour", code)
+                df, df_zo = pd.DataFrame(columns=["EPCI"]), pd.DataFrame(columns=["ZO"])
+            self._series_omphale[code] = TableMemoire.from_dataframes(
+                df, df_zo, codes=[code]
+            )
+        return self._series_omphale[code]
+
+    async def charger_async(self, codes, pool=None):
+        """
+        Charge en mémoire (accès asynchrones) les lignes EPCI et ZO de la feuille pour les codes indiqués
+        """
+        pool = pool if pool is not None else pool_donnees_async()
+        codes = list(codes)
+        df, df_zo = await asyncio.gather(
+            pool.dataframe(
+                self.requete_sql["get_lignes_epci"].format(self.nom_table), codes
+            ),
+            pool.dataframe(
+                self.requete_sql["get_lignes_zo"].format(self.nom_table_zo), codes
+            ),
+        )
+        memoire = TableMemoire.from_dataframes(df, df_zo, codes=codes)
+        if self._memoire is not None:
+            memoire = self._memoire.fusion(memoire)
+        self._memoire = memoire
+
+    def precharger(self, colonnes, codes):
+        """
+        Charge en mémoire les seules colonnes indiquées pour les codes (toutes les années
+        pour Omphale), avec une requête projetée par niveau (EPCI, ZO) au plus.
+        Les valeurs de ces colonnes pour ces codes sont ensuite servies depuis la mémoire.
+        """
+        if self.precharge:
+            return
+        colonnes = list(dict.fromkeys(colonnes))
+        codes = list(dict.fromkeys(codes))
+        if not colonnes or not codes:
+            return
+        if self._memoire is not None and self._memoire.couvre(
+            np.asarray(codes, dtype=object), colonnes
+        ):
+            return
+        # seules les colonnes présentes dans la table sont lues (les autres valent 0.0)
+        existantes = list(self.catalogue.selection(colonnes))
+        if not existantes:
+            return
+        lues = (["annee"] if "omphale" in self.nom_table else []) + existantes
+        selection = ", ".join(identifiant(nom) for nom in lues)
+        est_epci = self.territoires.est_epci
+        epcis = [c for c in codes if est_epci(c)]
+        zos = [c for c in codes if not est_epci(c)]
+        df = pd.DataFrame(columns=["EPCI"])
+        df_zo = pd.DataFrame(columns=["ZO"])
+        if epcis:
+            df = self.get_colonnes_epci(selection, self.nom_table, parametres=(epcis,))
+        if zos:
+            df_zo = self.get_colonnes_zo(
+                selection, self.nom_table_zo, parametres=(zos,)
+            )
+        if not isinstance(df, pd.DataFrame) or not isinstance(df_zo, pd.DataFrame):
+            # les valeurs restent lues une à une dans la base
+            print("-", "préchargement impossible pour", self.table)
+            return
+        memoire = TableMemoire.from_dataframes(
+            df, df_zo, codes=codes, projection=colonnes
+        )
+        if self._memoire is not None:
+            memoire = self._memoire.fusion(memoire)
+        self._memoire = memoire
+
+    def charger_snapshot(self, chemin, nom):
+        """
+        Charge la feuille depuis les fichiers Parquet d'un snapshot (lecture projetée en mémoire)
+        """
+        self.df = pd.read_parquet(
+            os.path.join(chemin, nom + ".parquet"), memory_map=True
+        )
+        self.df_zo = pd.read_parquet(
+            os.path.join(chemin, nom + "_zo.parquet"), memory_map=True
+        )
+        self.precharge = True
+        self._memoire = TableMemoire.from_dataframes(self.df, self.df_zo)
+
+    def attacher(self, memoire):
+        """
+        Sert la feuille depuis une TableMemoire complète déjà chargée (entrepôt partagé)
+        """
+        self.precharge = True
+        self._memoire = memoire
+
+    def charger_memoire(self):
+        """
+        Charge l'intégralité de la feuille (EPCI et ZO) dans une TableMemoire
+        """
+        order_by = ", annee" if "omphale" in self.nom_table else ""
+        return TableMemoire.from_dataframes(
+            self.get_table_epci(self.nom_table, order_by),
+            self.get_table_zo(self.nom_table_zo, order_by),
+        )
+
+    def exporter_table(self, fichier, niveau="epci", **options):
+        """
+        Écrit la table de la feuille (niveau "epci" ou "zo") dans fichier (CSV, ou Parquet
+        si son extension est .parquet) par lots lus dans un curseur côté serveur, sans
+        la charger en mémoire (voir PGScript.exporter). Renvoie le nombre de lignes écrites.
+        """
+        order_by = ", annee" if "omphale" in self.nom_table else ""
+        if niveau == "epci":
+            sql = self.requete_sql["get_table_epci"].format(self.nom_table, order_by)
+        else:
+            sql = self.requete_sql["get_table_zo"].format(self.nom_table_zo, order_by)
+        return self.exporter(sql, fichier, **options)
 
     @cached_property
     def df(self):
@@ -303,6 +740,8 @@ class Feuille(PGScript):
         """
         Renvoie la liste des EPCI de la feuille
         """
+        if self.memoire is not None and self.memoire.complete:
+            return self.memoire.epcis
         toto = self.get_epcis(self.nom_table)
         return toto
 
@@ -311,17 +750,115 @@ class Feuille(PGScript):
         """
         Renvoie la liste des ZO de la feuille
         """
+        if self.memoire is not None and self.memoire.complete:
+            return self.memoire.zos
         return self.get_zos(self.nom_table_zo)
 
+    @cached_property
+    def territoires(self):
+        """
+        Registre des territoires : celui du pack régional, ou à défaut un registre
+        des EPCI de la feuille (tout autre code étant traité comme une ZO)
+        """
+        if self.pack is not None:
+            return self.pack.territoires
+        return Territoires(self.epcis, [])
+
+    def _valeurs_groupees(self, expression, codes, annees=None):
+        """
+        Renvoie le tableau des valeurs de l'expression SQL pour chaque code (et chaque année
+        pour Omphale, codes et annees étant alors des listes de même longueur)
+        avec une requête par niveau (EPCI, ZO) au plus
+        Comme pour valeur(), une valeur absente, nulle ou non numérique est renvoyée à 0.0
+        """
+        est_epci = self.territoires.est_epci
+        niveaux = (
+            ("epci", self.nom_table, [c for c in codes if est_epci(c)]),
+            ("zo", self.nom_table_zo, [c for c in codes if not est_epci(c)]),
+        )
+        cles = ["code"] if annees is None else ["code", "annee"]
+        frames = []
+        for niveau, table, codes_niveau in niveaux:
+            if not codes_niveau:
+                continue
+            codes_niveau = list(dict.fromkeys(codes_niveau))
+            if annees is None:
+                requete = getattr(self, "get_vals_" + niveau)
+                parametres = (codes_niveau,)
+            else:
+                requete = getattr(self, "get_vals_omphale_" + niveau)
+                parametres = (codes_niveau, [int(a) for a in dict.fromkeys(annees)])
+            df = requete(expression, table, parametres=parametres)
+            if isinstance(df, pd.DataFrame):
+                frames.append(df)
+        if not frames:
+            return np.zeros(len(codes))
+        df = pd.concat(frames, ignore_index=True)
+        serie = pd.Series(
+            pd.to_numeric(df["valeur"], errors="coerce").to_numpy(
+                dtype=float, na_value=np.nan
+            ),
+            index=pd.MultiIndex.from_frame(df[cles]) if annees else df["code"],
+        )
+        # un code présent sur plusieurs lignes renvoie 0.0, comme valeur()
+        serie = serie[~serie.index.duplicated(keep=False)]
+        cible = pd.MultiIndex.from_arrays([codes, annees]) if annees else codes
+        return serie.reindex(cible).fillna(0.0).to_numpy()
+
+    def valeurs(self, nom_col, codes):
+        """
+        Renvoie les valeurs de la colonne pour plusieurs codes (une requête par niveau EPCI / ZO)
+        sous forme de Series indexée par code, à 0.0 pour un code absent ou une valeur nulle
+        """
+        codes = list(codes)
+        memoire = self._memoire_pour(np.asarray(codes, dtype=object), [nom_col])
+        if memoire is not None:
+            valeurs = memoire.valeurs(nom_col, codes, territoires=self.territoires)
+        else:
+            valeurs = self._valeurs_groupees(identifiant(nom_col), codes)
+        return pd.Series(valeurs, index=pd.Index(codes, name="code"), name=nom_col)
+
+    def valeurs_omphale(self, nom_col, codes, annees):
+        """
+        Renvoie les valeurs de la colonne Omphale pour plusieurs codes et une ou plusieurs années
+        sous forme de Series indexée par (code, annee), à 0.0 pour une ligne absente ou une valeur nulle
+        """
+        annees = [annees] if np.isscalar(annees) else list(annees)
+        index = pd.MultiIndex.from_product(
+            [list(codes), [int(a) for a in annees]], names=["code", "annee"]
+        )
+        codes_lignes = list(index.get_level_values("code"))
+        annees_lignes = list(index.get_level_values("annee"))
+        memoire = self._memoire_pour(np.asarray(codes_lignes, dtype=object), [nom_col])
+        if memoire is not None:
+            valeurs = memoire.valeurs(
+                nom_col, codes_lignes, annees_lignes, territoires=self.territoires
+            )
+        else:
+            valeurs = self._valeurs_groupees(
+                identifiant(nom_col), codes_lignes, annees_lignes
+            )
+        return pd.Series(valeurs, index=index, name=nom_col)
+
     def valeur(self, nom_col, code):
         """
         Recupère la valeur de la colonne pour le code correspondant dans la base de données
+        code peut être un tableau numpy de codes, le résultat est alors un tableau
         """
+        memoire = self._memoire_pour(code, [nom_col])
+        if memoire is not None:
+            return memoire.valeur(nom_col, code, territoires=self.territoires)
+        if isinstance(code, np.ndarray):
+            return self.valeurs(nom_col, code).to_numpy()
         try:
-            if code in self.epcis:
-                val = self.get_val_epci(nom_col, self.nom_table, code)
+            if self.territoires.est_epci(code):
+                val = self.get_val_epci(
+                    identifiant(nom_col), self.nom_table, parametres=(code,)
+                )
             else:
-                val = self.get_val_zo(nom_col, self.nom_table_zo, code)
+                val = self.get_val_zo(
+                    identifiant(nom_col), self.nom_table_zo, parametres=(code,)
+                )
             return float(val)
         except ValueError as e:
             return 0.0
@@ -331,38 +868,49 @@ class Feuille(PGScript):
     def valeur_omphale(self, nom_col, code, annee):
         """
         Recupère la valeur de la colonne pour le code correspondant dans la table Omphale
+        annee peut être un tableau numpy d'années (chronique), lues dans la série du code
         """
-        try:
-            if code in self.epcis:
-                val = self.get_val_omphale_epci(nom_col, self.nom_table, code, annee)
-            else:
-                val = self.get_val_omphale_zo(nom_col, self.nom_table_zo, code, annee)
-            return float(val)
-        except ValueError as e:
-            return 0.0
-        except Exception as e:
-            print("-", e)
-            return 0.0
+        memoire = self._memoire_pour(code, [nom_col])
+        if memoire is None and not isinstance(code, np.ndarray):
+            memoire = self.serie_omphale(code)
+        if memoire is not None:
+            return memoire.valeur(nom_col, code, annee, territoires=self.territoires)
+        codes, annees = np.broadcast_arrays(
+            np.asarray(code, dtype=object), np.asarray(annee, dtype=object)
+        )
+        return self._valeurs_groupees(
+            identifiant(nom_col), codes.tolist(), annees.tolist()
+        )
+
+    @cached_property
+    def catalogue(self):
+        """
+        Renvoie le catalogue des colonnes de la feuille (partagé par les feuilles du processus
+        qui lisent la même table dans la même base)
+        """
+        return CatalogueColonnes.partage(self)
 
     def valeur_somme_colonnes(self, colonnes, code, start_expression=None):
-        if not start_expression:
-            champs_sum = [
-                'COALESCE("' + champ[1] + '", 0) '
-                for champ in self.lister_champs(self.schema, self.table)
-                if champ[1] in colonnes
-            ]
-        else:
-            champs_sum = [
-                'COALESCE("' + champ[1] + '", 0) '
-                for champ in self.lister_champs(self.schema, self.table)
-                if champ[1].startswith(start_expression)
-            ]
-        nom_col = " + ".join(champs_sum)
+        memoire = self._memoire_pour(code, None if start_expression else colonnes)
+        if memoire is None and start_expression and self.memoire is not None:
+            # colonnes du préfixe, pour une table projetée
+            colonnes = self.catalogue.selection(None, start_expression)
+            start_expression = None
+            memoire = self._memoire_pour(code, colonnes)
+        if memoire is not None:
+            if start_expression:
+                colonnes = [
+                    c for c in memoire.noms_colonnes if c.startswith(start_expression)
+                ]
+            return memoire.somme(colonnes, code, territoires=self.territoires)
+        nom_col = self.catalogue.expression_somme(colonnes, start_expression)
+        if isinstance(code, np.ndarray):
+            return self._valeurs_groupees(nom_col, code.tolist())
         try:
-            if code in self.epcis:
-                val = self.get_expr_epci(nom_col, self.nom_table, code)
+            if self.territoires.est_epci(code):
+                val = self.get_val_epci(nom_col, self.nom_table, parametres=(code,))
             else:
-                val = self.get_expr_zo(nom_col, self.nom_table_zo, code)
+                val = self.get_val_zo(nom_col, self.nom_table_zo, parametres=(code,))
             return float(val)
         except ValueError as e:
             return 0.0
@@ -390,3 +938,565 @@ class Feuille(PGScript):
             return self.valeur("txRS_parctot17", code)
         else:
             return None
+
+
+class Territoires:
+    """
+    Registre des territoires d'un pack régional, lus une seule fois (codes de toutes les feuilles)
+
+    Chaque code reçoit un identifiant entier dense : 0 à n-1 pour les EPCI, puis n à n+m-1
+    pour les ZO. Un code inconnu a l'identifiant -1 et est traité comme une ZO, comme
+    le faisaient les feuilles. Les identifiants servent d'indices de ligne aux TableMemoire.
+    """
+
+    ## registres partagés, par (source des données, région, version) : snapshot, entrepôt
+    ## ou chaîne de connexion de la base lue (voir PoolConnexions.dsn)
+    _REGISTRES = {}
+    _VERROU = threading.Lock()
+    ## nombre de tableaux de codes dont les identifiants sont conservés
+    TAILLE_CACHE_IDS = 16
+
+    def __init__(self, epcis, zos):
+        self.epcis = list(dict.fromkeys(epcis))
+        self.zos = [code for code in dict.fromkeys(zos) if code not in self.epcis]
+        self.nb_epcis = len(self.epcis)
+        self._ids = {code: numero for numero, code in enumerate(self.epcis + self.zos)}
+        self._cache_ids = {}
+        self._verrou = threading.Lock()
+
+    @staticmethod
+    def _source(data):
+        """
+        Renvoie la source des données du pack (snapshot, entrepôt), None pour une base de données
+        """
+        if data.snapshot is not None:
+            return data.snapshot
+        if data.entrepot is not None:
+            return data.entrepot.chemin
+        return None
+
+    @classmethod
+    def _registre(cls, clef):
+        with cls._VERROU:
+            return cls._REGISTRES.get(clef)
+
+    @classmethod
+    def _conserver(cls, clef, registre):
+        with cls._VERROU:
+            return cls._REGISTRES.setdefault(clef, registre)
+
+    @staticmethod
+    def _unions(data):
+        """
+        Renvoie les unions des codes EPCI et des codes ZO de toutes les feuilles du pack
+        (arguments des requêtes get_epcis_pack et get_zos_pack)
+        """
+        feuilles = [getattr(data, nom) for nom in data.FEUILLES]
+        codes_table = feuilles[0].requete_sql["codes_table"].strip()
+        return tuple(
+            " UNION ALL ".join(
+                codes_table.format(
+                    identifiant(colonne),
+                    feuille.nom_table if colonne == "EPCI" else feuille.nom_table_zo,
+                )
+                for feuille in feuilles
+            )
+            for colonne in ("EPCI", "ZO")
+        )
+
+    @classmethod
+    def _codes(cls, data):
+        """
+        Renvoie les codes EPCI et ZO présents dans au moins une feuille du pack
+        (None, None si la lecture a échoué)
+        """
+        if cls._source(data) is not None or data.precharge:
+            # feuilles en mémoire
+            feuilles = [getattr(data, nom) for nom in data.FEUILLES]
+            epcis = [feuille.epcis for feuille in feuilles]
+            zos = [feuille.zos for feuille in feuilles]
+            if not all(isinstance(codes, list) for codes in epcis + zos):
+                return None, None
+            return sum(epcis, []), sum(zos, [])
+        feuille = data.fb1_sa_rp
+        union_epcis, union_zos = cls._unions(data)
+        epcis = feuille.get_epcis_pack(union_epcis)
+        zos = feuille.get_zos_pack(union_zos)
+        if not isinstance(epcis, list) or not isinstance(zos, list):
+            return None, None
+        return epcis, zos
+
+    @classmethod
+    def partage(cls, data):
+        """
+        Renvoie le registre de la région du pack (snapshot, entrepôt ou base de données du pool du pack)
+        Un code est classé EPCI s'il figure dans la table EPCI d'au moins une feuille du pack,
+        comme lorsque chaque feuille consultait sa propre liste d'EPCI.
+        """
+        source = cls._source(data)
+        clef = (source or data.pool.dsn, data.region, data.version)
+        registre = cls._registre(clef)
+        if registre is None:
+            epcis, zos = cls._codes(data)
+            if epcis is None:
+                # lecture en échec : registre vide, non conservé
+                return cls([], [])
+            registre = cls._conserver(clef, cls(epcis, zos))
+        return registre
+
+    @classmethod
+    async def partage_async(cls, data, pool=None):
+        """
+        partage() dont les codes sont lus, si besoin, par des requêtes asynchrones simultanées
+        pool : PoolAsync utilisé, par défaut le pool asynchrone de la boucle courante
+        """
+        if cls._source(data) is not None or data.precharge:
+            # codes lus en mémoire
+            return cls.partage(data)
+        pool = pool if pool is not None else pool_donnees_async()
+        clef = (pool.dsn, data.region, data.version)
+        registre = cls._registre(clef)
+        if registre is None:
+            requete_sql = data.fb1_sa_rp.requete_sql
+            union_epcis, union_zos = cls._unions(data)
+            epcis, zos = await asyncio.gather(
+                pool.dataframe(requete_sql["get_epcis_pack"].format(union_epcis)),
+                pool.dataframe(requete_sql["get_zos_pack"].format(union_zos)),
+            )
+            registre = cls._conserver(
+                clef, cls(epcis["EPCI"].tolist(), zos["ZO"].tolist())
+            )
+        return registre
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, code):
+        return code in self._ids
+
+    def id(self, code):
+        return self._ids.get(code, -1)
+
+    def est_epci(self, code):
+        return 0 <= self._ids.get(code, -1) < self.nb_epcis
+
+    def niveau(self, code):
+        return "epci" if self.est_epci(code) else "zo"
+
+    def ids(self, codes):
+        """
+        Renvoie le tableau des identifiants des codes (-1 pour un code inconnu)
+        Les identifiants d'un tableau numpy de codes (RegionResultat.code) sont conservés
+        et resservis tant que ce même tableau est utilisé : il ne doit pas être modifié.
+        """
+        if isinstance(codes, np.ndarray):
+            with self._verrou:
+                entree = self._cache_ids.get(id(codes))
+            if entree is not None and entree[0] is codes:
+                return entree[1]
+        tableau = np.asarray(codes, dtype=object)
+        ids = np.fromiter(
+            (self._ids.get(code, -1) for code in tableau.ravel().tolist()),
+            dtype=np.int64,
+            count=tableau.size,
+        ).reshape(tableau.shape)
+        if isinstance(codes, np.ndarray):
+            with self._verrou:
+                if len(self._cache_ids) >= self.TAILLE_CACHE_IDS:
+                    del self._cache_ids[next(iter(self._cache_ids))]
+                self._cache_ids[id(codes)] = (codes, ids)
+        return ids
+
+
+class CatalogueColonnes:
+    """
+    Colonnes d'une table du pack, lues une seule fois par processus dans information_schema
+
+    Les sélections de colonnes (liste ou préfixe) et les expressions SQL de somme
+    correspondantes sont construites au premier appel puis réutilisées.
+    """
+
+    ## catalogues partagés, par (chaîne de connexion de la base lue, table)
+    _CATALOGUES = {}
+    _VERROU = threading.Lock()
+
+    def __init__(self, noms):
+        self.noms = noms
+        self._selections = {}
+        self._expressions = {}
+
+    @classmethod
+    def partage(cls, feuille):
+        """
+        Renvoie le catalogue de la table (à l'EPCI) de la feuille, en le lisant si besoin
+        """
+        clef = (feuille.conn.dsn, feuille.nom_table)
+        with cls._VERROU:
+            catalogue = cls._CATALOGUES.get(clef)
+        if catalogue is None:
+            champs = feuille.lister_champs(feuille.schema, feuille.table)
+            if not isinstance(champs, list):
+                # lecture en échec : catalogue vide, non conservé
+                return cls([])
+            catalogue = cls([champ[1] for champ in champs])
+            with cls._VERROU:
+                catalogue = cls._CATALOGUES.setdefault(clef, catalogue)
+        return catalogue
+
+    def selection(self, colonnes=None, prefixe=None):
+        """
+        Renvoie les colonnes de la table commençant par prefixe, ou sinon présentes dans colonnes
+        """
+        clef = (prefixe,) if prefixe else (None, tuple(colonnes or ()))
+        if clef not in self._selections:
+            if prefixe:
+                choix = [nom for nom in self.noms if nom.startswith(prefixe)]
+            else:
+                choix = [nom for nom in self.noms if nom in clef[1]]
+            self._selections[clef] = tuple(choix)
+        return self._selections[clef]
+
+    def expression_somme(self, colonnes=None, prefixe=None):
+        """
+        Renvoie l'expression SQL de la somme des colonnes sélectionnées (valeurs nulles à 0)
+        """
+        selection = self.selection(colonnes, prefixe)
+        if selection not in self._expressions:
+            self._expressions[selection] = " + ".join(
+                "COALESCE(" + identifiant(nom) + ", 0) " for nom in selection
+            )
+        return self._expressions[selection]
+
+
+class TableMemoire:
+    """
+    Feuille du pack (EPCI et ZO réunis) stockée en mémoire colonne par colonne
+
+    Chaque colonne est un tableau numpy de flottants (NaN pour les valeurs absentes ou non numériques).
+    Les lignes sont repérées par code, ou par (code, annee) pour la feuille Omphale.
+    Comme pour les requêtes, une valeur absente ou nulle est renvoyée à 0.0.
+    La table peut ne contenir que les lignes de certains codes (codes), elle ne
+    répond alors que pour ces codes, et que certaines colonnes de ces codes (projection),
+    elle ne répond alors, pour chaque code, que pour les colonnes chargées.
+    """
+
+    def __init__(
+        self,
+        index,
+        colonnes,
+        noms_colonnes,
+        epcis,
+        zos,
+        par_annee=False,
+        nb_lignes=0,
+        codes=None,
+        projection=None,
+    ):
+        self.index = index
+        self.colonnes = colonnes
+        self.noms_colonnes = noms_colonnes
+        self.epcis = epcis
+        self.zos = zos
+        self.par_annee = par_annee
+        self.nb_lignes = nb_lignes
+        self.codes = codes
+        ## colonnes chargées par code : None si toutes les colonnes sont chargées pour
+        ## tous les codes, sinon {code: ensemble des colonnes, ou None pour toutes}
+        if projection is not None and not isinstance(projection, dict):
+            if codes is None:
+                raise ValueError("Une table projetée doit indiquer ses codes")
+            projection = dict.fromkeys(codes, frozenset(projection))
+        self.projection = projection
+        ## numéros de ligne par identifiant de territoire, par registre
+        self._positions = {}
+
+    @property
+    def complete(self):
+        """
+        Renvoie True si la table contient la feuille entière
+        """
+        return self.codes is None and self.projection is None
+
+    def couvre(self, code, colonnes=None):
+        """
+        Renvoie True si la table peut répondre pour le code (ou tous les codes d'un tableau)
+        et pour les colonnes (None : toutes les colonnes)
+        """
+        codes = code.tolist() if isinstance(code, np.ndarray) else [code]
+        if self.codes is not None and not all(c in self.codes for c in codes):
+            return False
+        if self.projection is None:
+            return True
+        for c in codes:
+            projection = self.projection.get(c)
+            if projection is not None and (
+                colonnes is None or not projection.issuperset(colonnes)
+            ):
+                return False
+        return True
+
+    def _projection_code(self, code):
+        """
+        Renvoie les colonnes chargées pour le code (None : toutes), False si le code est absent
+        """
+        if self.codes is not None and code not in self.codes:
+            return False
+        if self.projection is None:
+            return None
+        return self.projection.get(code)
+
+    @classmethod
+    def from_dataframes(cls, df, df_zo, codes=None, projection=None):
+        """
+        Construit la table depuis les Dataframes de la feuille à l'EPCI et à la ZO
+        codes : codes demandés si les Dataframes ne contiennent que les lignes de certains codes
+        projection : colonnes demandées si les Dataframes ne contiennent que certaines colonnes
+        """
+        par_annee = "annee" in df.columns or "annee" in df_zo.columns
+        tables = [
+            df.rename(columns={"EPCI": "code"}),
+            df_zo.rename(columns={"ZO": "code"}),
+        ]
+        table = pd.concat(tables, ignore_index=True)
+        if par_annee:
+            annees = pd.to_numeric(table["annee"], errors="coerce")
+            clefs = zip(table["code"], annees)
+        else:
+            clefs = table["code"]
+        index = {}
+        for ligne, clef in enumerate(clefs):
+            if par_annee:
+                clef = (clef[0], None if pd.isna(clef[1]) else int(clef[1]))
+            # une clef en double renvoie plusieurs lignes, donc 0.0, comme en base
+            index[clef] = None if clef in index else ligne
+        noms_colonnes = [c for c in df.columns if c != "EPCI"] + [
+            c for c in df_zo.columns if c != "ZO" and c not in df.columns
+        ]
+        colonnes = {
+            nom: pd.to_numeric(table[nom], errors="coerce").to_numpy(
+                dtype=float, na_value=np.nan
+            )
+            for nom in noms_colonnes
+        }
+        epcis = list(pd.unique(df["EPCI"])) if "EPCI" in df.columns else []
+        zos = list(pd.unique(df_zo["ZO"])) if "ZO" in df_zo.columns else []
+        return cls(
+            index,
+            colonnes,
+            noms_colonnes,
+            epcis,
+            zos,
+            par_annee,
+            len(table),
+            None if codes is None else set(codes),
+            projection,
+        )
+
+    def fusion(self, autre):
+        """
+        Renvoie une table réunissant les deux tables partielles, colonne par colonne :
+        pour les codes de autre, les colonnes chargées par autre remplacent celles de
+        la table, les autres colonnes de ces codes gardent leurs valeurs.
+        Une clef en double dans l'une des tables reste en double (valeurs à 0.0).
+        """
+        clefs = list(self.index) + [c for c in autre.index if c not in self.index]
+        index = {
+            clef: (
+                None
+                if self.index.get(clef, 0) is None or autre.index.get(clef, 0) is None
+                else ligne
+            )
+            for ligne, clef in enumerate(clefs)
+        }
+
+        def sources(table):
+            lignes = [table.index.get(clef) for clef in clefs]
+            return np.array([-1 if l is None else l for l in lignes], dtype=np.int64)
+
+        lignes_table, lignes_autre = sources(self), sources(autre)
+        # lignes de chaque code de autre, groupées selon les colonnes chargées par autre
+        groupes = {}
+        for ligne, clef in enumerate(clefs):
+            code = clef[0] if self.par_annee else clef
+            projection = autre._projection_code(code)
+            if projection is not False:
+                groupes.setdefault(projection, []).append(ligne)
+        noms_colonnes = self.noms_colonnes + [
+            c for c in autre.noms_colonnes if c not in self.noms_colonnes
+        ]
+        colonnes = {}
+        for nom in noms_colonnes:
+            colonne = np.full(len(clefs), np.nan)
+            if nom in self.colonnes:
+                presentes = lignes_table >= 0
+                colonne[presentes] = self.colonnes[nom][lignes_table[presentes]]
+            # colonne chargée par autre pour ces lignes : ses valeurs (ou leur absence) priment
+            chargees = np.zeros(len(clefs), dtype=bool)
+            for projection, lignes in groupes.items():
+                if projection is None or nom in projection:
+                    chargees[lignes] = True
+            colonne[chargees] = np.nan
+            if nom in autre.colonnes:
+                presentes = chargees & (lignes_autre >= 0)
+                colonne[presentes] = autre.colonnes[nom][lignes_autre[presentes]]
+            colonnes[nom] = colonne
+
+        codes = None
+        if self.codes is not None and autre.codes is not None:
+            codes = self.codes | autre.codes
+        projection = None
+        if self.projection is not None or autre.projection is not None:
+            projection = {}
+            for code in codes if codes is not None else ():
+                projections = [
+                    p
+                    for p in (self._projection_code(code), autre._projection_code(code))
+                    if p is not False
+                ]
+                projection[code] = (
+                    None if None in projections else frozenset().union(*projections)
+                )
+            if all(p is None for p in projection.values()):
+                projection = None
+        return TableMemoire(
+            index,
+            colonnes,
+            noms_colonnes,
+            list(dict.fromkeys(self.epcis + autre.epcis)),
+            list(dict.fromkeys(self.zos + autre.zos)),
+            self.par_annee,
+            len(clefs),
+            codes,
+            projection,
+        )
+
+    def _ligne(self, code, annee=None):
+        if self.par_annee:
+            return self.index.get((code, annee))
+        return self.index.get(code)
+
+    def positions(self, territoires):
+        """
+        Renvoie le tableau des numéros de ligne par identifiant de territoire du registre
+        (par identifiant et par année pour Omphale, à partir de la première année)
+        et cette première année, -1 indiquant une ligne absente ou en double
+        """
+        if territoires not in self._positions:
+            premiere, derniere = 0, -1
+            if self.par_annee:
+                annees = [annee for _, annee in self.index if annee is not None]
+                if annees:
+                    premiere, derniere = min(annees), max(annees)
+                positions = np.full((len(territoires), derniere - premiere + 1), -1)
+            else:
+                positions = np.full(len(territoires), -1)
+            for clef, ligne in self.index.items():
+                code, annee = clef if self.par_annee else (clef, None)
+                numero = territoires.id(code)
+                if numero < 0 or ligne is None:
+                    continue
+                if not self.par_annee:
+                    positions[numero] = ligne
+                elif annee is not None:
+                    positions[numero, annee - premiere] = ligne
+            self._positions[territoires] = (positions, premiere)
+        return self._positions[territoires]
+
+    def _lignes_par_id(self, codes, annees, territoires):
+        """
+        _lignes() par indexation directe sur les identifiants des territoires du registre,
+        les codes hors registre étant recherchés par code
+        """
+        positions, premiere = self.positions(territoires)
+        ids = territoires.ids(codes)
+        if self.par_annee:
+            ids, annees = np.broadcast_arrays(ids, np.asarray(annees, dtype=object))
+            try:
+                rangs = annees.astype(np.int64) - premiere
+            except (TypeError, ValueError):
+                return self._lignes(codes, annees)
+            valides = (ids >= 0) & (rangs >= 0) & (rangs < positions.shape[1])
+            lignes = np.full(ids.shape, -1, dtype=np.int64)
+            lignes[valides] = positions[ids[valides], rangs[valides]]
+        else:
+            valides = ids >= 0
+            lignes = np.full(ids.shape, -1, dtype=np.int64)
+            lignes[valides] = positions[ids[valides]]
+        inconnus = ids < 0
+        if inconnus.any():
+            codes = np.broadcast_to(np.asarray(codes, dtype=object), ids.shape)
+            lignes[inconnus] = self._lignes(
+                codes[inconnus], annees[inconnus] if self.par_annee else None
+            )
+        return lignes
+
+    def _lignes(self, codes, annees=None, territoires=None):
+        """
+        Renvoie le tableau des numéros de ligne des codes (-1 si absent)
+        territoires : registre dont les identifiants servent d'indices (voir positions()),
+        pour une table complète
+        """
+        if territoires is not None and self.complete:
+            return self._lignes_par_id(codes, annees, territoires)
+        if self.par_annee:
+            codes, annees = np.broadcast_arrays(
+                np.asarray(codes, dtype=object), np.asarray(annees, dtype=object)
+            )
+            clefs = zip(codes.tolist(), annees.tolist())
+        else:
+            clefs = np.asarray(codes, dtype=object).tolist()
+        lignes = [self.index.get(clef) for clef in clefs]
+        return np.array([-1 if l is None else l for l in lignes], dtype=np.int64)
+
+    @staticmethod
+    def _extraire(colonne, lignes):
+        if colonne is None:
+            return np.zeros(len(lignes))
+        val = np.where(lignes >= 0, colonne[lignes], np.nan)
+        return np.where(np.isnan(val), 0.0, val)
+
+    def valeurs(self, nom_col, codes, annees=None, territoires=None):
+        """
+        Renvoie le tableau des valeurs de la colonne pour un tableau de codes
+        (et d'années pour Omphale, une année seule s'appliquant à tous les codes)
+        """
+        return self._extraire(
+            self.colonnes.get(nom_col), self._lignes(codes, annees, territoires)
+        )
+
+    def valeur(self, nom_col, code, annee=None, territoires=None):
+        """
+        Renvoie la valeur de la colonne pour le code (et l'année pour Omphale)
+        code et annee peuvent être des tableaux numpy, le résultat est alors un tableau
+        """
+        if isinstance(code, np.ndarray) or isinstance(annee, np.ndarray):
+            return self.valeurs(nom_col, code, annee, territoires)
+        colonne = self.colonnes.get(nom_col)
+        ligne = self._ligne(code, annee)
+        if colonne is None or ligne is None:
+            return 0.0
+        val = colonne[ligne]
+        if np.isnan(val):
+            return 0.0
+        return float(val)
+
+    def somme(self, colonnes, code, territoires=None):
+        """
+        Renvoie la somme des colonnes pour le code, les valeurs nulles comptant pour 0
+        """
+        if isinstance(code, np.ndarray):
+            lignes = self._lignes(code, territoires=territoires)
+            val = np.zeros(len(lignes))
+            for nom_col in colonnes:
+                if nom_col in self.colonnes:
+                    val += self._extraire(self.colonnes[nom_col], lignes)
+            return val
+        ligne = self._ligne(code)
+        if ligne is None:
+            return 0.0
+        val = 0.0
+        for nom_col in colonnes:
+            colonne = self.colonnes.get(nom_col)
+            if colonne is not None and not np.isnan(colonne[ligne]):
+                val += float(colonne[ligne])
+        return val
@@ -0,0 +1,207 @@
+"""
+Entrepôt des indicateurs des packs régionaux, projeté en mémoire
+
+Chaque feuille de chaque pack régional est stockée dans un fichier .npy (une ligne
+de la matrice par colonne de la feuille) et un manifeste décrit les colonnes et les
+lignes (codes, années) de chaque matrice. Les processus de calcul ouvrent les fichiers
+en lecture seule (np.load(mmap_mode="r")) : les pages sont partagées par le système
+et une seule copie physique des données existe quel que soit le nombre de processus.
+
+Le manifeste indique pour chaque pack la source dont il a été lu (snapshot et son
+empreinte, ou base de données) : un pack dont la source a changé est reconstruit par
+preparer(), et refusé à l'ouverture.
+
+Exemple :
+    EntrepotIndicateurs.construire("entrepot", ["24", "32"], version=2)
+    EntrepotIndicateurs.preparer("entrepot", ["24", "32", "11"], version=2)
+    data = EntrepotIndicateurs("entrepot").data("24", 2)
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from chargement import SCHEMAS, Data, TableMemoire, pool_donnees
+
+## version du format de l'entrepôt
+FORMAT_ENTREPOT = 2
+
+
+class EntrepotIndicateurs:
+    """
+    Entrepôt en lecture seule des feuilles des packs régionaux
+    """
+
+    def __init__(self, chemin):
+        self.chemin = chemin
+        self._manifeste = None
+        self._tables = {}
+        self._verrou = threading.Lock()
+
+    @property
+    def manifeste(self):
+        if self._manifeste is None:
+            with open(
+                os.path.join(self.chemin, "entrepot.json"), "rt", encoding="utf-8"
+            ) as f:
+                manifeste = json.load(f)
+            if manifeste.get("format") != FORMAT_ENTREPOT:
+                raise ValueError(
+                    "Format d'entrepôt non pris en charge : "
+                    + str(manifeste.get("format"))
+                )
+            self._manifeste = manifeste
+        return self._manifeste
+
+    @staticmethod
+    def existe(chemin):
+        return os.path.exists(os.path.join(chemin, "entrepot.json"))
+
+    @staticmethod
+    def _clef(region, version, feuille=None):
+        clef = "r{0}_v{1}".format(region, version)
+        return clef if feuille is None else clef + "_" + feuille
+
+    @staticmethod
+    def source(region, version=1):
+        """
+        Renvoie la description de la source dont le pack serait lu : snapshot (chemin et
+        empreinte de son manifeste) ou base de données (chaîne de connexion et schéma)
+        """
+        chemin = Data.chemin_snapshot(region, version)
+        manifeste = None if chemin is None else os.path.join(chemin, "snapshot.json")
+        if manifeste is not None and os.path.exists(manifeste):
+            with open(manifeste, "rt", encoding="utf-8") as f:
+                empreinte = json.load(f)["empreinte"]
+            return {"snapshot": chemin, "empreinte": empreinte, "version": version}
+        return {
+            "base": pool_donnees().dsn,
+            "schema": SCHEMAS[version],
+            "version": version,
+        }
+
+    @classmethod
+    def _lire_manifeste(cls, chemin):
+        """
+        Renvoie le manifeste de l'entrepôt, vide s'il n'existe pas ou est d'un autre format
+        """
+        if not cls.existe(chemin):
+            return {"format": FORMAT_ENTREPOT, "packs": {}, "tables": {}}
+        with open(os.path.join(chemin, "entrepot.json"), "rt", encoding="utf-8") as f:
+            manifeste = json.load(f)
+        if manifeste.get("format") != FORMAT_ENTREPOT:
+            return {"format": FORMAT_ENTREPOT, "packs": {}, "tables": {}}
+        return manifeste
+
+    @classmethod
+    def construire(cls, chemin, regions=None, version=1):
+        """
+        Écrit dans l'entrepôt les packs des régions indiquées (par défaut toutes), lus dans
+        leurs snapshots ou dans la base de données, et le renvoie.
+        Les packs déjà présents des autres régions (ou versions) sont conservés.
+        """
+        os.makedirs(chemin, exist_ok=True)
+        manifeste = cls._lire_manifeste(chemin)
+        for region in regions or Data.regions(version):
+            data = Data.ouvrir(region, version, precharge=True)
+            for nom in Data.FEUILLES:
+                memoire = getattr(data, nom).memoire
+                clef = cls._clef(region, version, nom)
+                if memoire.noms_colonnes:
+                    matrice = np.stack(
+                        [memoire.colonnes[c] for c in memoire.noms_colonnes]
+                    )
+                else:
+                    matrice = np.empty((0, memoire.nb_lignes))
+                np.save(os.path.join(chemin, clef + ".npy"), matrice.astype(np.float64))
+                manifeste["tables"][clef] = {
+                    "noms_colonnes": memoire.noms_colonnes,
+                    "lignes": [
+                        [list(c) if memoire.par_annee else c, ligne]
+                        for c, ligne in memoire.index.items()
+                    ],
+                    "epcis": memoire.epcis,
+                    "zos": memoire.zos,
+                    "par_annee": memoire.par_annee,
+                    "nb_lignes": memoire.nb_lignes,
+                }
+            manifeste["packs"][cls._clef(region, version)] = cls.source(region, version)
+        fichier_tmp = os.path.join(chemin, "entrepot.json.tmp")
+        with open(fichier_tmp, "wt", encoding="utf-8") as f:
+            json.dump(manifeste, f)
+        os.replace(fichier_tmp, os.path.join(chemin, "entrepot.json"))
+        return cls(chemin)
+
+    @classmethod
+    def preparer(cls, chemin, regions=None, version=1):
+        """
+        Renvoie l'entrepôt après y avoir écrit les packs des régions indiquées (par défaut
+        toutes) qui sont absents ou dont la source a changé depuis leur écriture
+        """
+        packs = cls._lire_manifeste(chemin)["packs"]
+        a_construire = [
+            region
+            for region in regions or Data.regions(version)
+            if packs.get(cls._clef(region, version)) != cls.source(region, version)
+        ]
+        if a_construire:
+            return cls.construire(chemin, a_construire, version)
+        return cls(chemin)
+
+    def table(self, region, version, feuille):
+        """
+        Renvoie la TableMemoire de la feuille, dont les colonnes sont projetées en mémoire (sans copie)
+        """
+        clef = self._clef(region, version, feuille)
+        with self._verrou:
+            if clef not in self._tables:
+                description = self.manifeste["tables"][clef]
+                matrice = np.load(
+                    os.path.join(self.chemin, clef + ".npy"), mmap_mode="r"
+                )
+                par_annee = description["par_annee"]
+                index = {
+                    (tuple(c) if par_annee else c): ligne
+                    for c, ligne in description["lignes"]
+                }
+                colonnes = {
+                    nom: matrice[numero]
+                    for numero, nom in enumerate(description["noms_colonnes"])
+                }
+                self._tables[clef] = TableMemoire(
+                    index,
+                    colonnes,
+                    description["noms_colonnes"],
+                    description["epcis"],
+                    description["zos"],
+                    par_annee,
+                    description["nb_lignes"],
+                )
+            return self._tables[clef]
+
+    def regions(self, version=1):
+        return sorted(
+            pack[1:].rsplit("_v", 1)[0]
+            for pack, source in self.manifeste["packs"].items()
+            if source["version"] == version
+        )
+
+    def data(self, region, version=1):
+        """
+        Renvoie le pack régional dont les feuilles sont servies par l'entrepôt
+        """
+        pack = self.manifeste["packs"].get(self._clef(region, version))
+        if pack is None:
+            raise KeyError("Région absente de l'entrepôt : " + str(region))
+        if pack != self.source(region, version):
+            raise ValueError(
+                "Pack r{0} (version {1}) de l'entrepôt {2} périmé : sa source a changé,"
+                " voir EntrepotIndicateurs.preparer".format(
+                    region, version, self.chemin
+                )
+            )
+        data = Data(region, version, precharge=True)
+        data.entrepot = self
+        return data
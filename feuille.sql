@@ -4,26 +4,47 @@ SELECT * FROM {0} ORDER BY "EPCI"{1};
 ## get_table_zo::df
 SELECT * FROM {0} ORDER BY "ZO"{1};
 
+## get_lignes_epci::df
+SELECT * FROM {0} WHERE "EPCI" = ANY(%s);
+
+## get_lignes_zo::df
+SELECT * FROM {0} WHERE "ZO" = ANY(%s);
+
 ## get_epcis::list
 SELECT DISTINCT "EPCI" FROM {0};
 
 ## get_zos::list
 SELECT DISTINCT "ZO" FROM {0};
 
+## get_epcis_pack::list
+SELECT DISTINCT "EPCI" FROM ({0}) AS epcis;
+
+## get_zos_pack::list
+SELECT DISTINCT "ZO" FROM ({0}) AS zos;
+
+## codes_table
+SELECT {0} FROM {1}
+
 ## get_val_epci::smart
-SELECT "{0}" FROM {1} WHERE "EPCI"='{2}';
+SELECT {0} FROM {1} WHERE "EPCI" = %s;
 
 ## get_val_zo::smart
-SELECT "{0}" FROM {1} WHERE "ZO"='{2}';
+SELECT {0} FROM {1} WHERE "ZO" = %s;
+
+## get_vals_epci::df
+SELECT "EPCI" AS code, {0} AS valeur FROM {1} WHERE "EPCI" = ANY(%s);
+
+## get_vals_zo::df
+SELECT "ZO" AS code, {0} AS valeur FROM {1} WHERE "ZO" = ANY(%s);
 
-## get_expr_epci::smart
-SELECT {0} FROM {1} WHERE "EPCI"='{2}';
+## get_vals_omphale_epci::df
+SELECT "EPCI" AS code, annee, {0} AS valeur FROM {1} WHERE "EPCI" = ANY(%s) AND annee = ANY(%s);
 
-## get_expr_zo::smart
-SELECT {0} FROM {1} WHERE "ZO"='{2}';
+## get_vals_omphale_zo::df
+SELECT "ZO" AS code, annee, {0} AS valeur FROM {1} WHERE "ZO" = ANY(%s) AND annee = ANY(%s);
 
-## get_val_omphale_epci::smart
-SELECT "{0}" FROM {1} WHERE "EPCI"='{2}' AND annee={3};
+## get_colonnes_epci::df
+SELECT "EPCI", {0} FROM {1} WHERE "EPCI" = ANY(%s);
 
-## get_val_omphale_zo::smart
-SELECT "{0}" FROM {1} WHERE "ZO"='{2}' AND annee={3};
+## get_colonnes_zo::df
+SELECT "ZO", {0} FROM {1} WHERE "ZO" = ANY(%s);
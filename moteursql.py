@@ -0,0 +1,286 @@
+"""
+Calcul des besoins exécuté par PostgreSQL
+
+Le plan compilé des formules de Resultat (plan.py) est traduit en une seule requête SQL :
+les colonnes lues dans chaque feuille r<region>_* sont réunies par territoire (jointure
+sur le code EPCI ou ZO), puis chaque niveau d'étapes du plan est calculé dans une
+expression de table (CTE) matérialisée. Les arrondis sont faits aux mêmes étapes que
+dans Resultat, au pair le plus proche comme round() ; la requête renvoie en un aller-retour
+la table des indicateurs de tous les territoires.
+
+Exemple :
+    MoteurSQL("24", parametre, version=2).calculer(niveau="zo")
+    python moteursql.py 24 --version 2  # parité avec le calcul Python
+"""
+
+import argparse
+import sys
+
+import pandas as pd
+
+from chargement import OTELO_DATA_DB, Data, pool_donnees
+from pg.pgutils import PGScript, identifiant
+from plan import Noeud
+from resultat import RegionResultat
+
+## fragments SQL des étapes du plan, par opération
+OPERATIONS_SQL = {
+    "+": "addition",
+    "-": "soustraction",
+    "*": "multiplication",
+    "/": "division",
+    "neg": "oppose",
+    "puissance": "puissance",
+}
+
+
+class MoteurSQL(PGScript):
+    """
+    Calcul des indicateurs d'une région pour un paramétrage, exécuté dans la base de données
+
+    Les valeurs sont celles de RegionResultat.to_frame, à ceci près qu'une division
+    par zéro donne une valeur absente (NULL) au lieu d'interrompre la requête.
+    Un arrondi à n décimales est fait sur la représentation décimale la plus courte
+    de la valeur (PostgreSQL 12 ou plus récent).
+    """
+
+    def __init__(
+        self,
+        code_region,
+        parametre,
+        periode_projection=6,
+        version=1,
+        custom_parametre=None,
+        pool=None,
+    ):
+        pool = pool if pool is not None else pool_donnees()
+        super().__init__(*OTELO_DATA_DB, log=False, pool=pool)
+        self.code_region = code_region
+        self.parametre = parametre
+        self.periode_projection = periode_projection
+        self.version = version
+        self.custom_parametre = custom_parametre
+        ## pack lu en base, dont les catalogues de colonnes servent à la compilation
+        self.data = Data(code_region, version, pool=pool)
+
+    def plan(self, indicateurs=None):
+        """
+        Renvoie le plan compilé des indicateurs (voir Resultat.plan)
+        """
+        resultat = RegionResultat(
+            self.code_region,
+            self.parametre,
+            periode_projection=self.periode_projection,
+            version=self.version,
+            codes=[],
+            custom_parametre=self.custom_parametre,
+            data=self.data,
+        )
+        return resultat.plan(indicateurs)
+
+    def _fragment(self, nom, *args):
+        return self.requete_sql[nom].strip().format(*args)
+
+    def _operande(self, operande):
+        if isinstance(operande, Noeud):
+            return "n{0}".format(operande.numero)
+        return self._fragment("constante", repr(float(operande)))
+
+    def _expression(self, operation, operandes):
+        if operation == "arrondi":
+            valeur, decimales = operandes
+            if decimales is None:
+                return self._fragment("arrondi", self._operande(valeur))
+            return self._fragment(
+                "arrondi_decimales", self._operande(valeur), int(decimales)
+            )
+        return self._fragment(
+            OPERATIONS_SQL[operation], *(self._operande(o) for o in operandes)
+        )
+
+    def _arguments(self, niveau, codes, indicateurs):
+        """
+        Renvoie les arguments de la requête calcul_besoins et ses paramètres
+        """
+        plan = self.plan(indicateurs)
+        clef = identifiant("EPCI" if niveau == "epci" else "ZO")
+
+        # valeurs lues : une expression de table par feuille, réunies par territoire
+        lectures = {}
+        for numero in plan.ordre:
+            operation, operandes = plan.noeuds[numero]
+            if operation == "feuille":
+                lectures.setdefault(operandes[0], []).append((numero, *operandes[1:]))
+        feuilles, lues, jointures = [], [], []
+        for nom, valeurs in lectures.items():
+            feuille = getattr(self.data, nom)
+            existantes = feuille.catalogue.selection([c for _, c, _ in valeurs])
+            colonnes = []
+            for numero, colonne, annee in valeurs:
+                alias = "n{0}".format(numero)
+                if colonne not in existantes:
+                    # colonne absente de la table : 0.0, comme Feuille.valeur
+                    lues.append(self._fragment("constante", 0.0) + " AS " + alias)
+                elif annee is None:
+                    colonnes.append(
+                        self._fragment("valeur", identifiant(colonne), alias)
+                    )
+                    lues.append(self._fragment("lue", "f_" + nom, alias))
+                else:
+                    colonnes.append(
+                        self._fragment(
+                            "valeur_annee", identifiant(colonne), alias, int(annee)
+                        )
+                    )
+                    lues.append(self._fragment("lue", "f_" + nom, alias))
+            if colonnes:
+                table = feuille.nom_table if niveau == "epci" else feuille.nom_table_zo
+                feuilles.append(
+                    self._fragment(
+                        "feuille", "f_" + nom, clef, ", ".join(colonnes), table
+                    )
+                )
+                jointures.append(self._fragment("jointure", "f_" + nom))
+        expressions = feuilles + [
+            self._fragment(
+                "lecture", "e0", ", ".join(lues) or "NULL AS vide", " ".join(jointures)
+            )
+        ]
+
+        # étapes : une expression de table matérialisée par profondeur dans le plan
+        profondeurs = {}
+        etapes = {}
+        for numero in plan.ordre:
+            operation, operandes = plan.noeuds[numero]
+            if operation == "feuille":
+                profondeurs[numero] = 0
+                continue
+            profondeur = 1 + max(
+                [profondeurs[o.numero] for o in operandes if isinstance(o, Noeud)],
+                default=0,
+            )
+            profondeurs[numero] = profondeur
+            etapes.setdefault(profondeur, []).append(
+                self._expression(operation, operandes) + " AS n{0}".format(numero)
+            )
+        for profondeur in sorted(etapes):
+            expressions.append(
+                self._fragment(
+                    "etape",
+                    "e{0}".format(profondeur),
+                    "e{0}".format(profondeur - 1),
+                    ", ".join(etapes[profondeur]),
+                )
+            )
+        sorties = ", ".join(
+            self._fragment("entier", self._operande(sortie)) + " AS " + identifiant(nom)
+            for nom, sortie in plan.sorties.items()
+        )
+        arguments = [
+            ",\n".join(expressions),
+            sorties,
+            "e{0}".format(max(etapes, default=0)),
+        ]
+        if codes is None:
+            feuille = self.data.fb1_sa_rp
+            table = feuille.nom_table if niveau == "epci" else feuille.nom_table_zo
+            return [self._fragment("territoires_pack", table, clef)] + arguments, None
+        # les % des noms de colonnes ne doivent pas être pris pour des marqueurs
+        arguments = [argument.replace("%", "%%") for argument in arguments]
+        return [self._fragment("territoires_codes")] + arguments, (list(codes),)
+
+    def requete(self, niveau="epci", codes=None, indicateurs=None):
+        """
+        Renvoie le texte de la requête du calcul des territoires du niveau ("epci" ou "zo")
+        ou des codes indiqués (tous de ce niveau), et ses paramètres
+        """
+        arguments, parametres = self._arguments(niveau, codes, indicateurs)
+        return self.requete_sql["calcul_besoins"].format(*arguments), parametres
+
+    def calculer(self, niveau="epci", codes=None, indicateurs=None):
+        """
+        Renvoie le Dataframe des indicateurs (colonnes) par territoire (index "code",
+        dans l'ordre des codes s'ils sont indiqués), calculé par la base de données en une requête
+        """
+        arguments, parametres = self._arguments(niveau, codes, indicateurs)
+        frame = self.calcul_besoins(*arguments, parametres=parametres)
+        if not isinstance(frame, pd.DataFrame):
+            raise RuntimeError(
+                "Calcul SQL impossible pour la région " + str(self.code_region)
+            )
+        frame = frame.set_index("code")
+        if codes is not None:
+            frame = frame.reindex(pd.Index(list(codes), name="code"))
+        return frame
+
+
+def comparer(
+    code_region,
+    parametre=None,
+    periode_projection=6,
+    version=1,
+    niveau="epci",
+    indicateurs=None,
+):
+    """
+    Compare les indicateurs calculés par MoteurSQL et par RegionResultat (calcul Python)
+    Renvoie le Dataframe des écarts : une ligne par territoire et indicateur différents
+    (valeur_sql, valeur_python)
+    """
+    from national import parametre_standard
+
+    parametre = parametre or parametre_standard()
+    sql = MoteurSQL(code_region, parametre, periode_projection, version).calculer(
+        niveau, indicateurs=indicateurs
+    )
+    python = RegionResultat(
+        code_region,
+        parametre,
+        periode_projection=periode_projection,
+        version=version,
+        niveau=niveau,
+        codes=list(sql.index),
+    ).to_frame(indicateurs)
+    ecarts = []
+    for nom in python.columns:
+        valeurs_sql = sql[nom].reindex(python.index)
+        differents = ~(valeurs_sql == python[nom])
+        for code in python.index[differents.to_numpy()]:
+            ecarts.append(
+                {
+                    "code": code,
+                    "indicateur": nom,
+                    "valeur_sql": valeurs_sql[code],
+                    "valeur_python": python[nom][code],
+                }
+            )
+    return pd.DataFrame(
+        ecarts, columns=["code", "indicateur", "valeur_sql", "valeur_python"]
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Parité du calcul SQL avec le calcul Python"
+    )
+    parser.add_argument("regions", nargs="+")
+    parser.add_argument("--version", type=int, default=1)
+    parser.add_argument(
+        "--niveaux", nargs="*", choices=("epci", "zo"), default=("epci", "zo")
+    )
+    parser.add_argument("--periodes", nargs="*", type=int, default=[6])
+    args = parser.parse_args()
+    nb_ecarts = 0
+    for region in args.regions:
+        for niveau in args.niveaux:
+            for periode in args.periodes:
+                ecarts = comparer(region, None, periode, args.version, niveau)
+                nb_ecarts += len(ecarts)
+                print(
+                    "r{0} {1} période {2} : {3} écart(s)".format(
+                        region, niveau, periode, len(ecarts)
+                    )
+                )
+                if len(ecarts):
+                    print(ecarts.head(20).to_string(index=False))
+    sys.exit(1 if nb_ecarts else 0)
@@ -0,0 +1,76 @@
+## calcul_besoins::df
+WITH territoires AS (
+{0}
+),
+{1}
+SELECT code, {2}
+FROM {3}
+ORDER BY code;
+
+## territoires_pack
+SELECT DISTINCT {1} AS code FROM {0}
+
+## territoires_codes
+SELECT DISTINCT unnest(%s::varchar[]) AS code
+
+## feuille
+{0} AS (
+    SELECT {1} AS code, {2}
+    FROM {3}
+    WHERE {1} IN (SELECT code FROM territoires)
+    GROUP BY {1}
+)
+
+## valeur
+CASE WHEN count(*) = 1 THEN max({0}::double precision) END AS {1}
+
+## valeur_annee
+CASE WHEN count(*) FILTER (WHERE annee = {2}) = 1 THEN max({0}::double precision) FILTER (WHERE annee = {2}) END AS {1}
+
+## lecture
+{0} AS MATERIALIZED (
+    SELECT territoires.code, {1}
+    FROM territoires {2}
+)
+
+## jointure
+LEFT JOIN {0} ON {0}.code = territoires.code
+
+## lue
+COALESCE(NULLIF({0}.{1}, 'NaN'), 0) AS {1}
+
+## etape
+{0} AS MATERIALIZED (
+    SELECT {1}.*, {2}
+    FROM {1}
+)
+
+## constante
+CAST('{0}' AS double precision)
+
+## addition
+({0} + {1})
+
+## soustraction
+({0} - {1})
+
+## multiplication
+({0} * {1})
+
+## division
+({0} / NULLIF({1}, 0))
+
+## oppose
+(-{0})
+
+## puissance
+power({0}, {1})
+
+## arrondi
+(CASE WHEN abs({0} - trunc({0})) = 0.5 THEN 2 * round({0} / 2) ELSE round({0}) END)
+
+## arrondi_decimales
+(CASE WHEN abs({0}::text::numeric * 1e{1} - trunc({0}::text::numeric * 1e{1})) = 0.5 THEN 2 * round({0}::text::numeric * 1e{1} / 2) / 1e{1} ELSE round({0}::text::numeric, {1}) END)::double precision
+
+## entier
+CASE WHEN abs({0}) < 9.2e18 THEN trunc({0})::bigint END
@@ -0,0 +1,320 @@
+"""
+Calcul des besoins pour toutes les régions
+
+Les régions (découpées en lots d'EPCI / de ZO pour les plus grandes) sont réparties
+sur un pool de processus. Chaque processus dispose de son propre pool de connexions
+et garde en mémoire les packs régionaux préchargés qu'il a déjà utilisés.
+Les résultats sont écrits au fil de l'eau dans un fichier CSV ou dans un répertoire
+de fichiers Parquet, et un fichier de reprise permet de relancer un calcul interrompu.
+
+Exemple :
+    python national.py resultats.csv --version 2 --processus 8
+"""
+
+import argparse
+import dataclasses
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from chargement import CATEGORIES_HEBERGEMENT, Data
+from entrepot import EntrepotIndicateurs
+from models import Hebergement, Parametres
+from moteursql import MoteurSQL
+from pg.pgutils import EcritureFlux, PoolConnexions
+from resultat import RegionResultat
+
+## packs régionaux préchargés du processus de calcul, par (région, version, entrepôt)
+_DATAS = {}
+## entrepôts ouverts par le processus de calcul, par chemin
+_ENTREPOTS = {}
+
+
+def parametre_standard():
+    """
+    Paramétrage par défaut du calcul national (paramètres par défaut, tous les hébergements)
+    """
+    return Parametres(
+        nom="Standard",
+        b11_etablissement=[
+            Hebergement(code, nom) for code, nom in CATEGORIES_HEBERGEMENT.items()
+        ],
+    )
+
+
+def _data(region, version, entrepot=None):
+    if (region, version, entrepot) not in _DATAS:
+        if entrepot is not None:
+            if entrepot not in _ENTREPOTS:
+                _ENTREPOTS[entrepot] = EntrepotIndicateurs(entrepot)
+            data = _ENTREPOTS[entrepot].data(region, version)
+        else:
+            data = Data.ouvrir(region, version, precharge=True)
+        _DATAS[(region, version, entrepot)] = data
+    return _DATAS[(region, version, entrepot)]
+
+
+def calculer_lot(
+    tache,
+    parametre,
+    periode_projection,
+    indicateurs=None,
+    entrepot=None,
+    moteur="python",
+):
+    """
+    Calcule un lot de territoires d'une région, dans un processus de calcul
+    tache : dictionnaire (id, region, version, niveau, codes)
+    entrepot : chemin de l'EntrepotIndicateurs partagé par les processus
+    moteur : "python" (RegionResultat) ou "sql" (MoteurSQL, calcul fait par la base
+    de données, sans entrepôt)
+    """
+    if moteur == "sql":
+        frame = MoteurSQL(
+            tache["region"], parametre, periode_projection, tache["version"]
+        ).calculer(tache["niveau"], tache["codes"], indicateurs)
+    else:
+        frame = RegionResultat(
+            tache["region"],
+            parametre,
+            periode_projection=periode_projection,
+            version=tache["version"],
+            niveau=tache["niveau"],
+            codes=tache["codes"],
+            data=_data(tache["region"], tache["version"], entrepot),
+        ).to_frame(indicateurs)
+    frame = frame.reset_index()
+    frame.insert(0, "niveau", tache["niveau"])
+    frame.insert(0, "region", tache["region"])
+    return frame
+
+
+def lister_taches(
+    regions, version=1, niveaux=("epci", "zo"), taille_lot=200, entrepot=None
+):
+    """
+    Découpe les territoires de chaque région en lots d'au plus taille_lot codes
+    """
+    taches = []
+    for region in regions:
+        data = (
+            _data(region, version, entrepot)
+            if entrepot
+            else Data.ouvrir(region, version)
+        )
+        for niveau in niveaux:
+            codes = sorted(data.epcis() if niveau == "epci" else data.zos())
+            for debut in range(0, len(codes), taille_lot):
+                taches.append(
+                    {
+                        "id": "r{0}_{1}_{2:05d}".format(region, niveau, debut),
+                        "region": region,
+                        "version": version,
+                        "niveau": niveau,
+                        "codes": codes[debut : debut + taille_lot],
+                    }
+                )
+    return taches
+
+
+def description_calcul(
+    parametre, periode_projection, version, indicateurs, taille_lot, moteur
+):
+    """
+    Renvoie la description (sérialisable en JSON) des réglages d'un calcul national,
+    conservée dans le fichier de reprise : un calcul n'est repris qu'avec les mêmes réglages
+    """
+    parametre = dataclasses.asdict(parametre)
+    parametre.pop("nom", None)
+    description = {
+        "parametre": parametre,
+        "periode_projection": periode_projection,
+        "version": version,
+        "indicateurs": list(indicateurs) if indicateurs else None,
+        "taille_lot": taille_lot,
+        "moteur": moteur,
+    }
+    return json.loads(json.dumps(description, sort_keys=True, default=str))
+
+
+class EcritureResultats:
+    """
+    Écriture incrémentale des lots calculés avec suivi de reprise
+
+    - sortie en .csv : un seul fichier CSV complété lot par lot
+    - sinon : un répertoire contenant un fichier Parquet par lot (pyarrow requis)
+
+    Le fichier de reprise (<sortie>.reprise.json) contient les réglages du calcul, les lots
+    déjà écrits et, pour le CSV, la taille du fichier correspondante afin d'écarter une
+    écriture interrompue. Sans reprise, les résultats précédents sont effacés.
+    """
+
+    def __init__(self, sortie, reprendre=True, calcul=None):
+        """
+        calcul : réglages du calcul (voir description_calcul) ; la reprise d'un calcul
+        fait avec d'autres réglages est refusée (ValueError)
+        """
+        self.sortie = sortie
+        self.csv = sortie.lower().endswith(".csv")
+        self.fichier_reprise = sortie + ".reprise.json"
+        self.calcul = calcul
+        self.faites = []
+        self.taille = 0
+        if reprendre and os.path.exists(self.fichier_reprise):
+            with open(self.fichier_reprise, "rt", encoding="utf-8") as f:
+                reprise = json.load(f)
+            if reprise.get("calcul") != calcul:
+                raise ValueError(
+                    "Le fichier de reprise "
+                    + self.fichier_reprise
+                    + " a été écrit par un calcul aux réglages différents"
+                    " (paramètres, période, version, indicateurs, taille des lots ou moteur) :"
+                    " relancer sans reprise ou changer de sortie"
+                )
+            self.faites = reprise["taches"]
+            self.taille = reprise.get("taille", 0)
+        elif os.path.exists(self.fichier_reprise):
+            os.remove(self.fichier_reprise)
+        if self.csv:
+            with open(self.sortie, "ab") as f:
+                f.truncate(self.taille)
+        else:
+            os.makedirs(self.sortie, exist_ok=True)
+            if not reprendre:
+                for fichier in glob.glob(os.path.join(self.sortie, "*.parquet")):
+                    os.remove(fichier)
+
+    def ecrire(self, id_tache, frame):
+        if self.csv:
+            ecriture = EcritureFlux(self.sortie, ajout=True)
+        else:
+            ecriture = EcritureFlux(os.path.join(self.sortie, id_tache + ".parquet"))
+        ecriture.ecrire(frame)
+        ecriture.fermer(synchroniser=True)
+        if self.csv:
+            self.taille = os.path.getsize(self.sortie)
+        self.faites.append(id_tache)
+        fichier_tmp = self.fichier_reprise + ".tmp"
+        with open(fichier_tmp, "wt", encoding="utf-8") as f:
+            json.dump(
+                {"calcul": self.calcul, "taches": self.faites, "taille": self.taille}, f
+            )
+        os.replace(fichier_tmp, self.fichier_reprise)
+
+
+def calcul_national(
+    sortie,
+    parametre=None,
+    version=1,
+    regions=None,
+    niveaux=("epci", "zo"),
+    periode_projection=6,
+    processus=None,
+    taille_lot=200,
+    reprendre=True,
+    indicateurs=None,
+    entrepot=None,
+    moteur="python",
+):
+    """
+    Calcule les résultats de toutes les régions (ou des régions indiquées) et les écrit dans sortie
+    entrepot : répertoire d'un EntrepotIndicateurs (complété des régions absentes ou
+    périmées) dont les données projetées en mémoire sont partagées par tous les processus
+    moteur : "python", ou "sql" pour que chaque lot soit calculé par la base de données
+    Renvoie le nombre de lots calculés.
+    """
+    parametre = parametre or parametre_standard()
+    regions = regions or Data.regions(version)
+    if entrepot is not None:
+        EntrepotIndicateurs.preparer(entrepot, regions, version)
+    taches = lister_taches(regions, version, niveaux, taille_lot, entrepot)
+    calcul = description_calcul(
+        parametre, periode_projection, version, indicateurs, taille_lot, moteur
+    )
+    ecriture = EcritureResultats(sortie, reprendre=reprendre, calcul=calcul)
+    taches = [t for t in taches if t["id"] not in ecriture.faites]
+    # les processus de calcul ouvrent leurs propres connexions
+    PoolConnexions.fermer_pools_partages()
+    debut = time.time()
+    with ProcessPoolExecutor(
+        max_workers=processus, mp_context=multiprocessing.get_context("spawn")
+    ) as executeur:
+        futurs = {
+            executeur.submit(
+                calculer_lot,
+                tache,
+                parametre,
+                periode_projection,
+                indicateurs,
+                entrepot,
+                moteur,
+            ): tache
+            for tache in taches
+        }
+        try:
+            for numero, futur in enumerate(as_completed(futurs), start=1):
+                tache = futurs[futur]
+                frame = futur.result()
+                ecriture.ecrire(tache["id"], frame)
+                print(
+                    "[{0}/{1}] {2} : {3} territoires ({4:.1f} s)".format(
+                        numero,
+                        len(taches),
+                        tache["id"],
+                        len(frame),
+                        time.time() - debut,
+                    ),
+                    file=sys.stderr,
+                )
+        except BaseException:
+            # lots en attente annulés : seuls les lots en cours sont attendus à la sortie
+            executeur.shutdown(wait=False, cancel_futures=True)
+            raise
+    return len(taches)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calcul national des besoins")
+    parser.add_argument("sortie", help="fichier .csv ou répertoire Parquet de sortie")
+    parser.add_argument("--version", type=int, default=1)
+    parser.add_argument("--regions", nargs="*", help="codes région (défaut : toutes)")
+    parser.add_argument(
+        "--niveaux", nargs="*", choices=("epci", "zo"), default=("epci", "zo")
+    )
+    parser.add_argument("--periode", type=int, default=6)
+    parser.add_argument("--processus", type=int, default=None)
+    parser.add_argument("--taille-lot", type=int, default=200)
+    parser.add_argument(
+        "--sans-reprise",
+        action="store_true",
+        help="ignore le fichier de reprise et recommence le calcul (résultats précédents effacés)",
+    )
+    parser.add_argument(
+        "--entrepot",
+        help="répertoire de l'entrepôt des indicateurs partagé par les processus (complété si besoin)",
+    )
+    parser.add_argument(
+        "--moteur",
+        choices=("python", "sql"),
+        default="python",
+        help="calcul en Python ou par la base de données (une requête par lot)",
+    )
+    args = parser.parse_args()
+    calcul_national(
+        args.sortie,
+        version=args.version,
+        regions=args.regions,
+        niveaux=args.niveaux,
+        periode_projection=args.periode,
+        processus=args.processus,
+        taille_lot=args.taille_lot,
+        reprendre=not args.sans_reprise,
+        entrepot=args.entrepot,
+        moteur=args.moteur,
+    )
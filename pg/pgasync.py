@@ -0,0 +1,119 @@
+import asyncio
+import time
+import weakref
+
+import pandas as pd
+
+from pg.pgutils import PGScript, chaine_connexion, numeroter_marqueurs
+
+## dépendance optionnelle, nécessaire uniquement pour les accès asynchrones
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+
+def requete_asyncpg(sql):
+    """
+    Convertit les marqueurs de paramètres psycopg2 (%s) d'une requête en marqueurs asyncpg ($1, $2...)
+    """
+    return numeroter_marqueurs(sql)
+
+
+class PoolAsync:
+    """
+    Pool de connexions PostgreSQL asynchrone (asyncpg) partagé par boucle d'évènements
+
+    Le pool asyncpg n'est créé qu'à la première requête.
+    Les requêtes utilisent les marqueurs de paramètres psycopg2 (%s), convertis pour asyncpg.
+    """
+
+    ## pools partagés, par boucle d'évènements puis par paramètres de connexion
+    _POOLS = weakref.WeakKeyDictionary()
+
+    def __init__(
+        self,
+        hote=None,
+        base=None,
+        port=None,
+        utilisateur=None,
+        motdepasse=None,
+        min_connexions=1,
+        max_connexions=10,
+    ):
+        self.hote = hote
+        self.base = base
+        self.port = port
+        self.utilisateur = utilisateur
+        self.motdepasse = motdepasse
+        self.min_connexions = min_connexions
+        self.max_connexions = max_connexions
+        self._pool = None
+        self._verrou = None
+
+    @classmethod
+    def partage(
+        cls,
+        hote=None,
+        base=None,
+        port=None,
+        utilisateur=None,
+        motdepasse=None,
+        **options
+    ):
+        """
+        Renvoie le pool partagé de la boucle d'évènements courante pour ces paramètres de connexion
+        """
+        pools = cls._POOLS.setdefault(asyncio.get_running_loop(), {})
+        clef = (hote, base, str(port), utilisateur, motdepasse)
+        if clef not in pools:
+            pools[clef] = cls(hote, base, port, utilisateur, motdepasse, **options)
+        return pools[clef]
+
+    @property
+    def dsn(self):
+        """
+        Chaîne de connexion (sans mot de passe) de la base de données du pool
+        """
+        return chaine_connexion(self.hote, self.base, self.port, self.utilisateur)
+
+    async def pool(self):
+        if asyncpg is None:
+            raise ImportError(
+                "Le module asyncpg est nécessaire pour les accès asynchrones à la base"
+            )
+        if self._verrou is None:
+            self._verrou = asyncio.Lock()
+        async with self._verrou:
+            if self._pool is None:
+                self._pool = await asyncpg.create_pool(
+                    host=self.hote,
+                    database=self.base,
+                    port=int(self.port) if self.port else None,
+                    user=self.utilisateur,
+                    password=self.motdepasse,
+                    min_size=self.min_connexions,
+                    max_size=self.max_connexions,
+                )
+        return self._pool
+
+    async def dataframe(self, sql, *parametres):
+        """
+        Exécute une requête de sélection et renvoie le résultat sous forme de Dataframe
+        """
+        pool = await self.pool()
+        debut = time.time()
+        async with pool.acquire() as connexion:
+            requete = await connexion.prepare(requete_asyncpg(sql))
+            lignes = await requete.fetch(*parametres)
+            colonnes = [attribut.name for attribut in requete.get_attributes()]
+        if PGScript.OBSERVATEURS:
+            PGScript.notifier("async", sql, time.time() - debut, len(lignes))
+        return pd.DataFrame.from_records(
+            [tuple(ligne) for ligne in lignes], columns=colonnes
+        )
+
+    async def fermer(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
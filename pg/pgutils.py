@@ -1,17 +1,51 @@
 import csv
 import datetime
+import hashlib
 import inspect
+import itertools
+import re
 import logging
+import math
 import os
+import threading
 import time
 import types
+from contextlib import contextmanager
 from random import randint
 from logging.handlers import RotatingFileHandler
 
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 import pandas as pd
 
 
+def identifiant(nom):
+    """
+    Renvoie l'identifiant SQL (schéma, table, colonne) entre guillemets, les guillemets internes étant doublés
+    """
+    return '"' + str(nom).replace('"', '""') + '"'
+
+
+def chaine_connexion(hote=None, base=None, port=None, utilisateur=None):
+    """
+    Renvoie la chaîne de connexion (sans mot de passe) qui identifie une base de données,
+    par exemple "postgresql://otelo@localhost:5432/otelo"
+    """
+    return "postgresql://{0}@{1}:{2}/{3}".format(
+        utilisateur or "", hote or "", port or "", base or ""
+    )
+
+
+def numeroter_marqueurs(sql):
+    """
+    Convertit les marqueurs de paramètres psycopg2 (%s) d'une requête en marqueurs numérotés ($1, $2...)
+    """
+    numero = iter(range(1, sql.count("%s") + 1))
+    sql = re.sub(r"(?<!%)%s", lambda m: "$" + str(next(numero)), sql)
+    return sql.replace("%%", "%")
+
+
 ## DECORATEURS
 def change_args(nom_requete_sql):
     """
@@ -37,6 +71,19 @@ class PGScript:
 
     SCRIPTFILE = None
     LOGFILE = None
+    ## requêtes préparées côté serveur (PREPARE) sur chaque connexion lors de leur première exécution
+    REQUETES_PREPAREES = frozenset()
+
+    ## observateurs (Profileur) notifiés de chaque requête exécutée
+    OBSERVATEURS = ()
+
+    ## requêtes lues par fichier .sql : {fichier: (date de modification, requetes, formats)}
+    _FICHIERS_SQL = {}
+    ## requêtes réunies par classe : {classe: (fichiers et dates, requetes, formats)}
+    _REQUETES_CLASSES = {}
+    ## fonctions associées aux requêtes, par nom de requête
+    _FONCTIONS_REQUETES = {}
+    _VERROU_REQUETES = threading.Lock()
 
     def __init__(
         self,
@@ -46,12 +93,18 @@ class PGScript:
         utilisateur=None,
         motdepasse=None,
         log=True,
+        pool=None,
     ):
         """
         Constructeur
-        Se connecte directement à la base de données
+        Se connecte directement à la base de données, sauf si un pool est précisé :
+        - pool=True : utilise le pool partagé du processus pour ces paramètres de connexion
+        - pool=PoolConnexions(...) : utilise le pool fourni
+        Dans ces deux cas, les connexions sont empruntées au pool à chaque requête.
         """
-        self.conn = Connexion(hote, base, port, utilisateur, motdepasse)
+        if pool is True:
+            pool = PoolConnexions.partage(hote, base, port, utilisateur, motdepasse)
+        self.conn = Connexion(hote, base, port, utilisateur, motdepasse, pool=pool)
         self.log = log
         self.max_tentative = 3
         ## dicts pour enregistrer toutes les requetes SQL et les éventuels formats imposés à certaines requetes
@@ -78,20 +131,53 @@ class PGScript:
         """
         Charge la variable requete_sql avec toutes les requetes SQL
         de sa classe et des classes éventuelles dont elle hérite
+        Les requêtes sont lues une seule fois par classe et relues si un fichier .sql est modifié.
+        Les dictionnaires renvoyés sont partagés par toutes les instances de la classe.
         """
-        requetes = {}
-        format_requetes = {}
-        for classe in inspect.getmro(self.__class__):
+        classe_objet = self.__class__
+        fichiers = []
+        for classe in inspect.getmro(classe_objet):
             if classe != type(object()):
                 try:
                     fichier_script_classe = classe.fichier_script()
-                    self._charger_requete_sql_depuis(
-                        fichier_script_classe, requetes, format_requetes
+                    fichiers.append(
+                        (fichier_script_classe, os.path.getmtime(fichier_script_classe))
                     )
                 except (OSError, IOError, FileNotFoundError) as e:
                     print(e)
+        fichiers = tuple(fichiers)
+        with PGScript._VERROU_REQUETES:
+            en_cache = PGScript._REQUETES_CLASSES.get(classe_objet)
+            if en_cache is not None and en_cache[0] == fichiers:
+                return en_cache[1], en_cache[2]
+            requetes = {}
+            format_requetes = {}
+            for fichier, date_modification in fichiers:
+                requetes_fichier, formats_fichier = self._requetes_fichier(
+                    fichier, date_modification
+                )
+                requetes.update(requetes_fichier)
+                format_requetes.update(formats_fichier)
+            PGScript._REQUETES_CLASSES[classe_objet] = (
+                fichiers,
+                requetes,
+                format_requetes,
+            )
         return requetes, format_requetes
 
+    def _requetes_fichier(self, fichier, date_modification):
+        """
+        Renvoie les requêtes et formats d'un fichier .sql, lu seulement s'il est nouveau ou modifié
+        """
+        en_cache = PGScript._FICHIERS_SQL.get(fichier)
+        if en_cache is None or en_cache[0] != date_modification:
+            requetes = {}
+            format_requetes = {}
+            self._charger_requete_sql_depuis(fichier, requetes, format_requetes)
+            en_cache = (date_modification, requetes, format_requetes)
+            PGScript._FICHIERS_SQL[fichier] = en_cache
+        return en_cache[1], en_cache[2]
+
     def _charger_requete_sql_depuis(self, fichier, requetes, format_requetes):
         """
         Lit un fichier de requetes et intègre les requetes dans requete_sql
@@ -156,7 +242,22 @@ class PGScript:
         cls._changement_filehandler(cls.get_logger())
 
     def __getattr__(self, nom):
-        if nom in self.requete_sql or nom == "execution":
+        requetes = self.__dict__.get("requete_sql", {})
+        if nom in requetes or nom == "execution":
+            # la méthode liée est conservée sur l'instance : les appels suivants ne passent plus ici
+            methode = types.MethodType(self._fonction_requete(nom), self)
+            self.__dict__[nom] = methode
+            return methode
+        else:
+            raise AttributeError("Méthode non définie")
+
+    @staticmethod
+    def _fonction_requete(nom):
+        """
+        Renvoie la fonction exécutant la requete nom, créée une seule fois par nom de requête
+        """
+        fonction = PGScript._FONCTIONS_REQUETES.get(nom)
+        if fonction is None:
 
             def fonction(self, *args, **kwargs):
                 # on récupère les options eventuelles, sinon on applique le format imposé défini, sinon les paramètres par défaut de l'objet
@@ -167,11 +268,21 @@ class PGScript:
                 max_tentative = kwargs.get("max_tentative", self.max_tentative)
                 no_log = kwargs.get("no_log", False)
                 log = self.log and not no_log
+                # valeurs liées aux marqueurs %s de la requête (transmises séparément au serveur)
+                parametres = kwargs.get("parametres", None)
+                preparer = kwargs.get("preparer", nom in self.REQUETES_PREPAREES)
                 if nom != "execution":
                     sql = self.requete_sql[nom].format(*args)
                 else:
                     sql = args[0]
-                resultat = self.executer_requete(sql, max_tentative=3, log=log)
+                resultat = self.executer_requete(
+                    sql,
+                    max_tentative=3,
+                    log=log,
+                    parametres=parametres,
+                    preparer=preparer,
+                    nom=nom,
+                )
                 if resultat is None:
                     return False, -1
                 if csvfile:
@@ -190,18 +301,31 @@ class PGScript:
                     return resultat.dataframe
                 return resultat
 
-            methode = types.MethodType(fonction, self)
-            return methode
-        else:
-            raise AttributeError("Méthode non définie")
+            PGScript._FONCTIONS_REQUETES[nom] = fonction
+        return fonction
 
-    def executer_requete(self, sql, max_tentative=3, log=True):
+    def executer_requete(
+        self,
+        sql,
+        max_tentative=3,
+        log=True,
+        parametres=None,
+        preparer=False,
+        nom=None,
+    ):
+        """
+        Exécute la requête (jusqu'à max_tentative fois en cas d'échec)
+        Chaque tentative est transmise aux observateurs (Profileur) éventuellement attachés.
+        """
         tentative = 1
         while tentative <= max_tentative:
             try:
                 start_time = time.time()
-                resultat = self.conn.executer(sql)
+                resultat = self.conn.executer(sql, parametres, preparer)
                 exec_time = time.time() - start_time
+                if self.OBSERVATEURS:
+                    lignes = len(resultat.data) if resultat.data else 0
+                    self.notifier(nom, sql, exec_time, lignes)
                 if log:
                     logger = self.get_logger()
                     logger.info(sql)
@@ -210,6 +334,7 @@ class PGScript:
                     )
                 return resultat
             except Exception as e:
+                self.notifier(nom, sql, time.time() - start_time, 0, e)
                 print(e)
                 print("Tentative " + str(tentative) + " échouée...")
                 if tentative == max_tentative:
@@ -219,6 +344,61 @@ class PGScript:
                 tentative += 1
         return None
 
+    def iterer_requete(self, sql, parametres=None, taille_lot=10000, nom=None):
+        """
+        Renvoie les lignes de la requête par lots (description des colonnes, lignes),
+        lues dans un curseur nommé côté serveur : le résultat n'est jamais chargé
+        entièrement en mémoire. La lecture complète est transmise aux observateurs.
+        """
+        debut = time.time()
+        nb_lignes = 0
+        try:
+            for description, lignes in self.conn.iterer(sql, parametres, taille_lot):
+                nb_lignes += len(lignes)
+                yield description, lignes
+        except Exception as e:
+            self.notifier(nom, sql, time.time() - debut, nb_lignes, e)
+            raise
+        if self.OBSERVATEURS:
+            self.notifier(nom, sql, time.time() - debut, nb_lignes)
+
+    def exporter(self, sql, fichier, parametres=None, taille_lot=10000, **options):
+        """
+        Écrit le résultat de la requête dans fichier (CSV, ou Parquet si son extension
+        est .parquet) au fil de sa lecture par lots, voir EcritureFlux pour les options.
+        Renvoie le nombre de lignes écrites.
+        """
+        lots = self.iterer_requete(sql, parametres, taille_lot, nom="exporter")
+        try:
+            description, lignes = next(lots)
+            colonnes = [colonne.name for colonne in description]
+            types = {
+                colonne.name: TYPES_FLUX[colonne.type_code]
+                for colonne in description
+                if colonne.type_code in TYPES_FLUX
+            }
+            options.setdefault("types", types)
+            options.setdefault("lignes_par_groupe", taille_lot)
+            with EcritureFlux(fichier, colonnes, **options) as ecriture:
+                ecriture.ecrire_lignes(lignes)
+                for _, lignes in lots:
+                    ecriture.ecrire_lignes(lignes)
+        finally:
+            # en cas d'erreur d'écriture, le curseur côté serveur est fermé et la connexion
+            # rendue au pool immédiatement, sans attendre le ramasse-miettes
+            lots.close()
+        return ecriture.lignes
+
+    @classmethod
+    def notifier(cls, nom, sql, duree, lignes, erreur=None):
+        """
+        Transmet une requête exécutée (durée, nombre de lignes lues) aux observateurs attachés
+        """
+        if cls.OBSERVATEURS:
+            cadre = inspect.currentframe().f_back
+            for observateur in cls.OBSERVATEURS:
+                observateur.enregistrer(nom, sql, duree, lignes, erreur, cadre)
+
     def effacer_schemas(self, schemas):
         """
         Supprime les schemas de la base de données en CASCADE.
@@ -413,11 +593,462 @@ class PGScript:
         )
 
 
+class Profileur:
+    """
+    Profileur des requêtes exécutées (PGScript, PoolAsync) pendant qu'il est attaché
+
+    Chaque requête est enregistrée avec son nom, sa durée, le nombre de lignes lues et,
+    pour chaque classe d'attribution, la méthode publique de cette classe la plus proche
+    dans la pile d'appels au moment de la requête.
+    Les statistiques sont disponibles sous forme de dictionnaire ou de texte OpenMetrics.
+
+    Exemple :
+        with Profileur(data=Data, resultat=Resultat) as profileur:
+            EPCIResultat(epci).besoin_total()
+        profileur.statistiques()["par_resultat"]
+    """
+
+    ## quantiles calculés sur les durées
+    QUANTILES = (0.5, 0.9, 0.99)
+    ## préfixe des métriques OpenMetrics
+    PREFIXE = "otelo_sql"
+
+    def __init__(self, **attributions):
+        """
+        attributions : {etiquette: classe}, ex. data=Data, resultat=Resultat
+        """
+        self.attributions = attributions
+        self.requetes = []
+        self._verrou = threading.Lock()
+
+    def __enter__(self):
+        self.attacher()
+        return self
+
+    def __exit__(self, *exc):
+        self.detacher()
+
+    def attacher(self):
+        with PGScript._VERROU_REQUETES:
+            if self not in PGScript.OBSERVATEURS:
+                PGScript.OBSERVATEURS = PGScript.OBSERVATEURS + (self,)
+
+    def detacher(self):
+        with PGScript._VERROU_REQUETES:
+            PGScript.OBSERVATEURS = tuple(
+                o for o in PGScript.OBSERVATEURS if o is not self
+            )
+
+    def vider(self):
+        with self._verrou:
+            self.requetes = []
+
+    def _origine(self, cadre):
+        """
+        Renvoie {etiquette: nom de méthode} des méthodes des classes d'attribution
+        en cours d'exécution, en remontant la pile d'appels depuis cadre
+        """
+        origine = {}
+        restantes = dict(self.attributions)
+        while cadre is not None and restantes:
+            code = cadre.f_code
+            if (
+                code.co_argcount
+                and code.co_varnames[0] == "self"
+                and not code.co_name.startswith("_")
+                and code.co_name != "interne"
+            ):
+                objet = cadre.f_locals.get("self")
+                for etiquette, classe in list(restantes.items()):
+                    if isinstance(objet, classe):
+                        origine[etiquette] = code.co_name
+                        del restantes[etiquette]
+            cadre = cadre.f_back
+        return origine
+
+    def enregistrer(self, nom, sql, duree, lignes, erreur=None, cadre=None):
+        requete = {
+            "requete": nom or sql.split(None, 1)[0].upper(),
+            "duree": duree,
+            "lignes": lignes,
+            "echec": erreur is not None,
+        }
+        requete.update(self._origine(cadre))
+        with self._verrou:
+            self.requetes.append(requete)
+
+    @classmethod
+    def _quantile(cls, durees_triees, quantile):
+        rang = max(math.ceil(quantile * len(durees_triees)) - 1, 0)
+        return durees_triees[rang]
+
+    @classmethod
+    def _resume(cls, requetes):
+        durees = sorted(r["duree"] for r in requetes)
+        resume = {
+            "requetes": len(requetes),
+            "echecs": sum(r["echec"] for r in requetes),
+            "lignes": sum(r["lignes"] for r in requetes),
+            "duree_totale_s": sum(durees),
+        }
+        for quantile in cls.QUANTILES:
+            resume["duree_p{0:g}_s".format(quantile * 100)] = (
+                cls._quantile(durees, quantile) if durees else 0.0
+            )
+        return resume
+
+    def statistiques(self):
+        """
+        Renvoie les statistiques globales et, par nom de requête ("par_requete")
+        et par méthode de chaque classe d'attribution ("par_<etiquette>"), celles de chaque groupe
+        """
+        with self._verrou:
+            requetes = list(self.requetes)
+        statistiques = self._resume(requetes)
+        for critere in ("requete",) + tuple(self.attributions):
+            groupes = {}
+            for requete in requetes:
+                groupes.setdefault(requete.get(critere, ""), []).append(requete)
+            statistiques["par_" + critere] = {
+                valeur: self._resume(groupe)
+                for valeur, groupe in sorted(groupes.items())
+            }
+        return statistiques
+
+    @staticmethod
+    def _etiquettes(valeurs):
+        return ",".join(
+            '{0}="{1}"'.format(
+                nom,
+                str(valeur)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for nom, valeur in valeurs.items()
+        )
+
+    def openmetrics(self):
+        """
+        Renvoie les métriques au format texte OpenMetrics, par nom de requête et origine
+        """
+        with self._verrou:
+            requetes = list(self.requetes)
+        criteres = ("requete",) + tuple(self.attributions)
+        groupes = {}
+        for requete in requetes:
+            clef = tuple(requete.get(critere, "") for critere in criteres)
+            groupes.setdefault(clef, []).append(requete)
+        prefixe = self.PREFIXE
+        requetes_total = [
+            "# TYPE {0}_requetes counter".format(prefixe),
+            "# HELP {0}_requetes Requêtes SQL exécutées".format(prefixe),
+        ]
+        lignes_total = [
+            "# TYPE {0}_lignes counter".format(prefixe),
+            "# HELP {0}_lignes Lignes lues".format(prefixe),
+        ]
+        durees = [
+            "# TYPE {0}_duree_seconds summary".format(prefixe),
+            "# UNIT {0}_duree_seconds seconds".format(prefixe),
+            "# HELP {0}_duree_seconds Durée d'exécution des requêtes".format(prefixe),
+        ]
+        for clef, groupe in sorted(groupes.items()):
+            etiquettes = self._etiquettes(dict(zip(criteres, clef)))
+            resume = self._resume(groupe)
+            requetes_total.append(
+                "{0}_requetes_total{{{1}}} {2}".format(
+                    prefixe, etiquettes, resume["requetes"]
+                )
+            )
+            lignes_total.append(
+                "{0}_lignes_total{{{1}}} {2}".format(
+                    prefixe, etiquettes, resume["lignes"]
+                )
+            )
+            durees_triees = sorted(r["duree"] for r in groupe)
+            for quantile in self.QUANTILES:
+                durees.append(
+                    '{0}_duree_seconds{{{1},quantile="{2:g}"}} {3!r}'.format(
+                        prefixe,
+                        etiquettes,
+                        quantile,
+                        self._quantile(durees_triees, quantile),
+                    )
+                )
+            durees.append(
+                "{0}_duree_seconds_sum{{{1}}} {2!r}".format(
+                    prefixe, etiquettes, resume["duree_totale_s"]
+                )
+            )
+            durees.append(
+                "{0}_duree_seconds_count{{{1}}} {2}".format(
+                    prefixe, etiquettes, resume["requetes"]
+                )
+            )
+        return "\n".join(requetes_total + lignes_total + durees + ["# EOF"]) + "\n"
+
+
+class PoolConnexions:
+    """
+    Pool de connexions PostgreSQL pouvant être partagé par plusieurs objets Connexion / PGScript
+
+    Les connexions sont ouvertes à la demande (aucune connexion n'est ouverte à la création du pool),
+    dans la limite de max_connexions. Au premier emprunt, le pool est complété jusqu'à min_connexions.
+    Une connexion restée inactive plus de delai_verification secondes est testée avant d'être prêtée.
+    """
+
+    ## pools partagés du processus, indexés par paramètres de connexion
+    _POOLS = {}
+    _VERROU_POOLS = threading.Lock()
+
+    def __init__(
+        self,
+        hote=None,
+        base=None,
+        port=None,
+        utilisateur=None,
+        motdepasse=None,
+        min_connexions=1,
+        max_connexions=10,
+        delai_verification=30,
+        delai_attente=60,
+        client_encoding="UTF-8",
+    ):
+        if min_connexions < 0 or max_connexions < 1 or min_connexions > max_connexions:
+            raise ValueError(
+                "Il faut 0 <= min_connexions <= max_connexions et max_connexions >= 1"
+            )
+        self.hote = hote
+        self.base = base
+        self.port = port
+        self.utilisateur = utilisateur
+        self.motdepasse = motdepasse
+        self.min_connexions = min_connexions
+        self.max_connexions = max_connexions
+        self.delai_verification = delai_verification
+        self.delai_attente = delai_attente
+        self.client_encoding = client_encoding
+        self.pid = os.getpid()
+        self._libres = []  # liste de tuples (connexion, date de dernière utilisation)
+        self._nb_ouvertes = 0
+        self._condition = threading.Condition()
+
+    @classmethod
+    def partage(
+        cls,
+        hote=None,
+        base=None,
+        port=None,
+        utilisateur=None,
+        motdepasse=None,
+        **options
+    ):
+        """
+        Renvoie le pool partagé du processus pour ces paramètres de connexion, en le créant si besoin.
+        Les options (min_connexions, max_connexions...) ne sont prises en compte qu'à la création.
+        Un processus fils (fork) ne réutilise jamais le pool de son parent.
+        """
+        clef = (hote, base, str(port), utilisateur, motdepasse)
+        with cls._VERROU_POOLS:
+            pool = cls._POOLS.get(clef)
+            if pool is None or pool.pid != os.getpid():
+                pool = cls(hote, base, port, utilisateur, motdepasse, **options)
+                cls._POOLS[clef] = pool
+            return pool
+
+    @classmethod
+    def fermer_pools_partages(cls):
+        """
+        Ferme toutes les connexions des pools partagés du processus
+        """
+        with cls._VERROU_POOLS:
+            pools = list(cls._POOLS.values())
+            cls._POOLS.clear()
+        for pool in pools:
+            if pool.pid == os.getpid():
+                pool.fermer()
+
+    def _ouvrir(self):
+        connexion = psycopg2.connect(
+            host=self.hote,
+            dbname=self.base,
+            user=self.utilisateur,
+            password=self.motdepasse,
+            port=self.port,
+            connection_factory=ConnexionPostgres,
+        )
+        connexion.set_client_encoding(self.client_encoding)
+        return connexion
+
+    def _est_valide(self, connexion, derniere_utilisation):
+        """
+        Vérifie l'état d'une connexion libre avant de la prêter
+        """
+        if connexion.closed:
+            return False
+        if time.time() - derniere_utilisation < self.delai_verification:
+            return True
+        try:
+            with connexion.cursor() as curseur:
+                curseur.execute("SELECT 1;")
+            connexion.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _fermer_connexion(self, connexion):
+        try:
+            connexion.close()
+        except Exception:
+            pass
+
+    def _liberer_places(self, nombre=1):
+        """
+        Libère des places réservées (ou des connexions abandonnées) et réveille les emprunteurs en attente
+        """
+        with self._condition:
+            self._nb_ouvertes -= nombre
+            self._condition.notify(nombre)
+
+    def _completer(self):
+        """
+        Ouvre les connexions manquantes pour atteindre min_connexions. Les places sont réservées
+        sous le verrou, les connexions ouvertes en dehors pour ne pas bloquer les autres threads.
+        """
+        with self._condition:
+            manquantes = max(self.min_connexions - self._nb_ouvertes, 0)
+            self._nb_ouvertes += manquantes
+        for numero in range(manquantes):
+            try:
+                connexion = self._ouvrir()
+            except Exception:
+                self._liberer_places(manquantes - numero)
+                raise
+            with self._condition:
+                self._libres.append((connexion, time.time()))
+                self._condition.notify()
+
+    def emprunter(self):
+        """
+        Emprunte une connexion au pool. Attend au plus delai_attente secondes
+        qu'une connexion se libère si max_connexions est atteint.
+        L'ouverture et la vérification d'une connexion sont faites hors du verrou du pool :
+        une connexion lente ne bloque ni les autres emprunts ni les retours (rendre).
+        """
+        limite = time.time() + self.delai_attente
+        self._completer()
+        while True:
+            with self._condition:
+                while True:
+                    if self._libres:
+                        connexion, derniere_utilisation = self._libres.pop()
+                        break
+                    if self._nb_ouvertes < self.max_connexions:
+                        # place réservée, connexion ouverte hors du verrou
+                        self._nb_ouvertes += 1
+                        connexion = None
+                        break
+                    restant = limite - time.time()
+                    if restant <= 0 or not self._condition.wait(restant):
+                        raise TimeoutError(
+                            "Aucune connexion disponible dans le pool après "
+                            + str(self.delai_attente)
+                            + " s"
+                        )
+            if connexion is None:
+                try:
+                    return self._ouvrir()
+                except Exception:
+                    self._liberer_places()
+                    raise
+            if self._est_valide(connexion, derniere_utilisation):
+                return connexion
+            self._fermer_connexion(connexion)
+            self._liberer_places()
+
+    def rendre(self, connexion, defectueuse=False):
+        """
+        Rend une connexion au pool. Une connexion fermée ou défectueuse est abandonnée.
+        """
+        with self._condition:
+            if not defectueuse and not connexion.closed:
+                try:
+                    if (
+                        connexion.get_transaction_status()
+                        != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                    ):
+                        connexion.rollback()
+                    self._libres.append((connexion, time.time()))
+                    self._condition.notify()
+                    return
+                except Exception:
+                    pass
+            self._fermer_connexion(connexion)
+            self._nb_ouvertes -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def connexion(self):
+        """
+        Gestionnaire de contexte empruntant une connexion et la rendant en sortie
+        """
+        connexion = self.emprunter()
+        defectueuse = False
+        try:
+            yield connexion
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            defectueuse = True
+            raise
+        finally:
+            self.rendre(connexion, defectueuse=defectueuse)
+
+    def fermer(self):
+        """
+        Ferme toutes les connexions libres du pool
+        """
+        with self._condition:
+            for connexion, _ in self._libres:
+                self._fermer_connexion(connexion)
+            self._nb_ouvertes -= len(self._libres)
+            self._libres = []
+
+    @property
+    def dsn(self):
+        """
+        Chaîne de connexion (sans mot de passe) de la base de données du pool
+        """
+        return chaine_connexion(self.hote, self.base, self.port, self.utilisateur)
+
+    @property
+    def statistiques(self):
+        with self._condition:
+            return {
+                "ouvertes": self._nb_ouvertes,
+                "libres": len(self._libres),
+                "min": self.min_connexions,
+                "max": self.max_connexions,
+            }
+
+
+class ConnexionPostgres(psycopg2.extensions.connection):
+    """
+    Connexion psycopg2 qui garde la liste des requêtes préparées sur le serveur pour cette session
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requetes_preparees = set()
+
+
 class Connexion:
     """
     Classe permettant de se connecter à une base Postgresql
     """
 
+    ## numéros des curseurs nommés (côté serveur) ouverts par iterer()
+    _NUMEROS_CURSEURS = itertools.count()
+
     def __init__(
         self,
         hote=None,
@@ -426,6 +1057,7 @@ class Connexion:
         utilisateur=None,
         motdepasse=None,
         connexion_directe=True,
+        pool=None,
     ):
         """
         Constructeur qui prend les paramètres de connexion suivant:
@@ -436,6 +1068,8 @@ class Connexion:
 
         Par défaut, se connecte directement à la base.
         Pour ne pas se connecter directement, mettre connexion_directe à False.
+        Si un pool (PoolConnexions) est fourni, aucune connexion propre n'est ouverte :
+        une connexion est empruntée au pool pour chaque exécution.
         """
         self.connexion = None
         self.conn_actif = False
@@ -444,9 +1078,19 @@ class Connexion:
         self.utilisateur = utilisateur
         self.motdepasse = motdepasse
         self.port = port
+        self.pool = pool
         if connexion_directe:
             self.connexion_postgres()
 
+    @property
+    def dsn(self):
+        """
+        Chaîne de connexion (sans mot de passe) de la base interrogée : celle du pool s'il est fourni
+        """
+        if self.pool is not None:
+            return self.pool.dsn
+        return chaine_connexion(self.hote, self.base, self.port, self.utilisateur)
+
     def connexion_postgres(self, client_encoding="UTF-8"):
         """
         Connexion à la base PostgreSQL via les paramètres
@@ -454,7 +1098,11 @@ class Connexion:
 
         L'encodage du client est considéré par défaut comme du UTF-8.
         Il peut etre modifier par l'argument client_encoding.
+        Avec un pool, la connexion est établie paresseusement par le pool.
         """
+        if self.pool is not None:
+            self.conn_actif = True
+            return
         try:
             self.connexion = psycopg2.connect(
                 host=self.hote,
@@ -462,6 +1110,7 @@ class Connexion:
                 user=self.utilisateur,
                 password=self.motdepasse,
                 port=self.port,
+                connection_factory=ConnexionPostgres,
             )
             self.connexion.set_client_encoding(client_encoding)
             self.conn_actif = True
@@ -472,17 +1121,44 @@ class Connexion:
     def deconnexion_postgres(self):
         """
         Deconnexion de la base PostgreSQL si la connexion était établie
+        Avec un pool, les connexions restent gérées par le pool.
         """
+        if self.pool is not None:
+            self.conn_actif = False
+            return
         try:
             self.connexion.close()
             self.conn_actif = False
         except Exception as e:
             print("Problème de déconnexion : ", str(e))
 
-    def executer(self, sql):
-        with self.connexion:
-            with self.connexion.cursor() as curseur:
-                curseur.execute(sql)
+    @contextmanager
+    def _connexion_active(self):
+        """
+        Fournit la connexion à utiliser : la connexion propre ou une connexion empruntée au pool
+        """
+        if self.pool is None:
+            yield self.connexion
+        else:
+            with self.pool.connexion() as connexion:
+                yield connexion
+
+    def executer(self, sql, parametres=None, preparer=False):
+        """
+        Exécute la requête, les éventuels parametres étant liés aux marqueurs %s de la requête
+        Avec preparer, la requête est préparée côté serveur (PREPARE) une seule fois par connexion.
+        """
+        with self._connexion_active() as connexion:
+            return self._executer_sur(connexion, sql, parametres, preparer)
+
+    def _executer_sur(self, connexion, sql, parametres=None, preparer=False):
+        with connexion:
+            with connexion.cursor() as curseur:
+                preparees = getattr(connexion, "requetes_preparees", None)
+                if preparer and parametres is not None and preparees is not None:
+                    self._executer_preparee(curseur, preparees, sql, parametres)
+                else:
+                    curseur.execute(sql, parametres)
                 resultat = Resultat.from_cursor(curseur)
                 return resultat
                 if curseur.description:
@@ -491,9 +1167,45 @@ class Connexion:
                     return curseur.rowcount
         return None
 
+    def iterer(self, sql, parametres=None, taille_lot=10000):
+        """
+        Exécute la requête dans un curseur nommé (côté serveur) et renvoie ses lignes
+        par lots d'au plus taille_lot lignes (fetchmany) : (description des colonnes, lignes).
+        Le premier lot est toujours renvoyé, même vide. La connexion reste occupée
+        (et la transaction ouverte) jusqu'à la fin de la lecture.
+        """
+        with self._connexion_active() as connexion, connexion:
+            nom = "pgscript_flux_{0}".format(next(Connexion._NUMEROS_CURSEURS))
+            with connexion.cursor(name=nom) as curseur:
+                curseur.itersize = taille_lot
+                curseur.execute(sql, parametres)
+                lignes = curseur.fetchmany(taille_lot)
+                yield curseur.description, lignes
+                while len(lignes) == taille_lot:
+                    lignes = curseur.fetchmany(taille_lot)
+                    if lignes:
+                        yield curseur.description, lignes
+
+    @staticmethod
+    def _executer_preparee(curseur, preparees, sql, parametres):
+        """
+        Exécute la requête via EXECUTE, après l'avoir préparée si elle ne l'est pas encore sur la connexion
+        """
+        nom = "pgscript_" + hashlib.md5(sql.encode("utf-8")).hexdigest()
+        if nom not in preparees:
+            curseur.execute("PREPARE " + nom + " AS " + numeroter_marqueurs(sql))
+            preparees.add(nom)
+        marqueurs = ", ".join(["%s"] * len(parametres))
+        try:
+            curseur.execute("EXECUTE " + nom + " (" + marqueurs + ")", parametres)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # requête préparée disparue côté serveur (DISCARD ALL...) : elle sera préparée à nouveau
+            preparees.discard(nom)
+            raise
+
     def copy_from_csv(self, fichier, schema, table, separateur, entete=True):
-        with self.connexion:
-            with self.connexion.cursor() as curseur:
+        with self._connexion_active() as connexion, connexion:
+            with connexion.cursor() as curseur:
                 with open(fichier, "r", encoding="utf-8") as data:
                     if entete:
                         next(data)
@@ -579,13 +1291,9 @@ class Resultat:
 
     def to_csv(self, fichier_csv):
         if self.requete_select:
-            self.dataframe.to_csv(
-                fichier_csv,
-                sep="|",
-                index=False,
-                columns=self.columns,
-                encoding="utf-8",
-            )
+            # écriture ligne à ligne, sans construire de Dataframe
+            with EcritureFlux(fichier_csv, self.columns, format="csv") as ecriture:
+                ecriture.ecrire_lignes(self.data)
         else:
             raise Exception("Pas de données csv à exporter")
 
@@ -608,6 +1316,194 @@ class Resultat:
             raise Exception("Pas de données html à exporter")
 
 
+## types pandas des colonnes écrites en Parquet, par type PostgreSQL (oid) : les lots
+## successifs d'un export ont ainsi le même schéma, même si un lot ne contient que des NULL
+## (les numeric sont écrits en flottants, comme les valeurs lues par TableMemoire)
+TYPES_FLUX = {
+    16: "boolean",
+    20: "Int64",
+    21: "Int64",
+    23: "Int64",
+    700: "float64",
+    701: "float64",
+    25: "string",
+    1042: "string",
+    1043: "string",
+    1700: "float64",
+}
+
+
+class EcritureFlux:
+    """
+    Écriture incrémentale de lignes dans un fichier CSV (séparateur |) ou Parquet
+
+    Les lignes sont écrites au fil de l'eau : en CSV directement, en Parquet par groupes
+    de lignes (row groups) de lignes_par_groupe lignes au plus. La mémoire utilisée ne
+    dépend donc pas du nombre total de lignes. Le schéma Parquet est celui du premier
+    groupe (types imposés par types si précisé). pyarrow est nécessaire pour le Parquet.
+
+    Exemple :
+        with EcritureFlux("resultats.parquet") as ecriture:
+            for resultat in resultats:
+                ecriture.ecrire(resultat.to_dict())
+    """
+
+    def __init__(
+        self,
+        fichier,
+        colonnes=None,
+        format=None,
+        separateur="|",
+        lignes_par_groupe=10000,
+        types=None,
+        ajout=False,
+    ):
+        """
+        fichier : chemin du fichier écrit
+        colonnes : noms des colonnes (sinon ceux du premier dictionnaire ou Dataframe écrit)
+        format : "csv" ou "parquet", par défaut selon l'extension du fichier
+        types : {colonne: type pandas} imposés aux colonnes écrites en Parquet
+        ajout : complète un fichier CSV existant (l'entête n'est écrite que s'il est vide)
+        """
+        if format is None:
+            format = "parquet" if fichier.lower().endswith(".parquet") else "csv"
+        if format not in ("csv", "parquet"):
+            raise ValueError("L'attribut format prend les valeurs 'csv' ou 'parquet'")
+        self.fichier = fichier
+        self.format = format
+        self.colonnes = list(colonnes) if colonnes is not None else None
+        self.separateur = separateur
+        self.lignes_par_groupe = lignes_par_groupe
+        self.types = types or {}
+        self.lignes = 0
+        self._tampon = []
+        self._parquet = None
+        self._csv = None
+        self._fichier = None
+        if format == "csv":
+            self._fichier = open(
+                fichier, "a" if ajout else "w", encoding="utf-8", newline=""
+            )
+            self._csv = csv.writer(
+                self._fichier, delimiter=separateur, lineterminator="\n"
+            )
+            self._entete = self._fichier.tell() == 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fermer()
+
+    @staticmethod
+    def _texte(valeur):
+        # valeur absente (None, NaN, NA) écrite comme une chaîne vide, comme pandas.to_csv
+        if valeur is None or valeur is pd.NA:
+            return ""
+        if isinstance(valeur, float) and math.isnan(valeur):
+            return ""
+        return valeur
+
+    def ecrire(self, element):
+        """
+        Écrit un dictionnaire (une ligne, par exemple Resultat.to_dict()) ou un Dataframe
+        """
+        if isinstance(element, pd.DataFrame):
+            if self.colonnes is None:
+                self.colonnes = [str(c) for c in element.columns]
+            self.ecrire_lignes(element.itertuples(index=False, name=None))
+        elif isinstance(element, dict):
+            if self.colonnes is None:
+                self.colonnes = list(element)
+            self.ecrire_lignes([tuple(element.get(c) for c in self.colonnes)])
+        else:
+            raise TypeError("Un dictionnaire ou un Dataframe est attendu")
+
+    def ecrire_lignes(self, lignes, colonnes=None):
+        """
+        Écrit des lignes (tuples dans l'ordre des colonnes)
+        """
+        if self.colonnes is None:
+            if colonnes is None:
+                raise ValueError("Noms des colonnes inconnus")
+            self.colonnes = list(colonnes)
+        if self._csv is not None:
+            if self._entete:
+                self._csv.writerow(self.colonnes)
+                self._entete = False
+            for ligne in lignes:
+                self._csv.writerow([self._texte(v) for v in ligne])
+                self.lignes += 1
+            return
+        for ligne in lignes:
+            self._tampon.append(tuple(ligne))
+            self.lignes += 1
+            if len(self._tampon) >= self.lignes_par_groupe:
+                self._ecrire_groupe()
+
+    def _ecrire_groupe(self):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Le module pyarrow est nécessaire pour écrire en Parquet")
+        frame = pd.DataFrame.from_records(self._tampon, columns=self.colonnes)
+        self._tampon = []
+        types = {c: t for c, t in self.types.items() if c in frame.columns}
+        if types:
+            frame = frame.astype(types)
+        if self._parquet is None:
+            table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+            self._parquet = pyarrow.parquet.ParquetWriter(self.fichier, table.schema)
+        else:
+            try:
+                table = pyarrow.Table.from_pandas(
+                    frame, schema=self._parquet.schema, preserve_index=False
+                )
+            except pyarrow.ArrowException as e:
+                raise ValueError(
+                    "Types des colonnes différents de ceux du premier groupe de lignes "
+                    "(à imposer par types) : " + str(e)
+                )
+        self._parquet.write_table(table)
+
+    def fermer(self, synchroniser=False):
+        """
+        Termine l'écriture du fichier
+        synchroniser : attend que le fichier soit écrit sur le disque (fsync)
+        """
+        if self.format == "parquet":
+            try:
+                # fichier vide (schéma seul) si aucune ligne n'a été écrite
+                if self._tampon or (
+                    self._parquet is None
+                    and self.colonnes is not None
+                    and not self.lignes
+                ):
+                    self._ecrire_groupe()
+            finally:
+                # fichier refermé (lisible) même si le dernier groupe n'a pu être écrit
+                if self._parquet is not None:
+                    self._parquet.close()
+                    self._parquet = None
+                    if synchroniser:
+                        descripteur = os.open(self.fichier, os.O_RDONLY)
+                        try:
+                            os.fsync(descripteur)
+                        finally:
+                            os.close(descripteur)
+            return
+        if self._fichier is not None:
+            if self._entete and self.colonnes is not None:
+                self._csv.writerow(self.colonnes)
+                self._entete = False
+            self._fichier.flush()
+            if synchroniser:
+                os.fsync(self._fichier.fileno())
+            self._fichier.close()
+            self._fichier = None
+
+
 if __name__ == "__main__":
 
     t = PGScript(
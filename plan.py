@@ -0,0 +1,345 @@
+"""
+Plan de calcul compilé des besoins
+
+Les formules de Resultat sont exécutées une fois sur des valeurs symboliques (Noeud) :
+chaque valeur lue dans une feuille devient une feuille du plan (feuille, colonne, année
+pour Omphale) et chaque opération sur ces valeurs une étape. Les branchements sur les
+paramètres, les noms de colonnes et les constantes sont résolus pendant cette compilation.
+Le plan obtenu (liste des colonnes lues et suite d'opérations) est ensuite évalué sur un
+tableau de territoires sans branchement ni construction de nom de colonne.
+
+Exemple :
+    plan = RegionResultat("24", parametre, version=2).plan()
+    plan.colonnes()  # {"fb1_sa_rp": ["nb_pers"], ...}
+    plan.evaluer(data, codes)  # {"b11": tableau, ...}
+"""
+
+import collections
+import dataclasses
+import json
+import operator
+import threading
+
+import numpy as np
+
+from chargement import Data, Feuille, arrondi, puissance
+
+
+class PlanNonCompilable(TypeError):
+    """
+    Formule qui ne peut être compilée (branchement sur une valeur lue, période non scalaire...)
+    """
+
+
+def _non_compilable(*args):
+    raise PlanNonCompilable(
+        "Opération non prise en charge sur une valeur symbolique du plan"
+    )
+
+
+class Noeud:
+    """
+    Valeur symbolique d'un plan : feuille (valeur lue) ou résultat d'une étape
+    """
+
+    __slots__ = ("plan", "numero")
+    ## les opérations numpy avec un Noeud sont renvoyées vers les méthodes du Noeud
+    __array_ufunc__ = None
+
+    def __init__(self, plan, numero):
+        self.plan = plan
+        self.numero = numero
+
+    def __add__(self, autre):
+        return self.plan.etape("+", self, autre)
+
+    def __radd__(self, autre):
+        return self.plan.etape("+", autre, self)
+
+    def __sub__(self, autre):
+        return self.plan.etape("-", self, autre)
+
+    def __rsub__(self, autre):
+        return self.plan.etape("-", autre, self)
+
+    def __mul__(self, autre):
+        return self.plan.etape("*", self, autre)
+
+    def __rmul__(self, autre):
+        return self.plan.etape("*", autre, self)
+
+    def __truediv__(self, autre):
+        return self.plan.etape("/", self, autre)
+
+    def __rtruediv__(self, autre):
+        return self.plan.etape("/", autre, self)
+
+    def __pow__(self, exposant):
+        return self.plan.etape("puissance", self, exposant)
+
+    def __rpow__(self, base):
+        return self.plan.etape("puissance", base, self)
+
+    def __neg__(self):
+        return self.plan.etape("neg", self)
+
+    def __pos__(self):
+        return self
+
+    def __round__(self, decimales=None):
+        return self.plan.etape("arrondi", self, decimales)
+
+    __hash__ = object.__hash__
+    __eq__ = __ne__ = __lt__ = __le__ = __gt__ = __ge__ = _non_compilable
+    __bool__ = __float__ = __int__ = __index__ = _non_compilable
+
+
+## fonctions des étapes (mêmes fonctions que le calcul vectorisé, pour des valeurs identiques)
+OPERATIONS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "neg": operator.neg,
+    "puissance": puissance,
+    "arrondi": arrondi,
+}
+
+
+class FeuilleSymbolique:
+    """
+    Feuille dont les valeurs lues sont les feuilles (Noeud) du plan
+    """
+
+    taux = Feuille.taux
+
+    def __init__(self, plan, nom, data):
+        self.plan = plan
+        self.nom = nom
+        self.data = data
+
+    def valeur(self, nom_col, code):
+        return self.plan.feuille(self.nom, nom_col)
+
+    def valeur_omphale(self, nom_col, code, annee):
+        if isinstance(annee, np.ndarray):
+            raise PlanNonCompilable("Années multiples non prises en charge par le plan")
+        return self.plan.feuille(self.nom, nom_col, int(annee))
+
+    def valeur_somme_colonnes(self, colonnes, code, start_expression=None):
+        if start_expression:
+            # colonnes du pack commençant par le préfixe, résolues à la compilation
+            feuille = getattr(self.data, self.nom)
+            memoire = feuille.memoire
+            if memoire is not None and memoire.complete:
+                colonnes = [
+                    c for c in memoire.noms_colonnes if c.startswith(start_expression)
+                ]
+            else:
+                colonnes = feuille.catalogue.selection(None, start_expression)
+        somme = 0.0
+        for nom_col in colonnes:
+            somme = somme + self.valeur(nom_col, code)
+        return somme
+
+
+class PackSymbolique(Data):
+    """
+    Pack régional dont les feuilles sont symboliques : les méthodes de Data
+    construisent les noms de colonnes et renvoient des Noeud
+    """
+
+    def __init__(self, plan, data):
+        self.region = data.region
+        self.version = data.version
+        self.plan = plan
+        self.data = data
+
+    def __getattr__(self, nom):
+        if nom not in self.FEUILLES:
+            raise AttributeError(nom)
+        return self.__dict__.setdefault(
+            nom, FeuilleSymbolique(self.plan, nom, self.data)
+        )
+
+
+class Plan:
+    """
+    Plan compilé : feuilles lues (feuille, colonne, année) et étapes de calcul des indicateurs
+
+    Les plans sont partagés par les calculs de même classe, région, version, période,
+    Parametres (hors nom), CustomParam et indicateurs.
+    """
+
+    ## plans compilés (ou échecs de compilation), par description du calcul,
+    ## les moins récemment utilisés étant écartés au-delà de TAILLE_MAX_PLANS
+    _PLANS = collections.OrderedDict()
+    _VERROU = threading.Lock()
+    TAILLE_MAX_PLANS = 1000
+
+    def __init__(self, indicateurs):
+        self.indicateurs = tuple(indicateurs)
+        ## noeuds dans l'ordre de création : ("feuille", (feuille, colonne, annee)) ou (operation, operandes)
+        self.noeuds = []
+        self._feuilles = {}
+        ## {indicateur: Noeud ou constante}
+        self.sorties = {}
+        ## numéros des noeuds nécessaires aux sorties, dans l'ordre d'évaluation
+        self.ordre = []
+        ## champs des paramètres (et période) lus par les formules, comme pour memoise
+        self.dependances = frozenset()
+
+    def _noeud(self, operation, operandes):
+        self.noeuds.append((operation, operandes))
+        return Noeud(self, len(self.noeuds) - 1)
+
+    def feuille(self, feuille, colonne, annee=None):
+        clef = (feuille, colonne, annee)
+        if clef not in self._feuilles:
+            self._feuilles[clef] = self._noeud("feuille", clef)
+        return self._feuilles[clef]
+
+    def etape(self, operation, *operandes):
+        for operande in operandes:
+            if isinstance(operande, np.ndarray):
+                raise PlanNonCompilable("Constante tableau non prise en charge")
+        return self._noeud(operation, operandes)
+
+    @staticmethod
+    def description(resultat, indicateurs):
+        """
+        Renvoie la clef (texte) du plan du calcul
+        """
+        parametre = resultat.__dict__.get("_parametre")
+        custom_parametre = resultat.__dict__.get("_custom_parametre")
+        periode = resultat.__dict__.get("_periode_projection")
+        if isinstance(periode, np.ndarray):
+            raise PlanNonCompilable("Période de projection scalaire attendue")
+        if parametre is not None:
+            parametre = dataclasses.asdict(parametre)
+            parametre.pop("nom", None)
+        description = {
+            "classe": type(resultat).__name__,
+            "code_region": resultat.code_region,
+            "version": resultat.version,
+            "periode_projection": periode,
+            "parametre": parametre,
+            "custom_parametre": (
+                dataclasses.asdict(custom_parametre)
+                if custom_parametre is not None
+                else None
+            ),
+            "indicateurs": list(indicateurs),
+        }
+        return json.dumps(description, sort_keys=True, default=str)
+
+    @classmethod
+    def compiler(cls, resultat, indicateurs):
+        """
+        Renvoie le plan des indicateurs du calcul, compilé au premier appel
+        Lève PlanNonCompilable (échec lui aussi conservé) si une formule ne peut être compilée.
+        """
+        clef = cls.description(resultat, indicateurs)
+        with cls._VERROU:
+            plan = cls._PLANS.get(clef)
+            if plan is not None:
+                cls._PLANS.move_to_end(clef)
+        if plan is None:
+            plan = cls(indicateurs)
+            try:
+                plan._tracer(resultat)
+            except PlanNonCompilable as echec:
+                # échec conservé : les formules ne sont pas retracées à chaque appel
+                plan = echec
+            with cls._VERROU:
+                plan = cls._PLANS.setdefault(clef, plan)
+                cls._PLANS.move_to_end(clef)
+                while len(cls._PLANS) > cls.TAILLE_MAX_PLANS:
+                    cls._PLANS.popitem(last=False)
+        if isinstance(plan, PlanNonCompilable):
+            raise PlanNonCompilable(*plan.args)
+        return plan
+
+    def _tracer(self, resultat):
+        trace = resultat._copie()
+        object.__setattr__(trace, "CACHE_PARTAGEABLE", False)
+        trace.data = PackSymbolique(self, resultat.data)
+        dependances = set()
+        trace._pile.append(dependances)
+        try:
+            for nom in self.indicateurs:
+                valeur = getattr(trace, nom)
+                self.sorties[nom] = valeur() if callable(valeur) else valeur
+        finally:
+            trace._pile.pop()
+        self.dependances = frozenset(dependances)
+        # seuls les noeuds dont dépendent les sorties sont évalués
+        utiles = set()
+        a_visiter = [s for s in self.sorties.values() if isinstance(s, Noeud)]
+        while a_visiter:
+            noeud = a_visiter.pop()
+            if noeud.numero in utiles:
+                continue
+            utiles.add(noeud.numero)
+            operation, operandes = self.noeuds[noeud.numero]
+            if operation != "feuille":
+                a_visiter.extend(o for o in operandes if isinstance(o, Noeud))
+        self.ordre = sorted(utiles)
+
+    @property
+    def feuilles(self):
+        """
+        Renvoie la liste des valeurs lues par le plan : (feuille, colonne, année ou None)
+        """
+        return [
+            self.noeuds[numero][1]
+            for numero in self.ordre
+            if self.noeuds[numero][0] == "feuille"
+        ]
+
+    def colonnes(self):
+        """
+        Renvoie les colonnes lues par le plan, par feuille : {feuille: [colonnes]}
+        """
+        colonnes = {}
+        for feuille, colonne, _ in self.feuilles:
+            colonnes.setdefault(feuille, [])
+            if colonne not in colonnes[feuille]:
+                colonnes[feuille].append(colonne)
+        return colonnes
+
+    @property
+    def nb_etapes(self):
+        return sum(1 for numero in self.ordre if self.noeuds[numero][0] != "feuille")
+
+    def evaluer(self, data, codes):
+        """
+        Renvoie {indicateur: tableau des valeurs} pour le tableau de codes, les valeurs
+        étant lues dans les feuilles de data
+        """
+        codes = np.atleast_1d(np.asarray(codes, dtype=object))
+        valeurs = {}
+
+        def valeur(operande):
+            if isinstance(operande, Noeud):
+                return valeurs[operande.numero]
+            return operande
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for numero in self.ordre:
+                operation, operandes = self.noeuds[numero]
+                if operation == "feuille":
+                    nom, colonne, annee = operandes
+                    feuille = getattr(data, nom)
+                    if annee is None:
+                        valeurs[numero] = feuille.valeur(colonne, codes)
+                    else:
+                        valeurs[numero] = feuille.valeur_omphale(colonne, codes, annee)
+                else:
+                    valeurs[numero] = OPERATIONS[operation](
+                        *(valeur(operande) for operande in operandes)
+                    )
+        return {
+            nom: np.broadcast_to(valeur(sortie), codes.shape)
+            for nom, sortie in self.sorties.items()
+        }
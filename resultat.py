@@ -1,6 +1,189 @@
+import copy
+import dataclasses
+import functools
+import hashlib
+import inspect
+import json
 from functools import cached_property
 
-from chargement import Data
+import numpy as np
+import pandas as pd
+
+from cache import ABSENT
+from chargement import Data, arrondi, puissance
+from models import CustomParam
+from pg.pgutils import Profileur
+from plan import Plan, PlanNonCompilable
+
+
+def memoise(methode):
+    """
+    Décorateur mémorisant, pour chaque objet Resultat, le résultat d'une méthode
+    selon ses arguments (les arguments par défaut étant explicités dans la clef).
+    Les champs des paramètres (et la période) lus pendant le calcul, directement ou par
+    les méthodes appelées, sont enregistrés comme dépendances de la valeur :
+    Resultat.invalider(champs) n'efface que les valeurs qui dépendent de ces champs.
+    Si Resultat.CACHE_RESULTATS est défini, la valeur est aussi recherchée (et conservée)
+    dans ce cache partagé, sous l'empreinte du Resultat.
+    La méthode décorée a un attribut connue(resultat) qui indique, sans calcul, si la valeur
+    (arguments par défaut) est déjà mémorisée ou présente dans le cache partagé.
+    """
+    nom = methode.__name__
+    parametres = list(inspect.signature(methode).parameters.values())[1:]
+    noms = [param.name for param in parametres]
+    defauts = [param.default for param in parametres]
+
+    @functools.wraps(methode)
+    def interne(self, *args, **kwargs):
+        valeurs = list(args) + defauts[len(args) :]
+        for clef_arg, valeur in kwargs.items():
+            valeurs[noms.index(clef_arg)] = valeur
+        clef = (nom, tuple(valeurs))
+        cache = self._cache
+        pile = self._pile
+        if clef not in cache:
+            dependances = set()
+            pile.append(dependances)
+            try:
+                partage = self.CACHE_RESULTATS if self.CACHE_PARTAGEABLE else None
+                if partage is None:
+                    valeur = methode(self, *args, **kwargs)
+                else:
+                    clef_partagee = (self.empreinte, clef)
+                    entree = partage.obtenir(clef_partagee)
+                    if entree is ABSENT:
+                        valeur = methode(self, *args, **kwargs)
+                        partage.enregistrer(
+                            clef_partagee, (valeur, frozenset(dependances))
+                        )
+                    else:
+                        valeur, dependances_partagees = entree
+                        dependances.update(dependances_partagees)
+            finally:
+                pile.pop()
+            cache[clef] = valeur
+            self._dependances[clef] = frozenset(dependances)
+        if pile:
+            pile[-1].update(self._dependances[clef])
+        return cache[clef]
+
+    def connue(self):
+        """
+        Indique si la valeur (arguments par défaut) est connue sans calcul : mémorisée
+        par le Resultat, ou reprise du cache partagé (et alors mémorisée)
+        """
+        clef = (nom, tuple(defauts))
+        if clef in self._cache:
+            return True
+        partage = self.CACHE_RESULTATS if self.CACHE_PARTAGEABLE else None
+        if partage is None:
+            return False
+        entree = partage.obtenir((self.empreinte, clef))
+        if entree is ABSENT:
+            return False
+        valeur, dependances = entree
+        self._cache[clef] = valeur
+        self._dependances[clef] = frozenset(dependances)
+        return True
+
+    interne.connue = connue
+    return interne
+
+
+class LectureSuivie:
+    """
+    Enveloppe d'un objet de paramètres (Parametres, CustomParam) qui enregistre
+    chaque champ lu dans l'ensemble des dépendances du calcul en cours
+    """
+
+    def __init__(self, objet, prefixe, dependances):
+        self._objet = objet
+        self._prefixe = prefixe
+        self._dependances = dependances
+
+    def __getattr__(self, nom):
+        self._dependances.add(self._prefixe + nom)
+        return getattr(self._objet, nom)
+
+
+class AttributSuivi:
+    """
+    Attribut de Resultat dont les lectures pendant un calcul mémorisé sont enregistrées
+    comme dépendances ("periode_projection", ou "parametre.<champ>" pour un objet de paramètres)
+    """
+
+    def __set_name__(self, classe, nom):
+        self.nom = nom
+        self.clef = "_" + nom
+
+    def __get__(self, objet, classe=None):
+        if objet is None:
+            return self
+        valeur = objet.__dict__.get(self.clef)
+        pile = objet.__dict__.get("_pile")
+        if pile:
+            if dataclasses.is_dataclass(valeur):
+                return LectureSuivie(valeur, self.nom + ".", pile[-1])
+            pile[-1].add(self.nom)
+        return valeur
+
+    def __set__(self, objet, valeur):
+        objet.__dict__[self.clef] = valeur
+
+
+def clef_hashable(valeur):
+    """
+    Renvoie une forme hashable de la valeur (un tableau numpy est remplacé par son contenu)
+    """
+    if isinstance(valeur, np.ndarray):
+        return (valeur.dtype.str, valeur.shape, valeur.tobytes())
+    return valeur
+
+
+def entiers(nom, valeurs, index):
+    """
+    Renvoie les valeurs (tableau numpy) de l'indicateur converties en entiers.
+    Lève ValueError si une valeur n'est pas finie, comme round() pour un territoire,
+    au lieu de la convertir silencieusement en un entier arbitraire.
+    """
+    valeurs = np.asarray(valeurs, dtype=float)
+    finies = np.isfinite(valeurs)
+    if not finies.all():
+        raise ValueError(
+            "Valeur non finie de {0} pour {1}".format(
+                nom, ", ".join(str(i) for i in np.asarray(index)[~finies])
+            )
+        )
+    return valeurs.astype("int64")
+
+
+class DonneesMemorisees:
+    """
+    Enveloppe de Resultat.data mémorisant, dans le cache du Resultat, chaque valeur lue
+    pour le territoire du Resultat (premier argument des méthodes de Data)
+    """
+
+    def __init__(self, resultat):
+        self._resultat = resultat
+
+    def __getattr__(self, nom):
+        resultat = self._resultat
+        methode = getattr(resultat.data, nom)
+
+        def interne(code, *args, **kwargs):
+            if code is not resultat.code:
+                return methode(code, *args, **kwargs)
+            clef = (
+                "data." + nom,
+                tuple(clef_hashable(arg) for arg in args),
+                tuple(sorted(kwargs.items())),
+            )
+            cache = resultat._cache
+            if clef not in cache:
+                cache[clef] = methode(code, *args, **kwargs)
+            return cache[clef]
+
+        return interne
 
 
 class Resultat:
@@ -10,7 +193,48 @@ class Resultat:
 
     """
 
+    ## indicateurs renvoyés par to_dict / to_frame
+    INDICATEURS = (
+        "b11",
+        "b12",
+        "b13",
+        "b14",
+        "b15",
+        "b17",
+        "besoin_en_stock",
+        "b21",
+        "b22",
+        "besoin_renouvellement",
+        "demande_potentielle",
+        "besoin_total",
+        "evolution_nb_lv",
+        "evolution_nb_rs",
+    )
+
+    ## cache.CacheResultats partagé par tous les Resultat du processus (None : désactivé)
+    CACHE_RESULTATS = None
+    ## les valeurs de la classe peuvent être conservées dans CACHE_RESULTATS
+    CACHE_PARTAGEABLE = True
+
+    ## attributs dont la modification invalide les valeurs mémorisées
+    ATTRIBUTS_CALCUL = (
+        "code",
+        "code_region",
+        "version",
+        "parametre",
+        "custom_parametre",
+        "periode_projection",
+        "data",
+    )
+
+    parametre = AttributSuivi()
+    custom_parametre = AttributSuivi()
+    periode_projection = AttributSuivi()
+
     def __init__(self, periode_projection=6):
+        self._cache = {}
+        self._dependances = {}
+        self._pile = []
         self.code = None  # sera défini dans les classes filles
         self.code_region = None  # idem
         self.version = None  # idem
@@ -18,15 +242,218 @@ class Resultat:
         self.custom_parametre = None  # idem
         self.periode_projection = periode_projection
 
+    def __setattr__(self, nom, valeur):
+        champs = None
+        if nom in ("parametre", "custom_parametre", "periode_projection"):
+            champs = self._champs_modifies(nom, valeur)
+        super().__setattr__(nom, valeur)
+        if nom in self.ATTRIBUTS_CALCUL:
+            self.invalider(champs)
+
+    def _champs_modifies(self, nom, valeur):
+        """
+        Renvoie les dépendances ("parametre.<champ>"...) touchées par la nouvelle valeur de l'attribut,
+        ou None si elles ne peuvent être déterminées (toutes les valeurs sont alors à recalculer)
+        """
+        ancienne = self.__dict__.get("_" + nom)
+        if nom == "periode_projection":
+            return {nom}
+        if (
+            ancienne is None
+            or ancienne is valeur
+            or type(ancienne) is not type(valeur)
+            or not dataclasses.is_dataclass(valeur)
+        ):
+            return None
+        return {
+            nom + "." + champ.name
+            for champ in dataclasses.fields(valeur)
+            if getattr(ancienne, champ.name) != getattr(valeur, champ.name)
+        }
+
+    def invalider(self, champs=None):
+        """
+        Vide les valeurs mémorisées. Appelé automatiquement lorsque parametre,
+        custom_parametre, periode_projection (ou le territoire) sont réaffectés ;
+        à appeler explicitement après avoir modifié un champ de parametre en place.
+        champs : si précisé (ex. {"parametre.b15_taux_reallocation"}), seules les valeurs
+        qui dépendent de ces champs sont effacées, les autres et les données lues sont conservées.
+        """
+        if champs is None:
+            super().__setattr__("_cache", {})
+            super().__setattr__("_dependances", {})
+            return
+        cache = self._cache
+        cache.pop("empreinte", None)
+        for clef, dependances in list(self._dependances.items()):
+            if not dependances.isdisjoint(champs):
+                del cache[clef]
+                del self._dependances[clef]
+
+    def modifier(self, **valeurs):
+        """
+        Modifie des champs de Parametres (ou de CustomParam) du calcul :
+        seules les valeurs qui dépendent de ces champs seront recalculées.
+        Exemple : resultat.modifier(b15_taux_reallocation=70)
+        """
+        champs_custom = {f.name for f in dataclasses.fields(CustomParam)}
+        modif = {k: v for k, v in valeurs.items() if k not in champs_custom}
+        modif_custom = {k: v for k, v in valeurs.items() if k in champs_custom}
+        if modif:
+            self.parametre = dataclasses.replace(self.__dict__["_parametre"], **modif)
+        if modif_custom:
+            custom = self.__dict__.get("_custom_parametre") or CustomParam()
+            self.custom_parametre = dataclasses.replace(custom, **modif_custom)
+
+    @property
+    def empreinte(self):
+        """
+        Empreinte stable (sha256) du calcul : classe, territoire, version, période,
+        Parametres (hors nom) et CustomParam. Clef des valeurs dans CACHE_RESULTATS.
+        """
+        if "empreinte" not in self._cache:
+            parametre = self.__dict__.get("_parametre")
+            custom_parametre = self.__dict__.get("_custom_parametre")
+            if parametre is not None:
+                parametre = dataclasses.asdict(parametre)
+                parametre.pop("nom", None)
+            description = {
+                "classe": type(self).__name__,
+                "code": self.code,
+                "code_region": self.code_region,
+                "version": self.version,
+                "periode_projection": self.__dict__.get("_periode_projection"),
+                "parametre": parametre,
+                "custom_parametre": (
+                    dataclasses.asdict(custom_parametre)
+                    if custom_parametre is not None
+                    else None
+                ),
+            }
+            texte = json.dumps(description, sort_keys=True, default=str)
+            self._cache["empreinte"] = hashlib.sha256(texte.encode("utf-8")).hexdigest()
+        return self._cache["empreinte"]
+
     @cached_property
     def data(self):
-        return Data(self.code_region, self.version)
+        return Data.ouvrir(self.code_region, self.version)
+
+    @cached_property
+    def donnees(self):
+        """
+        Accès aux données du territoire dont chaque valeur n'est lue qu'une fois
+        """
+        return DonneesMemorisees(self)
+
+    async def charger_async(self):
+        """
+        Charge simultanément (accès asynchrones) toutes les données du territoire
+        """
+        await self.data.charger_async([self.code])
+
+    async def besoin_total_async(self, projection=True):
+        """
+        besoin_total() dont les données sont chargées par des requêtes asynchrones simultanées
+        """
+        await self.charger_async()
+        return self.besoin_total(projection)
+
+    def plan(self, indicateurs=None):
+        """
+        Renvoie le plan compilé (plan.Plan) des indicateurs pour les paramètres, la période,
+        la version et la région du calcul, partagé par tous les calculs identiques.
+        Lève PlanNonCompilable si une formule ne peut être compilée.
+        """
+        return Plan.compiler(self, tuple(indicateurs or self.INDICATEURS))
+
+    def precharger(self, indicateurs=None):
+        """
+        Charge en une requête projetée par feuille les seules colonnes que lisent les indicateurs
+        pour les paramètres du calcul (voir Data.precharger), sans effet sur un pack préchargé
+        ou si les formules ne peuvent être compilées
+        """
+        if self.data.precharge:
+            return
+        try:
+            colonnes = self.plan(indicateurs).colonnes()
+        except PlanNonCompilable:
+            return
+        self.data.precharger(colonnes, np.atleast_1d(self.code).tolist())
+
+    def evaluer_plan(self, indicateurs=None):
+        """
+        Renvoie {indicateur: tableau des valeurs par territoire} calculé par le plan compilé,
+        mémorisé (et invalidé selon les champs des paramètres lus) comme les autres valeurs
+        """
+        plan = self.plan(indicateurs)
+        clef = ("plan", plan.indicateurs)
+        if clef not in self._cache:
+            self._cache[clef] = plan.evaluer(self.data, self.code)
+            self._dependances[clef] = plan.dependances
+        return self._cache[clef]
+
+    def to_dict(self, indicateurs=None):
+        """
+        Renvoie un dictionnaire {indicateur: valeur} des indicateurs demandés (par défaut INDICATEURS)
+        """
+        indicateurs = indicateurs or self.INDICATEURS
+        if not all(self.valeur_connue(nom) for nom in indicateurs):
+            self.precharger(indicateurs)
+        return {nom: getattr(self, nom)() for nom in indicateurs}
+
+    def valeur_connue(self, nom):
+        """
+        Indique si la valeur de l'indicateur est déjà mémorisée, par le Resultat ou dans
+        CACHE_RESULTATS : le préchargement des colonnes lues est alors inutile
+        """
+        connue = getattr(getattr(type(self), nom, None), "connue", None)
+        return connue is not None and connue(self)
+
+    def _copie(self):
+        """
+        Renvoie une copie du calcul qui reprend les valeurs déjà mémorisées
+        (effacées ensuite selon leurs dépendances si un paramètre de la copie est modifié)
+        """
+        copie = copy.copy(self)
+        object.__setattr__(copie, "_cache", dict(self._cache))
+        object.__setattr__(copie, "_dependances", dict(self._dependances))
+        object.__setattr__(copie, "_pile", [])
+        object.__setattr__(copie, "donnees", DonneesMemorisees(copie))
+        return copie
+
+    def horizon_curve(self, periodes, indicateurs=None):
+        """
+        Renvoie un Dataframe des indicateurs (colonnes) pour chaque période de projection
+        (index "periode"), évalués en une fois sur le tableau des périodes.
+        indicateurs : méthodes ou propriétés de Resultat (par défaut INDICATEURS),
+        par exemple ["coeff", "b21", "taux_restructuration", "besoin_total"]
+        Les valeurs de la période courante indépendantes de la période sont réutilisées.
+        """
+        periodes = np.asarray(periodes)
+        courbe = self._copie()
+        object.__setattr__(courbe, "CACHE_PARTAGEABLE", False)
+        courbe.periode_projection = periodes
+        colonnes = {}
+        for nom in indicateurs or self.INDICATEURS:
+            valeur = getattr(courbe, nom)
+            if callable(valeur):
+                valeur = valeur()
+            valeur = np.broadcast_to(valeur, periodes.shape)
+            if nom in self.INDICATEURS:
+                valeur = entiers(nom, valeur, periodes)
+            colonnes[nom] = valeur
+        return pd.DataFrame(colonnes, index=pd.Index(periodes, name="periode"))
 
     def coeff(self, projection=True):
         if projection:
             horizon_resorption = self.parametre.b1_horizon_resorption
-            if self.periode_projection < horizon_resorption:
-                return self.periode_projection / horizon_resorption
+            periode = self.periode_projection
+            if isinstance(periode, np.ndarray):
+                return np.where(
+                    periode < horizon_resorption, periode / horizon_resorption, 1
+                )
+            if periode < horizon_resorption:
+                return periode / horizon_resorption
             else:
                 return 1
         return 1
@@ -73,16 +500,19 @@ class Resultat:
         else:
             return 0.0116
 
+    @memoise
     def besoin_total(self, projection=True):
-        return round(self.besoin_en_stock(projection) + self.demande_potentielle())
+        return arrondi(self.besoin_en_stock(projection) + self.demande_potentielle())
 
+    @memoise
     def besoin_total_custom(self, projection=True):
-        return round(
+        return arrondi(
             self.besoin_en_stock(projection) + self.demande_potentielle_custom()
         )
 
+    @memoise
     def besoin_en_stock(self, projection=True):
-        return round(
+        return arrondi(
             self.b11(projection)
             + self.b12(projection)
             + self.b13(projection)
@@ -91,9 +521,10 @@ class Resultat:
             + self.b17(projection)
         )
 
+    @memoise
     def b11(self, projection=True):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         resultat = 0
         if p.source_b11 == "RP":
             if p.b11_sa:
@@ -113,11 +544,12 @@ class Resultat:
             resultat += (p.b11_part_etablissement / 100) * d.b1_hebergement_finess(
                 self.code, hebergement.code
             )
-        return round(resultat * self.coeff(projection))
+        return arrondi(resultat * self.coeff(projection))
 
+    @memoise
     def b12(self, projection=True):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         resultat = (p.b12_cohab_interg_subie / 100) * d.b1_cohab_interg_filo(self.code)
         if p.b12_heberg_particulier:
             resultat += d.b1_heberges_sne(self.code, "particulier")
@@ -125,11 +557,12 @@ class Resultat:
             resultat += d.b1_heberges_sne(self.code, "gratuit")
         if p.b12_heberg_temporaire:
             resultat += d.b1_heberges_sne(self.code, "temp")
-        return round(resultat * self.coeff(projection))
+        return arrondi(resultat * self.coeff(projection))
 
+    @memoise
     def b13(self, projection=True, correction=True, reallocation=True):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         resultat = 0
         if p.b13_acc:
             resultat += d.b1_inadeq_fin(self.code, p.b13_taux_effort, "Acc")
@@ -139,11 +572,12 @@ class Resultat:
             resultat += -1 * self.ratio_4_3 * self.b14(projection=False)
         if reallocation:
             resultat = (1 - p.b13_taux_reallocation / 100.0) * resultat
-        return round(resultat * self.coeff(projection))
+        return arrondi(resultat * self.coeff(projection))
 
+    @memoise
     def b14(self, projection=True, reallocation=True):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         resultat = 0
         if p.source_b14 == "RP":
             resultat = d.b1_mv_qualite_rp(
@@ -157,11 +591,12 @@ class Resultat:
             )
         if reallocation:
             resultat = (1 - p.b14_taux_reallocation / 100.0) * resultat
-        return round(resultat * self.coeff(projection))
+        return arrondi(resultat * self.coeff(projection))
 
+    @memoise
     def besoin_en_rehabilitation(self, projection=True):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         resultat = 0
         if p.source_b14 == "RP":
             resultat = d.b1_mv_qualite_rp(self.code, p.b14_confort, rehabilitation=True)
@@ -171,11 +606,12 @@ class Resultat:
             resultat = d.b1_mv_qualite_ff(
                 self.code, p.b14_confort, p.b14_qualite, rehabilitation=True
             )
-        return round(resultat * self.coeff(projection))
+        return arrondi(resultat * self.coeff(projection))
 
+    @memoise
     def b15(self, projection=True, correction=True, reallocation=True):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         resultat = 0
         if p.source_b15 == "RP":
             if p.b15_proprietaire:
@@ -197,53 +633,61 @@ class Resultat:
             )
         if reallocation:
             resultat = (1 - p.b15_taux_reallocation / 100.0) * resultat
-        return round(resultat * self.coeff(projection))
+        return arrondi(resultat * self.coeff(projection))
 
+    @memoise
     def b17(self, projection=True):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         resultat = d.b1_parc_social_sne(self.code, p.b17_motif)
-        return round(resultat * self.coeff(projection))
+        return arrondi(resultat * self.coeff(projection))
 
+    @memoise
     def parc_total_actuel(self):
-        d = self.data
+        d = self.donnees
         return d.parc_total(self.code)
 
+    @memoise
     def parc_rp_actuel(self):
-        d = self.data
+        d = self.donnees
         tx_rp_actuel = d.b2_taux_rp(self.code)
-        return round(self.parc_total_actuel() * tx_rp_actuel)
+        return arrondi(self.parc_total_actuel() * tx_rp_actuel)
 
+    @memoise
     def taux_croissance_annuel(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         return d.taux_croissance_annuel_omphale(
             self.code, p.b2_scenario_omphale, self.periode_projection
         )
 
+    @memoise
     def demande_potentielle(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         resultat = ((self.parc_rp_actuel() + self.b21()) / self.taux_rp) - (
             self.parc_total_actuel() - self.besoin_renouvellement()
         )
-        return round(resultat)
+        return arrondi(resultat)
 
+    @memoise
     def demande_potentielle_custom(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         resultat = (
             (self.parc_rp_actuel() + self.b21_custom()) / self.taux_rp_custom
         ) - (self.parc_total_actuel() - self.besoin_renouvellement_custom())
-        return round(resultat)
+        return arrondi(resultat)
 
+    @memoise
     def b21(self):
         p = self.parametre
-        d = self.data
-        return round(
+        d = self.donnees
+        return arrondi(
             d.b2_omphale(self.code, p.b2_scenario_omphale, self.periode_projection)
         )
 
+    @memoise
     def b21_custom(self):
         p = self.custom_parametre
         if p:
@@ -251,163 +695,190 @@ class Resultat:
                 return p.b2_evol_demo_an * self.periode_projection
         return self.b21()
 
+    @memoise
     def b22(self):
-        return round(self.demande_potentielle() - self.b21())
+        return arrondi(self.demande_potentielle() - self.b21())
 
+    @memoise
     def b22_custom(
         self,
     ):
-        return round(self.demande_potentielle_custom() - self.b21_custom())
+        return arrondi(self.demande_potentielle_custom() - self.b21_custom())
 
+    @memoise
     def besoin_renouvellement(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         renouvellement = self.parc_total_actuel() * (
             self.taux_restructuration - self.taux_disparition
         )
-        return round(-1.0 * renouvellement)
+        return arrondi(-1.0 * renouvellement)
 
+    @memoise
     def besoin_renouvellement_custom(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         renouvellement = self.parc_total_actuel() * (
             self.taux_restructuration_custom - self.taux_disparition_custom
         )
-        return round(-1.0 * renouvellement)
+        return arrondi(-1.0 * renouvellement)
 
+    @memoise
     def evolution_nb_lv(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         evol = (
             d.parc_total(self.code)
             - self.besoin_renouvellement()
             + self.demande_potentielle()
         ) * self.taux_lv - d.parc_total(self.code) * d.b2_taux_lv(self.code)
-        return round(evol)
+        return arrondi(evol)
 
+    @memoise
     def evolution_nb_lv_custom(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         evol = (
             d.parc_total(self.code)
             - self.besoin_renouvellement_custom()
             + self.demande_potentielle_custom()
         ) * self.taux_lv_custom - d.parc_total(self.code) * d.b2_taux_lv(self.code)
-        return round(evol)
+        return arrondi(evol)
 
+    @memoise
     def evolution_nb_rs(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         evol = (
             d.parc_total(self.code)
             - self.besoin_renouvellement()
             + self.demande_potentielle()
         ) * self.taux_rs - d.parc_total(self.code) * d.b2_taux_rs(self.code)
-        return round(evol)
+        return arrondi(evol)
 
+    @memoise
     def evolution_nb_rs_custom(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         evol = (
             d.parc_total(self.code)
             - self.besoin_renouvellement_custom()
             + self.demande_potentielle_custom()
         ) * self.taux_rs_custom - d.parc_total(self.code) * d.b2_taux_rs(self.code)
-        return round(evol)
+        return arrondi(evol)
 
     @property
+    @memoise
     def taux_restructuration_an(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         tx_actuel = d.b2_taux_restruc_an(self.code)
-        return round(tx_actuel + p.b2_tx_restructuration / 100.0, 10)
+        return arrondi(tx_actuel + p.b2_tx_restructuration / 100.0, 10)
 
     @property
+    @memoise
     def taux_restructuration(self):
-        return round(
-            (1.0 + self.taux_restructuration_an) ** (self.periode_projection) - 1.0, 10
+        return arrondi(
+            puissance(1.0 + self.taux_restructuration_an, self.periode_projection)
+            - 1.0,
+            10,
         )
 
     @property
+    @memoise
     def taux_restructuration_custom_an(self):
         p = self.custom_parametre
         if p:
             if p.b2_tx_restructuration_custom is not None:
-                return round(p.b2_tx_restructuration_custom / 100.0, 10)
+                return arrondi(p.b2_tx_restructuration_custom / 100.0, 10)
         return self.taux_restructuration_an
 
     @property
+    @memoise
     def taux_restructuration_custom(self):
-        return round(
-            (1.0 + self.taux_restructuration_custom_an) ** (self.periode_projection)
+        return arrondi(
+            puissance(
+                1.0 + self.taux_restructuration_custom_an, self.periode_projection
+            )
             - 1.0,
             10,
         )
 
     @property
+    @memoise
     def taux_disparition_an(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         tx_actuel = d.b2_taux_disp_an(self.code)
-        return round(tx_actuel + p.b2_tx_disparition / 100.0, 10)
+        return arrondi(tx_actuel + p.b2_tx_disparition / 100.0, 10)
 
     @property
+    @memoise
     def taux_disparition(self):
-        return round(
-            (1.0 + self.taux_disparition_an) ** (self.periode_projection) - 1.0, 10
+        return arrondi(
+            puissance(1.0 + self.taux_disparition_an, self.periode_projection) - 1.0, 10
         )
 
     @property
+    @memoise
     def taux_disparition_custom_an(self):
         p = self.custom_parametre
         if p:
             if p.b2_tx_disparition_custom is not None:
-                return round(p.b2_tx_disparition_custom / 100.0, 10)
+                return arrondi(p.b2_tx_disparition_custom / 100.0, 10)
         return self.taux_disparition_an
 
     @property
+    @memoise
     def taux_disparition_custom(self):
-        return round(
-            (1.0 + self.taux_disparition_custom_an) ** (self.periode_projection) - 1.0,
+        return arrondi(
+            puissance(1.0 + self.taux_disparition_custom_an, self.periode_projection)
+            - 1.0,
             10,
         )
 
     @property
+    @memoise
     def taux_rp(self):
         return 1.0 - self.taux_lv - self.taux_rs
 
     @property
+    @memoise
     def taux_rp_custom(self):
         return 1.0 - self.taux_lv_custom - self.taux_rs_custom
 
     @property
+    @memoise
     def taux_lv(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         tx_actuel = d.b2_taux_lv(self.code)
-        return round(tx_actuel + p.b2_tx_vacance / 100.0, 10)
+        return arrondi(tx_actuel + p.b2_tx_vacance / 100.0, 10)
 
     @property
+    @memoise
     def taux_lv_custom(self):
         p = self.custom_parametre
         if p:
             if p.b2_tx_lv_custom is not None:
-                return round(p.b2_tx_lv_custom / 100.0, 10)
+                return arrondi(p.b2_tx_lv_custom / 100.0, 10)
         return self.taux_lv
 
     @property
+    @memoise
     def taux_rs(self):
         p = self.parametre
-        d = self.data
+        d = self.donnees
         tx_actuel = d.b2_taux_rs(self.code)
-        return round(tx_actuel + p.b2_tx_rs / 100.0, 10)
+        return arrondi(tx_actuel + p.b2_tx_rs / 100.0, 10)
 
     @property
+    @memoise
     def taux_rs_custom(self):
         p = self.custom_parametre
         if p:
             if p.b2_tx_rs_custom is not None:
-                return round(p.b2_tx_rs_custom / 100.0, 10)
+                return arrondi(p.b2_tx_rs_custom / 100.0, 10)
         return self.taux_rs
 
 
@@ -429,3 +900,94 @@ class ZOResultat(Resultat):
         self.code_region = zo.code_region
         self.parametre = zo.parametre
         self.custom_parametre = None
+
+
+class RegionResultat(Resultat):
+    """
+
+    Calcul vectorisé des résultats pour tous les EPCI (ou toutes les ZO) d'une région
+
+    Les formules de Resultat sont évaluées une seule fois sur des tableaux numpy de valeurs
+    (un élément par territoire) servis par un pack régional préchargé en mémoire.
+    Les arrondis sont appliqués aux mêmes étapes que pour le calcul unitaire.
+
+    """
+
+    CACHE_PARTAGEABLE = False
+
+    def __init__(
+        self,
+        code_region,
+        parametre,
+        periode_projection=6,
+        version=1,
+        niveau="epci",
+        codes=None,
+        custom_parametre=None,
+        data=None,
+    ):
+        """
+        niveau : "epci" ou "zo", territoires calculés lorsque codes n'est pas précisé
+        codes : liste de codes (tous du même niveau) à calculer
+        data : pack régional préchargé à utiliser, par défaut Data.ouvrir(code_region, version, precharge=True)
+        """
+        super().__init__(periode_projection=periode_projection)
+        if niveau not in ("epci", "zo"):
+            raise ValueError("L'attribut niveau prend les valeurs 'epci' ou 'zo'")
+        self.code_region = code_region
+        self.version = version
+        self.parametre = parametre
+        self.custom_parametre = custom_parametre
+        self.niveau = niveau
+        if data is not None:
+            self.data = data
+        if codes is None:
+            codes = self.data.epcis() if niveau == "epci" else self.data.zos()
+        self.code = np.asarray(codes, dtype=object)
+
+    @cached_property
+    def data(self):
+        return Data.ouvrir(self.code_region, self.version, precharge=True)
+
+    def to_frame(self, indicateurs=None):
+        """
+        Renvoie un Dataframe des indicateurs (colonnes) par territoire (index "code"),
+        identique à celui obtenu en calculant chaque territoire avec EPCIResultat / ZOResultat
+        """
+        indicateurs = tuple(indicateurs or self.INDICATEURS)
+        self.precharger(indicateurs)
+        try:
+            valeurs = self.evaluer_plan(indicateurs)
+        except PlanNonCompilable:
+            valeurs = {nom: getattr(self, nom)() for nom in indicateurs}
+        colonnes = {
+            nom: entiers(nom, np.broadcast_to(valeurs[nom], self.code.shape), self.code)
+            for nom in indicateurs
+        }
+        return pd.DataFrame(colonnes, index=pd.Index(self.code, name="code"))
+
+    def horizon_curve(self, periodes, indicateurs=None):
+        """
+        Renvoie un Dataframe des indicateurs par territoire et par période de projection
+        (index "code", "periode"), chaque période étant évaluée sur tous les territoires à la fois
+        """
+        frames = []
+        for periode in periodes:
+            courbe = self._copie()
+            courbe.periode_projection = periode
+            frame = courbe.to_frame(indicateurs)
+            frame["periode"] = periode
+            frames.append(frame.set_index("periode", append=True))
+        return pd.concat(frames).sort_index()
+
+
+def profileur():
+    """
+    Renvoie un Profileur des requêtes attribuant chacune à la méthode de Data
+    et au calcul de Resultat qui l'ont déclenchée (statistiques "par_data" et "par_resultat")
+    Exemple :
+        with profileur() as p:
+            resultat.besoin_total()
+        print(p.openmetrics())
+    """
+    return Profileur(data=Data, resultat=Resultat)
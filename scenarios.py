@@ -0,0 +1,197 @@
+import dataclasses
+import itertools
+import typing
+from functools import cached_property
+
+import pandas as pd
+
+from chargement import Data
+from models import EPCI, CustomParam, Parametres, ZoneOtelo
+from pg.pgutils import EcritureFlux
+from resultat import EPCIResultat, RegionResultat, Resultat, ZOResultat
+
+
+class ScenarioSweep:
+    """
+
+    Évaluation d'une série de paramétrages (études de sensibilité) sur un même territoire
+    ou sur tous les territoires d'une région.
+
+    Le pack régional est chargé une seule fois en mémoire puis partagé par tous les scénarios.
+
+    """
+
+    def __init__(
+        self,
+        territoire,
+        scenarios,
+        periode_projection=6,
+        version=1,
+        niveau="epci",
+        data=None,
+    ):
+        """
+        territoire : EPCI ou ZoneOtelo, ou code de région pour calculer tous ses EPCI (ou ZO)
+        scenarios : liste de Parametres ou de tuples (Parametres, CustomParam)
+        version, niveau : utilisés uniquement lorsque territoire est un code de région
+        data : pack régional déjà chargé à utiliser
+        """
+        self.territoire = territoire
+        self.scenarios = [s if isinstance(s, tuple) else (s, None) for s in scenarios]
+        self.periode_projection = periode_projection
+        if isinstance(territoire, (EPCI, ZoneOtelo)):
+            self.code_region = territoire.code_region
+            self.version = territoire.version
+        else:
+            self.code_region = territoire
+            self.version = version
+        self.niveau = niveau
+        if data is not None:
+            self.data = data
+
+    @classmethod
+    def grille(cls, base, custom=None, **valeurs):
+        """
+        Renvoie la liste des scénarios (Parametres, CustomParam) obtenus en croisant
+        toutes les valeurs des champs indiqués, les autres champs étant ceux de base / custom.
+
+        Exemple : ScenarioSweep.grille(param_standard, b13_taux_effort=[25, 30, 35],
+        b2_scenario_omphale=["Central_C", "PH_B"]) renvoie 6 scénarios
+        """
+        champs_parametres = {f.name for f in dataclasses.fields(Parametres)}
+        champs_custom = {f.name for f in dataclasses.fields(CustomParam)}
+        inconnus = set(valeurs) - champs_parametres - champs_custom
+        if inconnus:
+            raise ValueError("Champs inconnus : " + ", ".join(sorted(inconnus)))
+        scenarios = []
+        for combinaison in itertools.product(*valeurs.values()):
+            choix = dict(zip(valeurs.keys(), combinaison))
+            modif = {k: v for k, v in choix.items() if k in champs_parametres}
+            modif_custom = {k: v for k, v in choix.items() if k in champs_custom}
+            nom = (
+                base.nom + " [" + ", ".join(f"{k}={v}" for k, v in choix.items()) + "]"
+            )
+            parametre = dataclasses.replace(base, nom=nom, **modif)
+            custom_parametre = custom
+            if modif_custom:
+                custom_parametre = dataclasses.replace(
+                    custom or CustomParam(), **modif_custom
+                )
+            scenarios.append((parametre, custom_parametre))
+        return scenarios
+
+    @cached_property
+    def data(self):
+        return Data.ouvrir(self.code_region, self.version, precharge=True)
+
+    def resultat(self, parametre, custom_parametre=None):
+        """
+        Renvoie l'objet Resultat (RegionResultat pour une région) du scénario, branché sur le pack partagé
+        """
+        if isinstance(self.territoire, EPCI):
+            epci = dataclasses.replace(
+                self.territoire, parametre=parametre, custom_param=custom_parametre
+            )
+            resultat = EPCIResultat(epci, periode_projection=self.periode_projection)
+        elif isinstance(self.territoire, ZoneOtelo):
+            zo = dataclasses.replace(self.territoire, parametre=parametre)
+            resultat = ZOResultat(zo, periode_projection=self.periode_projection)
+        else:
+            return RegionResultat(
+                self.code_region,
+                parametre,
+                periode_projection=self.periode_projection,
+                version=self.version,
+                niveau=self.niveau,
+                custom_parametre=custom_parametre,
+                data=self.data,
+            )
+        resultat.data = self.data
+        return resultat
+
+    def _champs_variables(self):
+        """
+        Renvoie les champs de Parametres / CustomParam qui diffèrent d'un scénario à l'autre
+        """
+        valeurs = [
+            {
+                **{
+                    k: v
+                    for k, v in dataclasses.asdict(p).items()
+                    if k not in ("nom", "b11_etablissement")
+                },
+                "b11_etablissement": p.hebergements_display,
+                **(dataclasses.asdict(c) if c is not None else {}),
+            }
+            for p, c in self.scenarios
+        ]
+        champs = []
+        for champ in dict.fromkeys(k for v in valeurs for k in v):
+            if len({repr(v.get(champ)) for v in valeurs}) > 1:
+                champs.append(champ)
+        return champs, valeurs
+
+    @staticmethod
+    def _types_champs():
+        """
+        Renvoie les types pandas des colonnes des champs de Parametres / CustomParam,
+        imposés à l'export pour que les valeurs absentes (None) d'un premier scénario
+        ne fixent pas le type des colonnes
+        """
+        correspondance = {
+            bool: "boolean",
+            int: "Int64",
+            float: "Float64",
+            str: "string",
+        }
+        types = {}
+        for champ in dataclasses.fields(Parametres) + dataclasses.fields(CustomParam):
+            # Optional[int] -> int
+            type_champ = champ.type
+            if typing.get_origin(type_champ) is typing.Union:
+                type_champ = next(
+                    t for t in typing.get_args(type_champ) if t is not type(None)
+                )
+            if type_champ in correspondance:
+                types[champ.name] = correspondance[type_champ]
+        # exporté sous forme de texte (hebergements_display)
+        types["b11_etablissement"] = "string"
+        return types
+
+    def iterer(self, indicateurs=None):
+        """
+        Renvoie, scénario par scénario, le Dataframe de ses lignes (une par territoire) :
+        numéro et nom du scénario, champs qui varient entre scénarios, code, indicateurs
+        """
+        indicateurs = list(indicateurs or Resultat.INDICATEURS)
+        champs, valeurs = self._champs_variables()
+        for numero, (parametre, custom_parametre) in enumerate(self.scenarios):
+            resultat = self.resultat(parametre, custom_parametre)
+            if isinstance(resultat, RegionResultat):
+                frame = resultat.to_frame(indicateurs).reset_index()
+            else:
+                frame = pd.DataFrame(
+                    [{"code": resultat.code, **resultat.to_dict(indicateurs)}]
+                )
+            entete = {"scenario": numero, "nom": parametre.nom}
+            entete.update({champ: valeurs[numero].get(champ) for champ in champs})
+            yield pd.concat([pd.DataFrame([entete] * len(frame)), frame], axis=1)
+
+    def to_frame(self, indicateurs=None):
+        """
+        Renvoie un Dataframe avec une ligne par scénario et par territoire (voir iterer)
+        """
+        return pd.concat(list(self.iterer(indicateurs)), ignore_index=True)
+
+    def exporter(self, fichier, indicateurs=None, **options):
+        """
+        Écrit les lignes de to_frame dans fichier (CSV, ou Parquet si son extension est
+        .parquet) au fur et à mesure du calcul des scénarios, sans les garder en mémoire
+        (voir EcritureFlux pour les options). Les colonnes des champs de paramétrage
+        gardent le type du champ. Renvoie le nombre de lignes écrites.
+        """
+        options["types"] = {**self._types_champs(), **options.get("types", {})}
+        with EcritureFlux(fichier, **options) as ecriture:
+            for frame in self.iterer(indicateurs):
+                ecriture.ecrire(frame)
+        return ecriture.lignes